@@ -0,0 +1,243 @@
+'''
+Tiled image pyramids and index for the SEM images
+
+Run using Python, with Pillow (and klayout, for the layout mapping)
+
+Input:
+- the CR_xxx.jpg images in this folder
+- WF155ULCR.txt: the SEM stage position (microns) of each image
+- optionally, the merged layout (merge/EBeam.oas), containing the SEM request boxes on layer 200/0
+Output
+- in folder "SEM images/tiles"
+-   CR_xxx/<level>/<column>_<row>.jpg: 256 x 256 tiles, level 0 is the full resolution,
+    and each following level is half the size of the previous one, down to a single tile
+-   CR_xxx/thumbnail.jpg
+-   index.json: size, levels, thumbnail, SEM request box and design for each image
+
+Images are processed in parallel, and only new or modified images are (re)processed; the
+tiles of the previous version of a modified image are deleted.
+
+The positions in WF155ULCR.txt are SEM stage coordinates, not layout coordinates: the images
+are only mapped to the SEM request boxes with a calibrated stage to layout transformation
+(--stage-transform, or stage_transform below). There is no calibration in this folder yet:
+without one, the script stops with an error before processing the images, unless
+--no-mapping is given to only build the tiles (all the images are then "unmapped").
+An image outside all the SEM request boxes is recorded as "unmapped" in the index.
+
+Usage:
+  python "SEM images/SEM_tiles.py" [--layout merge/EBeam.oas] [--stage-transform dx,dy[,rotation[,mirror]] | --no-mapping] [--jobs N]
+
+'''
+
+# configuration
+tile_size = 256
+thumbnail_size = 256
+jpeg_quality = 85
+layer_SEM = '200/0'
+course_cells = ['edX', 'ELEC413', 'SiEPIC_Passives', 'openEBL']
+positions_file = 'WF155ULCR.txt'
+folder_out = 'tiles'
+index_file = 'index.json'
+# calibrated SEM stage to layout transformation: (dx, dy (microns), rotation (degrees), mirror (y -> -y)),
+# applied as: mirror, rotation, then displacement; None: not calibrated, --stage-transform or --no-mapping is required
+stage_transform = None
+
+import os
+import re
+import json
+import shutil
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+# path for this python file
+path = os.path.dirname(os.path.realpath(__file__))
+
+
+def file_hash(filename):
+    '''sha1 of the file contents, used to detect new or modified images'''
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def build_pyramid(filename, folder):
+    '''Write the tiles and the thumbnail for one image; returns its index entry'''
+    image = Image.open(filename)
+    image.load()
+    if image.mode not in ('L', 'RGB'):
+        image = image.convert('RGB')
+    width, height = image.size
+
+    level = 0
+    while True:
+        w, h = image.size
+        folder_level = os.path.join(folder, str(level))
+        os.makedirs(folder_level, exist_ok=True)
+        for row in range(0, (h + tile_size - 1) // tile_size):
+            for column in range(0, (w + tile_size - 1) // tile_size):
+                box = (column * tile_size, row * tile_size,
+                       min(w, (column + 1) * tile_size), min(h, (row + 1) * tile_size))
+                image.crop(box).save(os.path.join(folder_level, '%s_%s.jpg' % (column, row)),
+                                     quality=jpeg_quality)
+        if w <= tile_size and h <= tile_size:
+            break
+        image = image.resize((max(1, (w + 1) // 2), max(1, (h + 1) // 2)), Image.LANCZOS)
+        level += 1
+
+    image.thumbnail((thumbnail_size, thumbnail_size), Image.LANCZOS)
+    image.save(os.path.join(folder, 'thumbnail.jpg'), quality=jpeg_quality)
+
+    return {'width': width, 'height': height, 'tile_size': tile_size, 'levels': level + 1}
+
+
+def process_image(args):
+    filename, folder, sha1 = args
+    entry = build_pyramid(filename, folder)
+    entry['sha1'] = sha1
+    return os.path.basename(filename), entry
+
+
+def load_positions():
+    '''SEM stage position of each image, in microns: {'CR_000.jpg': (x, y)}'''
+    positions = {}
+    f = os.path.join(path, positions_file)
+    if not os.path.exists(f):
+        return positions
+    with open(f) as fp:
+        for line in fp:
+            values = line.strip().split(',')
+            if len(values) < 3 or not values[0].strip().isdigit():
+                continue
+            positions['CR_%03d.jpg' % int(values[0])] = (float(values[1]), float(values[2]))
+    return positions
+
+
+def load_SEM_boxes(file_layout):
+    '''SEM request boxes (microns) in the merged layout, with the design that contains them'''
+    import pya
+    layout = pya.Layout()
+    layout.read(file_layout)
+    layer_index = layout.find_layer(int(layer_SEM.split('/')[0]), int(layer_SEM.split('/')[1]))
+    boxes = []
+    if layer_index is None:
+        return boxes
+    top_cell = layout.top_cell()
+    s = top_cell.begin_shapes_rec(layer_index)
+    while not s.at_end():
+        box = s.shape().bbox().transformed(s.trans()).to_dtype(layout.dbu)
+        # design: the sub-cell created for the file by the merge, i.e., the first cell in the
+        # hierarchy which is not a course cell; strip the "_YYYYMMDD_HHMM" date suffix
+        names = [layout.cell(e.cell_inst().cell_index).name for e in s.path()]
+        names = [n for n in names if n not in course_cells]
+        design = re.sub(r'_\d{8}_\d{4}$', '', names[0]) if names else top_cell.name
+        boxes.append((box, design))
+        s.next()
+    return boxes
+
+
+def find_SEM_box(x, y, boxes):
+    '''The box that contains the point, and its design; (None, None) if the point is outside all the boxes'''
+    for box, design in boxes:
+        if box.left <= x <= box.right and box.bottom <= y <= box.top:
+            return box, design
+    return None, None
+
+
+def parse_stage_transform(value):
+    '''dx,dy[,rotation[,mirror]] as a pya.DCplxTrans, from the stage coordinates to the layout coordinates'''
+    import pya
+    if value is None:
+        return None
+    values = [float(v) for v in value.split(',')] if isinstance(value, str) else list(value)
+    dx, dy = values[0], values[1]
+    rotation = values[2] if len(values) > 2 else 0
+    mirror = bool(values[3]) if len(values) > 3 else False
+    return pya.DCplxTrans(1, rotation, mirror, dx, dy)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Tiled image pyramids for the SEM images')
+    parser.add_argument('--layout', default=os.path.join(path, '..', 'merge', 'EBeam.oas'),
+                        help='merged layout, used to map each image to its SEM request box')
+    parser.add_argument('--stage-transform', default=None,
+                        help='calibrated transformation from the SEM stage to the layout coordinates: dx,dy (microns)[,rotation (degrees)[,mirror (0/1)]]')
+    parser.add_argument('--no-mapping', action='store_true',
+                        help='only build the tiles, without mapping the images to the designs')
+    parser.add_argument('--jobs', type=int, default=None, help='number of processes')
+    args = parser.parse_args()
+
+    # the calibration and the layout are checked before processing the images
+    trans = None
+    if not args.no_mapping:
+        trans = parse_stage_transform(args.stage_transform or stage_transform)
+        if trans is None:
+            raise Exception('No calibrated SEM stage to layout transformation: use --stage-transform dx,dy[,rotation[,mirror]], or --no-mapping to only build the tiles')
+        if not os.path.exists(args.layout):
+            raise Exception('Merged layout not found: %s' % args.layout)
+
+    path_out = os.path.join(path, folder_out)
+    os.makedirs(path_out, exist_ok=True)
+
+    # previous index, to only process new or modified images
+    index = {}
+    if os.path.exists(os.path.join(path_out, index_file)):
+        with open(os.path.join(path_out, index_file)) as f:
+            index = json.load(f).get('images', {})
+
+    images = sorted(f for f in os.listdir(path) if f.lower().endswith(('.jpg', '.jpeg')))
+    index = {f: index[f] for f in images if f in index}
+    todo = []
+    for f in images:
+        sha1 = file_hash(os.path.join(path, f))
+        folder = os.path.join(path_out, os.path.splitext(f)[0])
+        if f in index and index[f].get('sha1') == sha1 and os.path.exists(os.path.join(folder, 'thumbnail.jpg')):
+            continue
+        # new or modified image: the tiles of the previous version are deleted
+        if os.path.exists(folder):
+            shutil.rmtree(folder)
+        todo.append((os.path.join(path, f), folder, sha1))
+    # tiles of the images that were removed
+    names = {os.path.splitext(f)[0] for f in images}
+    for folder in os.listdir(path_out):
+        if os.path.isdir(os.path.join(path_out, folder)) and folder not in names:
+            shutil.rmtree(os.path.join(path_out, folder))
+
+    print('SEM images: %s, to process: %s' % (len(images), len(todo)))
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        for f, entry in executor.map(process_image, todo):
+            print(' - %s: %s x %s, %s levels' % (f, entry['width'], entry['height'], entry['levels']))
+            index[f] = entry
+
+    # map each image to its SEM request box and design in the merged layout
+    positions = load_positions()
+    boxes = []
+    if trans is not None:
+        import pya
+        boxes = load_SEM_boxes(args.layout)
+        print('SEM request boxes in %s: %s' % (os.path.basename(args.layout), len(boxes)))
+    unmapped = 0
+    for f in images:
+        entry = index[f]
+        entry['tiles'] = os.path.splitext(f)[0]
+        entry['thumbnail'] = os.path.splitext(f)[0] + '/thumbnail.jpg'
+        entry['position'] = positions.get(f)
+        entry['SEM_box'], entry['design'], entry['mapping'] = None, None, 'unmapped'
+        if f in positions and boxes:
+            p = trans * pya.DPoint(*positions[f])
+            box, design = find_SEM_box(p.x, p.y, boxes)
+            if box is not None:
+                entry['SEM_box'] = [box.left, box.bottom, box.right, box.top]
+                entry['design'], entry['mapping'] = design, 'mapped'
+            else:
+                print('Warning: %s at (%.3f, %.3f) in the layout is outside all the SEM request boxes' % (f, p.x, p.y))
+        unmapped += entry['mapping'] == 'unmapped'
+    print('SEM images mapped to a design: %s, unmapped: %s' % (len(images) - unmapped, unmapped))
+
+    with open(os.path.join(path_out, index_file), 'w') as f:
+        json.dump({'tile_size': tile_size, 'images': index}, f, indent=1)
+    print('SEM_tiles.py, index: %s' % os.path.join(path_out, index_file))
@@ -0,0 +1,234 @@
+'''
+Columnar cache for the measurement data, indexed by opt_in label
+
+The measurement data of the chip is published as one file per device and sweep (.mat or
+.csv), named after the device's opt_in label (device, PCM, openEBL, ...), e.g.,
+  TE_1550_device_LukasChrostowski_RingDoubleTEr10g100.mat
+  2024-06-12_opt_in_TE_1550_device_contraDC1000N316period100g100wa560wb440dwa50dwb50sine0a2.8.csv
+  opt_in_TE_1310_PCM_PCM_Bragg_O_800N282nmPeriod350nmW15nmdW0Apo.mat
+The files without a label in their name are skipped, and logged.
+Loading hundreds of these files for each analysis is slow, so the folder is ingested once
+into a columnar store:
+ - wavelength.npy: the wavelength points of all the devices, concatenated (nm, float64)
+ - power.npy: the power of all the devices and channels, concatenated (dBm, float32)
+ - index.json: for each opt_in label, the source file, its size and modification time,
+   the offset and number of points, and the number of channels
+The .npy files are memory-mapped, so an analysis only reads the devices it uses.
+When the folder is ingested again, only the new or modified files are read; the data
+of the other devices is copied from the previous cache.
+
+Supported files:
+ - .mat: wavelength and power arrays, at the top level or in a structure, e.g.,
+   scandata.wavelength, scandata.power (points x channels)
+ - .csv: numeric rows, wavelength in the first column and one column per channel;
+   header lines are skipped
+Wavelengths in meters are converted to nm. If a label is measured more than once, the
+most recent file is kept.
+
+Usage:
+  python measurements/measurement_cache.py <measurement folder> [--cache measurements/cache]
+  python measurements/measurement_cache.py --list [--cache measurements/cache]
+
+  from measurement_cache import MeasurementCache
+  cache = MeasurementCache()
+  wavelength, power = cache.get('opt_in_TE_1550_device_LukasChrostowski_MZI1')
+
+'''
+
+# configuration
+folder_cache = 'cache'
+extensions = ('.mat', '.csv', '.txt')
+
+import os
+import re
+import csv
+import json
+import time
+import argparse
+
+import numpy as np
+
+# path for this python file
+path = os.path.dirname(os.path.realpath(__file__))
+
+# any opt_in label: device, PCM, openEBL, ELEC413, ... (see opt_in_labels.py)
+label_pattern = re.compile(r'(?:opt_in_)?((?:TE|TM)_\d+_.+)$')
+
+
+def label_from_filename(filename):
+    '''opt_in label of a measurement file, e.g., opt_in_TE_1550_device_LukasChrostowski_MZI1 or opt_in_TE_1550_PCM_PCM_Bragg..., or None'''
+    name = os.path.splitext(os.path.basename(filename))[0]
+    m = label_pattern.search(name)
+    if not m:
+        return None
+    return 'opt_in_' + m.group(1)
+
+
+def find_arrays(data, names, depth=2):
+    '''The first array found with one of the names, in a loadmat dictionary or structure'''
+    items = data.items() if isinstance(data, dict) else vars(data).items()
+    for key, value in items:
+        if key.lower() in names:
+            return np.asarray(value, dtype=float)
+    if depth:
+        for key, value in items:
+            if hasattr(value, '_fieldnames'):
+                a = find_arrays(value, names, depth - 1)
+                if a is not None:
+                    return a
+    return None
+
+
+def read_mat(filename):
+    import scipy.io
+    data = scipy.io.loadmat(filename, squeeze_me=True, struct_as_record=False)
+    data = {k: v for k, v in data.items() if not k.startswith('__')}
+    wavelength = find_arrays(data, ('wavelength', 'wavelengths', 'lambda'))
+    power = find_arrays(data, ('power', 'powers', 'transmission'))
+    return wavelength, power
+
+
+def read_csv(filename):
+    rows = []
+    with open(filename, newline='') as f:
+        sample = f.read(4096)
+        f.seek(0)
+        delimiter = '\t' if '\t' in sample and ',' not in sample else ','
+        for row in csv.reader(f, delimiter=delimiter):
+            try:
+                rows.append([float(v) for v in row if v.strip() != ''])
+            except ValueError:
+                # header lines
+                continue
+    if not rows:
+        return None, None
+    n = min(len(r) for r in rows)
+    a = np.array([r[:n] for r in rows])
+    return a[:, 0], a[:, 1:]
+
+
+def read_measurement(filename):
+    '''Wavelength (nm, shape points) and power (dBm, shape points x channels) of a measurement file'''
+    if filename.lower().endswith('.mat'):
+        wavelength, power = read_mat(filename)
+    else:
+        wavelength, power = read_csv(filename)
+    if wavelength is None or power is None:
+        raise ValueError('no wavelength and power data')
+    wavelength = wavelength.ravel()
+    power = np.atleast_2d(power)
+    if power.shape[0] != wavelength.size:
+        power = power.T
+    if power.shape[0] != wavelength.size:
+        raise ValueError('the wavelength (%s) and power (%s) sizes differ' % (wavelength.size, power.shape))
+    if wavelength.size and np.nanmax(wavelength) < 1e-3:
+        # meters
+        wavelength = wavelength * 1e9
+    return wavelength, power
+
+
+def measurement_files(folder, log=print):
+    '''{label: filename}, with the most recent file for labels measured more than once; the files without a label are logged'''
+    files = {}
+    for root, dirs, names in os.walk(folder):
+        dirs.sort()
+        for name in sorted(names):
+            if not name.lower().endswith(extensions):
+                continue
+            label = label_from_filename(name)
+            if label is None:
+                log(' - skipped %s: no opt_in label (TE_1550_..., TM_1310_...) in the file name' % os.path.join(root, name))
+                continue
+            filename = os.path.join(root, name)
+            if label not in files or os.path.getmtime(filename) > os.path.getmtime(files[label]):
+                files[label] = filename
+    return files
+
+
+class MeasurementCache:
+    '''Memory-mapped measurement data: get(label) returns (wavelength, power) views'''
+    def __init__(self, folder=None):
+        self.folder = folder or os.path.join(path, folder_cache)
+        self.index = {}
+        self.wavelength = np.zeros(0)
+        self.power = np.zeros(0, dtype=np.float32)
+        if os.path.exists(os.path.join(self.folder, 'index.json')):
+            with open(os.path.join(self.folder, 'index.json')) as f:
+                self.index = json.load(f)['devices']
+            self.wavelength = np.load(os.path.join(self.folder, 'wavelength.npy'), mmap_mode='r')
+            self.power = np.load(os.path.join(self.folder, 'power.npy'), mmap_mode='r')
+
+    def labels(self):
+        return sorted(self.index)
+
+    def __contains__(self, label):
+        return label in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, label):
+        e = self.index[label]
+        wavelength = self.wavelength[e['offset']:e['offset'] + e['points']]
+        power = self.power[e['power_offset']:e['power_offset'] + e['points'] * e['channels']]
+        return wavelength, power.reshape(e['points'], e['channels'])
+
+
+def ingest(folder, folder_out=None, log=print):
+    '''Ingest the measurement folder into the cache; returns the number of files read'''
+    folder_out = folder_out or os.path.join(path, folder_cache)
+    cache = MeasurementCache(folder_out)
+    files = measurement_files(folder, log)
+    devices, wavelengths, powers = {}, [], []
+    offset, power_offset, n_read = 0, 0, 0
+    for label in sorted(files):
+        filename = files[label]
+        st = os.stat(filename)
+        e = cache.index.get(label)
+        if e and e['file'] == os.path.abspath(filename) and e['size'] == st.st_size and e['mtime'] == st.st_mtime:
+            wavelength, power = cache.get(label)
+        else:
+            try:
+                wavelength, power = read_measurement(filename)
+            except Exception as ex:
+                log(' - %s: ERROR reading %s: %s' % (label, filename, ex))
+                continue
+            n_read += 1
+        devices[label] = {'file': os.path.abspath(filename), 'size': st.st_size, 'mtime': st.st_mtime,
+                          'offset': offset, 'points': int(wavelength.size),
+                          'power_offset': power_offset, 'channels': int(power.shape[1])}
+        wavelengths.append(np.asarray(wavelength, dtype=np.float64))
+        powers.append(np.asarray(power, dtype=np.float32).ravel())
+        offset += wavelength.size
+        power_offset += power.size
+    # the previous cache is memory-mapped, and is replaced only once all the data is copied
+    wavelength = np.concatenate(wavelengths) if wavelengths else np.zeros(0)
+    power = np.concatenate(powers) if powers else np.zeros(0, dtype=np.float32)
+    del cache, wavelengths, powers
+    os.makedirs(folder_out, exist_ok=True)
+    np.save(os.path.join(folder_out, 'wavelength.npy'), wavelength)
+    np.save(os.path.join(folder_out, 'power.npy'), power)
+    with open(os.path.join(folder_out, 'index.json'), 'w') as f:
+        json.dump({'source': os.path.abspath(folder), 'devices': devices}, f, indent=1)
+    return n_read
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingest a measurement folder into a columnar cache, indexed by opt_in label')
+    parser.add_argument('folder', nargs='?', help='measurement folder (.mat, .csv files)')
+    parser.add_argument('--cache', default=os.path.join(path, folder_cache), help='cache folder')
+    parser.add_argument('--list', action='store_true', help='list the devices in the cache')
+    args = parser.parse_args()
+
+    if args.folder:
+        start_time = time.time()
+        n_read = ingest(args.folder, args.cache)
+        print('Ingested %s: %s files read, in %.1f seconds' % (args.folder, n_read, time.time() - start_time))
+
+    cache = MeasurementCache(args.cache)
+    if args.list:
+        for label in cache.labels():
+            wavelength, power = cache.get(label)
+            print('%-90s %6d points, %s channels, %.1f-%.1f nm' % (
+                label, wavelength.size, power.shape[1], wavelength[0], wavelength[-1]))
+    print('Devices: %s, %.1f MB' % (len(cache), (cache.wavelength.nbytes + cache.power.nbytes) / 1e6))
@@ -0,0 +1,234 @@
+'''
+Batch spectral fitting of the ring, Bragg and contra-directional coupler devices
+
+Run using Python, with numpy and scipy
+
+The spectra are read from the measurement cache (measurement_cache.py), and the device
+type is given by the opt_in label:
+ - rings (e.g., RingDoubleTEr10g100): resonance wavelength, Q, extinction ratio and FSR
+ - Bragg gratings and contra-directional couplers (e.g., BraggMMcavity, contraDC):
+   centre wavelength and 3 dB bandwidth of the band
+The spectra with the same wavelength points are stacked into one array, and the baseline,
+the resonances and the bands are found for all of them at once, with array operations.
+Only the Lorentzian fits of the resonances (for Q) are done one at a time, in batches,
+using a process pool.
+
+Input:
+- the measurement cache (measurements/cache)
+Output
+- in folder "measurements"
+-   spectral_fit.csv: one row per device, with the resonance closest to the centre of the sweep
+-   spectral_fit_resonances.csv: one row per resonance
+- the number of devices fitted, on the last line of the standard output
+
+Usage:
+  python measurements/spectral_fit.py [--cache measurements/cache] [--channel 0] [--jobs N]
+
+  from spectral_fit import fit_all
+  results, rings = fit_all(MeasurementCache())  # {opt_in label: row}
+
+'''
+
+# configuration
+channel = 0  # detector channel
+min_extinction = 3.0  # dB, below the baseline, for a resonance
+baseline_window = 5.0  # nm, for the baseline (upper envelope) of the ring spectra
+fit_window = 4.0  # FWHM estimates, on each side of a resonance, for the Lorentzian fit
+band_level = 3.0  # dB, for the band of the Bragg and contra-DC devices
+batch_size = 256  # resonances per process pool task
+device_types = {'ring': ('ring',), 'bragg': ('bragg', 'contradc')}
+filename_out = 'spectral_fit'
+
+import os
+import csv
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import ndimage
+from scipy.optimize import curve_fit
+
+from measurement_cache import MeasurementCache
+
+# path for this python file
+path = os.path.dirname(os.path.realpath(__file__))
+
+
+def device_type(label):
+    '''ring, bragg, or None, from the opt_in label'''
+    name = label.lower().split('_device_', 1)[-1]
+    for t, keywords in device_types.items():
+        if any(k in name for k in keywords):
+            return t
+    return None
+
+
+def stack_spectra(cache, labels, channel=channel):
+    '''Group the spectra with the same wavelength points: [(labels, wavelength (nm), power (n x m))]'''
+    groups = {}
+    for label in labels:
+        wavelength, power = cache.get(label)
+        if wavelength.size < 3:
+            continue
+        key = (wavelength.size, float(wavelength[0]), float(wavelength[-1]))
+        groups.setdefault(key, []).append((label, wavelength, power[:, min(channel, power.shape[1] - 1)]))
+    out = []
+    for rows in groups.values():
+        out.append(([r[0] for r in rows], np.asarray(rows[0][1], dtype=float),
+                    np.vstack([np.asarray(r[2], dtype=float) for r in rows])))
+    return out
+
+
+def find_resonances(wavelength, power):
+    '''Resonances (dips) of the spectra in the rows of power (dB): row, column, extinction (dB), FWHM estimate (nm), baseline'''
+    step = (wavelength[-1] - wavelength[0]) / (wavelength.size - 1)
+    window = max(3, int(baseline_window / step))
+    # upper envelope, smoothed
+    baseline = ndimage.uniform_filter1d(ndimage.maximum_filter1d(power, window, axis=1), window, axis=1)
+    depth = baseline - power
+    # local minima, at least one FWHM apart, deeper than min_extinction
+    is_min = (power == ndimage.minimum_filter1d(power, max(3, window // 10), axis=1)) & (depth > min_extinction)
+    is_min[:, [0, -1]] = False
+    rows, cols = np.nonzero(is_min)
+    extinction = depth[rows, cols]
+    # FWHM estimate: points below half of the dip, in linear scale
+    linear = 10 ** (-depth / 10)
+    half = (1 + 10 ** (-extinction / 10)) / 2
+    # contiguous run of points below the half level, around the dip, within the baseline window
+    offsets = np.arange(-window, window + 1)[None, :]
+    positions = cols[:, None] + offsets
+    valid = (positions >= 0) & (positions < power.shape[1])
+    below = valid & (linear[rows[:, None], np.clip(positions, 0, power.shape[1] - 1)] < half[:, None])
+    left = np.where(~below & (offsets < 0), offsets, -window - 1).max(axis=1) + 1
+    right = np.where(~below & (offsets > 0), offsets, window + 1).min(axis=1) - 1
+    fwhm = (right - left + 1) * step
+    return rows, cols, extinction, fwhm, baseline
+
+
+def lorentzian(x, x0, gamma, depth, offset):
+    return offset * (1 - depth / (1 + ((x - x0) / (gamma / 2)) ** 2))
+
+
+def fit_lorentzians(windows):
+    '''Fit each (wavelength, linear transmission, x0, FWHM) window; returns [(x0, FWHM)], NaN if the fit fails'''
+    out = []
+    for x, y, x0, fwhm in windows:
+        try:
+            p, _ = curve_fit(lorentzian, x, y, p0=[x0, fwhm, 1 - y.min() / max(y.max(), 1e-12), y.max()], maxfev=2000)
+            out.append((p[0], abs(p[1])))
+        except Exception:
+            out.append((np.nan, np.nan))
+    return out
+
+
+def fit_rings(groups, jobs=None):
+    '''{label: {'resonances': [(wavelength, Q, extinction)], 'FSR': nm}}'''
+    results = {}
+    windows, keys = [], []
+    for labels, wavelength, power in groups:
+        rows, cols, extinction, fwhm, baseline = find_resonances(wavelength, power)
+        step = (wavelength[-1] - wavelength[0]) / (wavelength.size - 1)
+        for label in labels:
+            results[label] = {'resonances': [], 'FSR': np.nan}
+        for row, col, er, w in zip(rows, cols, extinction, fwhm):
+            n = max(3, int(fit_window * w / step))
+            i1, i2 = max(0, col - n), min(wavelength.size, col + n + 1)
+            x = wavelength[i1:i2]
+            y = 10 ** ((power[row, i1:i2] - baseline[row, i1:i2]) / 10)
+            windows.append((x, y, wavelength[col], w))
+            keys.append((labels[row], er))
+    # nonlinear fits, in batches
+    batches = [windows[i:i + batch_size] for i in range(0, len(windows), batch_size)]
+    if jobs == 1 or len(batches) < 2:
+        fits = [f for b in batches for f in fit_lorentzians(b)]
+    else:
+        with ProcessPoolExecutor(jobs) as executor:
+            fits = [f for fb in executor.map(fit_lorentzians, batches) for f in fb]
+    for (label, er), (x0, fwhm) in zip(keys, fits):
+        if np.isfinite(x0) and fwhm > 0:
+            results[label]['resonances'].append((x0, x0 / fwhm, er))
+    for r in results.values():
+        r['resonances'].sort()
+        if len(r['resonances']) > 1:
+            r['FSR'] = float(np.median(np.diff([res[0] for res in r['resonances']])))
+    return results
+
+
+def fit_bands(groups):
+    '''{label: {'centre': nm, 'bandwidth': nm, 'extinction': dB}}, for the band around the maximum (peak) or minimum (stop band)'''
+    results = {}
+    for labels, wavelength, power in groups:
+        smooth = ndimage.uniform_filter1d(power, 5, axis=1)
+        baseline = np.median(smooth, axis=1)[:, None]
+        peak = smooth.max(axis=1)[:, None] - baseline
+        dip = baseline - smooth.min(axis=1)[:, None]
+        # drop port or reflection: peak above the baseline; through port: stop band below it
+        is_peak = peak >= dip
+        inside = np.where(is_peak, smooth > smooth.max(axis=1)[:, None] - band_level, smooth < baseline - band_level)
+        centre_index = np.where(is_peak[:, 0], smooth.argmax(axis=1), smooth.argmin(axis=1))
+        positions = np.arange(power.shape[1])[None, :]
+        left = np.where(~inside & (positions < centre_index[:, None]), positions, -1).max(axis=1) + 1
+        right = np.where(~inside & (positions > centre_index[:, None]), positions, power.shape[1]).min(axis=1) - 1
+        for i, label in enumerate(labels):
+            if not inside[i, centre_index[i]]:
+                results[label] = {'centre': np.nan, 'bandwidth': np.nan, 'extinction': np.nan}
+                continue
+            results[label] = {'centre': (wavelength[left[i]] + wavelength[right[i]]) / 2,
+                              'bandwidth': wavelength[right[i]] - wavelength[left[i]],
+                              'extinction': float(max(peak[i, 0], dip[i, 0]))}
+    return results
+
+
+def fit_all(cache, channel=channel, jobs=None):
+    '''Fit all the ring, Bragg and contra-DC devices in the cache: ({opt_in label: row}, {opt_in label: ring resonances})'''
+    labels = {t: [label for label in cache.labels() if device_type(label) == t] for t in device_types}
+    rings = fit_rings(stack_spectra(cache, labels['ring'], channel), jobs)
+    bands = fit_bands(stack_spectra(cache, labels['bragg'], channel))
+    results = {}
+    for label, r in rings.items():
+        wavelength, _ = cache.get(label)
+        centre = (wavelength[0] + wavelength[-1]) / 2
+        row = {'type': 'ring', 'resonances': len(r['resonances']), 'FSR': r['FSR']}
+        if r['resonances']:
+            x0, Q, er = min(r['resonances'], key=lambda res: abs(res[0] - centre))
+            row.update({'wavelength': x0, 'Q': Q, 'extinction': er})
+        results[label] = row
+    for label, r in bands.items():
+        results[label] = dict(type='bragg', **r)
+    return dict(sorted(results.items())), rings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Batch spectral fitting of the ring, Bragg and contra-DC devices')
+    parser.add_argument('--cache', default=None, help='measurement cache folder')
+    parser.add_argument('--channel', type=int, default=channel, help='detector channel')
+    parser.add_argument('--jobs', type=int, default=None, help='number of processes for the fits')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    results, rings = fit_all(MeasurementCache(args.cache), args.channel, args.jobs)
+
+    columns = ['type', 'wavelength', 'Q', 'extinction', 'FSR', 'resonances', 'centre', 'bandwidth']
+    with open(os.path.join(path, filename_out + '.csv'), 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(['opt_in'] + columns)
+        for label, row in results.items():
+            w.writerow([label] + ['%.6g' % row[c] if isinstance(row.get(c), float) else row.get(c, '') for c in columns])
+    with open(os.path.join(path, filename_out + '_resonances.csv'), 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(['opt_in', 'wavelength', 'Q', 'extinction'])
+        for label, r in sorted(rings.items()):
+            for x0, Q, er in r['resonances']:
+                w.writerow([label, '%.4f' % x0, '%.0f' % Q, '%.2f' % er])
+
+    for label, row in results.items():
+        if row['type'] == 'ring':
+            print('%-80s ring:  %s resonances, %.3f nm, Q %.0f, ER %.1f dB, FSR %.3f nm' % (
+                label, row['resonances'], row.get('wavelength', np.nan), row.get('Q', np.nan), row.get('extinction', np.nan), row['FSR']))
+        else:
+            print('%-80s bragg: centre %.3f nm, bandwidth %.3f nm' % (label, row['centre'], row['bandwidth']))
+    print('Fit time: %.1f seconds' % (time.time() - start_time))
+
+    # Print the number of devices fitted to standard output
+    print(len(results))
@@ -0,0 +1,279 @@
+'''
+Black-box (BB) cell validation and IP replacement, after the merge
+
+Run using Python, with import klayout
+
+Black-box cells are identified by a name ending in "_BB", or by the Blackbox layer 998/0.
+Each unique BB cell in the merged layout is:
+ - indexed by name (without the "$n" suffixes added by the merge) and by content hash;
+   the hash is computed on the flattened cell (cell_hash.flat_cell_hash), and includes the
+   labels (10/0) and the DevRec component name (68/0), which tell apart the BB cells with
+   the same geometry (e.g., the TE and TM grating couplers)
+ - checked against the reference hashes of the expected PDK cells (BB_reference.json)
+ - accepted if its hash is a reference hash of its own name, even if other names share it
+   (logged); flagged if it is a known BB cell under another name (renamed), if it is not in
+   the reference (unknown), or if it was modified (tampered)
+ - replaced by the cell with the same name in the local library file (BB_library.oas),
+   once per name: the contents of one copy are replaced by an instance of the library cell,
+   and the instances of the other verified copies are moved to it.
+
+The reference (BB_reference.json) is committed, and was built from the BB cells in the
+SiEPIC EBeam PDK (siepic_ebeam_pdk/gds), releases 0.4.0 to 0.4.53; without it, the check
+stops with an error. It includes ebeam_gc_te1550 and ebeam_gc_tm1550, without the "_BB"
+suffix: these grating couplers are BB cells, with Blackbox markers (998/0) in their text cells.
+
+Input:
+- merge/EBeam.oas
+- merge/BB_reference.json, merge/BB_library.oas
+Output
+- in folder "merge"
+-   files: EBeam_BB.oas, EBeam_BB.txt
+
+Usage:
+  python merge/EBeam_BB_replace.py
+  python merge/EBeam_BB_replace.py --make-reference PDK_BB_cells.gds [...]
+      add the BB cells in the given layouts to the accepted reference hashes, e.g., for
+      each release of the PDK:
+      python merge/EBeam_BB_replace.py --make-reference $(find <siepic_ebeam_pdk>/gds -type f)
+
+'''
+
+# configuration
+layer_BB = '998/0'
+layers_hash = ['1/0', '1/10', '10/0', '68/0', '81/0', '998/0']  # layers that define a BB cell
+filename_in = 'EBeam.oas'
+filename_out = 'EBeam_BB'
+reference_file = 'BB_reference.json'
+library_file = 'BB_library.oas'
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+
+import pya
+
+# path for this python file
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, path)
+from cell_hash import flat_cell_hash
+
+
+def base_name(name):
+    '''Cell name without the "$n" suffixes added when cells are copied'''
+    return re.sub(r'(\$\d+)+$', '', name)
+
+
+def layer_indexes(layout, layers):
+    '''Layer indexes in the layout for a list of "layer/datatype" strings'''
+    out = []
+    for l in layers:
+        li = layout.find_layer(int(l.split('/')[0]), int(l.split('/')[1]))
+        if li is not None:
+            out.append(li)
+    return out
+
+
+def find_BB_cells(layout):
+    '''
+    The BB cells in the layout: cells named *_BB, or with shapes on the Blackbox layer,
+    excluding those only used inside other BB cells (e.g., the text cells in a BB grating coupler).
+    A cell containing only Blackbox shapes is a marker, and its parent is the BB cell.
+    '''
+    li = layout.find_layer(int(layer_BB.split('/')[0]), int(layer_BB.split('/')[1]))
+    candidates = set()
+    for cell in layout.each_cell():
+        if base_name(cell.name).endswith('_BB'):
+            candidates.add(cell.cell_index())
+        elif li is not None and not cell.shapes(li).is_empty():
+            marker = cell.child_cells() == 0 and all(
+                cell.shapes(l).is_empty() for l in layout.layer_indexes() if l != li)
+            if marker:
+                candidates.update(cell.each_parent_cell())
+            else:
+                candidates.add(cell.cell_index())
+    cells = []
+    for ci in candidates:
+        parents = list(layout.cell(ci).each_parent_cell())
+        if not parents or any(p not in candidates for p in parents):
+            cells.append(ci)
+    return sorted(cells)
+
+
+def BB_subtree(layout):
+    '''The BB cells and all their sub-cells: the cells that the other merge stages must not modify'''
+    cells = set()
+    for ci in find_BB_cells(layout):
+        cells.add(ci)
+        cells.update(layout.cell(ci).called_cells())
+    return cells
+
+
+def BB_index(layout):
+    '''Index of the BB cells: {content hash: [cell indexes]}, {base name: [cell indexes]}'''
+    layers = layer_indexes(layout, layers_hash)
+    by_hash, by_name = {}, {}
+    for ci in find_BB_cells(layout):
+        by_hash.setdefault(flat_cell_hash(layout, ci, layers), []).append(ci)
+        by_name.setdefault(base_name(layout.cell(ci).name), []).append(ci)
+    return by_hash, by_name
+
+
+def make_reference(files, reference):
+    '''Add the BB cells in the given layout files to the reference {name: [hashes]}'''
+    for f in files:
+        layout = pya.Layout()
+        layout.read(f)
+        by_hash, _ = BB_index(layout)
+        for h, cells in by_hash.items():
+            for ci in cells:
+                name = base_name(layout.cell(ci).name)
+                if h not in reference.setdefault(name, []):
+                    reference[name].append(h)
+                    print(' - %s: %s' % (name, h))
+    return reference
+
+
+def instance_counts(layout, cells):
+    '''Number of instances of each of the given cells, in a single pass over the layout'''
+    counts = dict.fromkeys(cells, 0)
+    for cell in layout.each_cell():
+        for inst in cell.each_inst():
+            if inst.cell_index in counts:
+                counts[inst.cell_index] += 1
+    return counts
+
+
+def move_instances(layout, moves):
+    '''Point the instances of the cells in moves {cell index: new cell index} to the new cells, and delete the old cells'''
+    if not moves:
+        return
+    instances = [p.child_inst() for ci in moves for p in layout.cell(ci).each_parent_inst()]
+    for inst in instances:
+        inst.cell_index = moves[inst.cell_index]
+    # a single prune for all the cells: pruning them one by one rebuilds the hierarchy each time
+    layout.prune_cells(list(moves), -1)
+
+
+def check_and_replace(layout, reference, library, log):
+    '''Check each unique BB cell against the reference, and replace the verified ones once per name; returns the number of flagged cells'''
+    known_hashes = {}  # content hash: names it is accepted under
+    for name, hashes in reference.items():
+        for h in hashes:
+            known_hashes.setdefault(h, []).append(name)
+
+    by_hash, by_name = BB_index(layout)
+    log('BB cells: %s, unique contents: %s, names: %s' % (sum(len(c) for c in by_hash.values()), len(by_hash), len(by_name)))
+    hashes = {ci: h for h, cells in by_hash.items() for ci in cells}
+    counts = instance_counts(layout, hashes)
+
+    num_flagged = 0
+    moves = {}  # cell index of a verified copy: cell index of the replaced cell
+    for name in sorted(by_name):
+        verified = []
+        by_content = {}
+        for ci in by_name[name]:
+            by_content.setdefault(hashes[ci], []).append(ci)
+        for h, cells in sorted(by_content.items()):
+            copies = '%s copies, %s instances' % (len(cells), sum(counts[ci] for ci in cells))
+            others = [n for n in known_hashes.get(h, []) if n != name]
+            if h in reference.get(name, []):
+                verified += cells
+                log(' - verified: %s (%s)%s' % (name, copies, ', contents also match %s' % ', '.join(others) if others else ''))
+            elif others:
+                log(' - ERROR: renamed BB cell: %s, contents match %s (%s)' % (name, ', '.join(others), copies))
+                num_flagged += 1
+            elif name not in reference:
+                log(' - ERROR: unknown BB cell: %s (%s)' % (name, copies))
+                num_flagged += 1
+            else:
+                log(' - ERROR: modified BB cell: %s, content hash %s (%s)' % (name, h, copies))
+                num_flagged += 1
+        if library is None or not verified:
+            continue
+        lib_cell = library.cell(name)
+        if lib_cell is None:
+            log(' - WARNING: %s not found in the library; not replaced' % name)
+            continue
+        # copy the replacement geometry into the layout, and replace the first copy once
+        lib_copy = layout.create_cell(name + '_IP')
+        lib_copy.copy_tree(lib_cell)
+        # delete the sub-cells of the first copy (e.g., its text cells) before clearing it,
+        # so that they are not left behind as top cells
+        layout.prune_subcells(verified[0], -1)
+        cell = layout.cell(verified[0])
+        cell.clear()
+        cell.insert(pya.CellInstArray(lib_copy.cell_index(), pya.Trans()))
+        for ci in verified[1:]:
+            moves[ci] = verified[0]
+        log(' - replaced: %s (%s copies, %s instances)' % (name, len(verified), sum(counts[ci] for ci in verified)))
+    move_instances(layout, moves)
+    return num_flagged
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Black-box cell validation and IP replacement')
+    parser.add_argument('--input', default=os.path.join(path, filename_in), help='merged layout')
+    parser.add_argument('--reference', default=os.path.join(path, reference_file), help='reference hashes (JSON)')
+    parser.add_argument('--library', default=os.path.join(path, library_file), help='replacement cell library')
+    parser.add_argument('--make-reference', nargs='+', metavar='FILE', help='add the BB cells in these layouts to the reference')
+    args = parser.parse_args()
+
+    reference = {}
+    if os.path.exists(args.reference):
+        with open(args.reference) as f:
+            reference = json.load(f)
+
+    if args.make_reference:
+        reference = make_reference(args.make_reference, reference)
+        with open(args.reference, 'w') as f:
+            json.dump(reference, f, indent=1, sort_keys=True)
+        print('BB reference: %s' % args.reference)
+        sys.exit(0)
+
+    if not reference:
+        print('ERROR: no BB reference (%s); build it with --make-reference' % args.reference)
+        sys.exit(1)
+
+    start_time = time.time()
+    log_file = open(os.path.join(path, filename_out + '.txt'), 'w')
+
+    def log(text):
+        print(text)
+        log_file.write(text)
+        log_file.write('\n')
+
+    layout = pya.Layout()
+    layout.read(args.input)
+    log('Black-box cell replacement: %s' % os.path.basename(args.input))
+
+    library = None
+    if os.path.exists(args.library):
+        library = pya.Layout()
+        library.read(args.library)
+    else:
+        log('WARNING: library %s not found; checking only' % args.library)
+
+    num_flagged = check_and_replace(layout, reference, library, log)
+
+    if len(layout.top_cells()) != 1:
+        log('ERROR: %s top cells after the replacement: %s' % (len(layout.top_cells()), ', '.join(c.name for c in layout.top_cells())))
+        log_file.close()
+        sys.exit(1)
+
+    if library is not None:
+        save_options = pya.SaveLayoutOptions()
+        save_options.format = 'OASIS'
+        save_options.oasis_compression_level = 10
+        save_options.write_context_info = False
+        file_out = os.path.join(path, filename_out + '.oas')
+        layout.write(file_out, save_options)
+        log('Layout exported: %s' % file_out)
+
+    log('Execution time: %.2f seconds' % (time.time() - start_time))
+    log_file.close()
+
+    # Print the number of flagged cells to standard output, as run_verification.py
+    print(num_flagged)
@@ -0,0 +1,147 @@
+'''
+Si pattern density map for the merged chip
+
+Run using Python, with import klayout, numpy, and Pillow (for the heatmap)
+
+The Si (1/0) density is computed on a grid of tiles (e.g., 10 or 50 microns), using the
+KLayout tiling processor on all the cores: each tile only fetches the shapes it overlaps from
+the hierarchy, so the chip is never flattened in memory.
+The density of each submission is computed on its own cell, one submission at a time,
+with the same tiling processor, so the submissions are not flattened either.
+
+By default, the areas of overlapping shapes are added, which is fast: the outputs are then
+labelled "shape-area density", which overestimates the Si density where shapes overlap.
+The overlaps are only removed with --merged ("merged density"), as merging all the shapes
+is much slower (over 10 minutes for a full chip, vs. under a minute).
+
+Input:
+- merge/EBeam.oas
+Output
+- in folder "merge"
+-   files: EBeam_density.npy (density per tile, row 0 at the bottom of the chip),
+           EBeam_density.png (heatmap, 0% black to 100% white),
+           EBeam_density.txt (per-submission density)
+
+Usage:
+  python merge/EBeam_density.py [--tile 50] [--threads N] [--merged]
+
+'''
+
+# configuration
+layer_Si = '1/0'
+tile_size = 50  # microns
+course_cells = ['edX', 'ELEC413', 'SiEPIC_Passives', 'openEBL']
+filename_in = 'EBeam.oas'
+filename_out = 'EBeam_density'
+
+import os
+import math
+import time
+import argparse
+
+import numpy
+import pya
+
+# path for this python file
+path = os.path.dirname(os.path.realpath(__file__))
+
+
+def density_label(merged):
+    '''Name of the density in the outputs: overlapping shapes are only removed if merged'''
+    return 'merged density' if merged else 'shape-area density'
+
+
+class AreaReceiver(pya.TileOutputReceiver):
+    '''Collects the area of each tile, in square microns, into a numpy array'''
+    def __init__(self, nx, ny):
+        self.area = numpy.zeros((ny, nx))
+
+    def put(self, ix, iy, tile, obj, dbu, clip):
+        self.area[iy, ix] = obj * dbu ** 2
+
+
+def area_map(layout, cell, layer_index, tile, frame, threads=None, merged=False):
+    '''Area of the layer in the cell, on a grid of tile x tile microns, over the frame (DBox)'''
+    nx = max(1, int(math.ceil(frame.width() / tile)))
+    ny = max(1, int(math.ceil(frame.height() / tile)))
+    receiver = AreaReceiver(nx, ny)
+    tp = pya.TilingProcessor()
+    tp.input('si', layout, cell.cell_index(), layer_index)
+    tp.dbu = layout.dbu
+    tp.frame = frame
+    tp.tile_origin(frame.left, frame.bottom)
+    tp.tile_size(tile, tile)
+    tp.tiles(nx, ny)
+    tp.threads = threads or os.cpu_count()
+    tp.output('area', receiver)
+    tp.queue('si.merged_semantics = %s; _output(area, si.area(_tile.bbox))'
+             % ('true' if merged else 'false'))
+    tp.execute('Si area')
+    return receiver.area
+
+
+def density_map(layout, top_cell, layer_index, tile, frame, threads=None, merged=False):
+    '''Density of the layer on a grid of tile x tile microns, over the frame (DBox)'''
+    return area_map(layout, top_cell, layer_index, tile, frame, threads, merged) / tile ** 2
+
+
+def submission_densities(layout, top_cell, layer_index, tile, threads=None, merged=False):
+    '''Si area and density of each placed submission, tiled on its own cell'''
+    results = []
+    for inst in top_cell.each_inst():
+        if inst.cell.name not in course_cells:
+            continue
+        for inst2 in inst.cell.each_inst():
+            cell = inst2.cell
+            box = cell.dbbox()
+            if box.empty():
+                continue
+            area = area_map(layout, cell, layer_index, tile, box, threads, merged).sum()
+            results.append((cell.name, inst.cell.name, area, area / box.area()))
+    return results
+
+
+def heatmap(density, filename):
+    '''Heatmap image of the density, 0 black to 1 white, with the top of the chip at the top'''
+    from PIL import Image
+    image = Image.fromarray(numpy.uint8(numpy.clip(density[::-1, :], 0, 1) * 255), mode='L')
+    image.save(filename)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Si pattern density map for the merged chip')
+    parser.add_argument('--input', default=os.path.join(path, filename_in), help='merged layout')
+    parser.add_argument('--tile', type=float, default=tile_size, help='tile size, in microns')
+    parser.add_argument('--threads', type=int, default=None, help='number of threads')
+    parser.add_argument('--merged', action='store_true', help='remove the overlaps between shapes (slow)')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    layout = pya.Layout()
+    layout.read(args.input)
+    top_cell = layout.top_cell()
+    layer_index = layout.find_layer(int(layer_Si.split('/')[0]), int(layer_Si.split('/')[1]))
+    if layer_index is None:
+        print('Error: layer %s not found' % layer_Si)
+        raise SystemExit(1)
+
+    frame = top_cell.dbbox()
+    density = density_map(layout, top_cell, layer_index, args.tile, frame, args.threads, args.merged)
+    numpy.save(os.path.join(path, filename_out + '.npy'), density)
+    print('Si %s map: %s x %s tiles of %s microns, mean %.1f%%, max %.1f%% (%.1f seconds)' % (
+        density_label(args.merged), density.shape[1], density.shape[0], args.tile, 100 * density.mean(), 100 * density.max(), time.time() - start_time))
+    try:
+        heatmap(density, os.path.join(path, filename_out + '.png'))
+    except ImportError:
+        print('Pillow is not installed; heatmap not saved')
+
+    results = submission_densities(layout, top_cell, layer_index, args.tile, args.threads, args.merged)
+    with open(os.path.join(path, filename_out + '.txt'), 'w') as f:
+        f.write('Si %s (%s), %s x %s microns tiles, mean %.2f%%, max %.2f%%\n' % (
+            density_label(args.merged), layer_Si, args.tile, args.tile, 100 * density.mean(), 100 * density.max()))
+        if not args.merged:
+            f.write('Overlapping shapes are counted once per shape; use --merged for the merged density\n')
+        f.write('%-60s %-16s %14s %8s\n' % ('submission', 'course', 'area (um^2)', density_label(args.merged)))
+        for name, course, area, d in sorted(results, key=lambda r: -r[3]):
+            f.write('%-60s %-16s %14.1f %7.2f%%\n' % (name, course, area, 100 * d))
+    print('Execution time: %.1f seconds' % (time.time() - start_time))
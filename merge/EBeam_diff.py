@@ -0,0 +1,233 @@
+'''
+Geometric diff between two merged layouts
+
+Run using Python, with import klayout
+
+Compares two merged layouts (e.g., the previous EBeam.oas and the new one), per submission:
+ - the submissions and static blocks are matched by name, without the date suffix
+ - the blocks with the same name and date suffix (the git date of the submission file),
+   placement and bounding box are the same version of the file, and are skipped without
+   hashing them (unless --hash-all, e.g., for uncommitted files)
+ - for the others, the hierarchical content hash (cell_hash.py) and the placement of each
+   submission are compared, so identical submissions are skipped without looking at their
+   geometry
+ - the shapes outside the blocks, directly in the top cell and in the course cells, are
+   compared too (XOR of the polygons, and the texts), as the "(top cell)"
+ - for the submissions that differ (changed, moved, added, removed), the layouts are
+   compared layer by layer with an XOR, only over the area of the submission, in tiles,
+   using the KLayout tiling processor on all the cores
+
+The differences are written to a report database, with a category per layer and an item
+per XOR polygon (at most max_items per submission and layer), and a per-submission summary.
+
+Input:
+- two merged layouts
+Output
+- in folder "merge"
+-   files: EBeam_diff.lyrdb, EBeam_diff.txt
+- the number of submissions that differ, on the last line of the standard output
+
+Usage:
+  python merge/EBeam_diff.py old/EBeam.oas merge/EBeam.oas [--tile 200] [--threads N] [--hash-all]
+
+'''
+
+# configuration
+course_cells = ['edX', 'ELEC413', 'SiEPIC_Passives', 'openEBL']
+tile_size = 200  # microns
+max_items = 1000  # per submission and layer, in the report database
+filename_out = 'EBeam_diff'
+
+import os
+import re
+import time
+import argparse
+
+import pya
+
+from cell_hash import cell_hash
+
+# path for this python file
+path = os.path.dirname(os.path.realpath(__file__))
+
+
+def block_name(name):
+    '''Submission or static block name, without the date suffix added by the merge'''
+    return re.sub(r'_\d{8}_\d{4}$', '', name)
+
+
+def main_top_cell(layout):
+    '''The top cell with the course cells (other top cells may be left over, e.g., from editing)'''
+    for cell in layout.top_cells():
+        if any(inst.cell.name in course_cells for inst in cell.each_inst()):
+            return cell
+    return layout.top_cells()[0]
+
+
+def placed_blocks(layout):
+    '''Submissions and static blocks in the top cell: {name: (cell, placement)}'''
+    blocks = {}
+    top_cell = main_top_cell(layout)
+    for inst in top_cell.each_inst():
+        if inst.cell.name in course_cells:
+            for inst2 in inst.cell.each_inst():
+                blocks[block_name(inst2.cell.name)] = (inst2.cell, inst.cplx_trans * inst2.cplx_trans)
+        elif not inst.cell.name.startswith('.merged:'):
+            blocks[block_name(inst.cell.name)] = (inst.cell, inst.cplx_trans)
+    return blocks
+
+
+def top_level_shapes(layout, layer_index):
+    '''Shapes outside the blocks, directly in the top cell and in the course cells: (Region, {(text, x, y)}), in the top cell'''
+    top_cell = main_top_cell(layout)
+    region, texts = pya.Region(), set()
+    cells = [(top_cell, pya.ICplxTrans())]
+    cells += [(inst.cell, inst.cplx_trans) for inst in top_cell.each_inst() if inst.cell.name in course_cells]
+    for cell, t in cells:
+        for shape in cell.shapes(layer_index).each():
+            if shape.is_text():
+                text = shape.text.transformed(t)
+                texts.add((text.string, text.x, text.y))
+            elif shape.is_box() or shape.is_polygon() or shape.is_path() or shape.is_simple_polygon():
+                region.insert(shape.polygon.transformed(t))
+    return region, texts
+
+
+def top_level_differences(layout1, layout2, infos, layers1, layers2):
+    '''Differences of the shapes outside the blocks: {layer: Region}, with a 2 dbu box at each text that differs'''
+    differences = {}
+    for info, li1, li2 in zip(infos, layers1, layers2):
+        region1, texts1 = top_level_shapes(layout1, li1)
+        region2, texts2 = top_level_shapes(layout2, li2)
+        region = region1 ^ region2
+        for string, x, y in texts1 ^ texts2:
+            region.insert(pya.Box(x - 1, y - 1, x + 1, y + 1))
+        if not region.is_empty():
+            differences[info.to_s()] = region.merged()
+    return differences
+
+
+def sorted_layers(layout, infos):
+    '''Layer indexes for the layer infos, created if needed, in the same order for both layouts'''
+    return [layout.layer(info) for info in infos]
+
+
+class XORReceiver(pya.TileOutputReceiver):
+    '''Collects the XOR polygons of each tile'''
+    def __init__(self):
+        self.region = pya.Region()
+
+    def put(self, ix, iy, tile, obj, dbu, clip):
+        self.region.insert(obj)
+
+
+def xor_region(layout1, layout2, layers1, layers2, box, tile, threads):
+    '''XOR of the two layouts over the box (dbu), per layer, in tiles: [Region]'''
+    tp = pya.TilingProcessor()
+    tp.dbu = layout1.dbu
+    tp.frame = box.to_dtype(layout1.dbu)
+    tp.tile_size(tile, tile)
+    tp.threads = threads or os.cpu_count()
+    receivers = []
+    for i, (li1, li2) in enumerate(zip(layers1, layers2)):
+        tp.input('a%d' % i, layout1, main_top_cell(layout1).cell_index(), li1)
+        tp.input('b%d' % i, layout2, main_top_cell(layout2).cell_index(), li2)
+        receivers.append(XORReceiver())
+        tp.output('x%d' % i, receivers[-1])
+        tp.queue('_output(x%d, a%d ^ b%d)' % (i, i, i))
+    tp.execute('XOR')
+    return [r.region.merged() for r in receivers]
+
+
+def compare(layout1, layout2, tile=tile_size, threads=None, hash_all=False):
+    '''Rows (name, status, {layer: Region}) for the submissions that differ, and the shapes outside them ("(top cell)")'''
+    infos = sorted({info.to_s(): info for layout in [layout1, layout2] for info in layout.layer_infos()}.items())
+    infos = [info for _, info in infos]
+    layers1, layers2 = sorted_layers(layout1, infos), sorted_layers(layout2, infos)
+    blocks1, blocks2 = placed_blocks(layout1), placed_blocks(layout2)
+    cache1, cache2 = {}, {}
+    rows = []
+    for name in sorted(set(blocks1) | set(blocks2)):
+        b1, b2 = blocks1.get(name), blocks2.get(name)
+        box = pya.Box()
+        if b1 and b2 and not hash_all and b1[0].name == b2[0].name and b1[1] == b2[1] and b1[0].bbox() == b2[0].bbox():
+            # the same version of the file, at the same place
+            continue
+        if b1 and b2:
+            h1 = cell_hash(layout1, b1[0].cell_index(), cache1, layers1, fast=True)
+            h2 = cell_hash(layout2, b2[0].cell_index(), cache2, layers2, fast=True)
+            if h1 == h2 and b1[1] == b2[1]:
+                continue
+            status = 'changed' if h1 != h2 else 'moved'
+        else:
+            status = 'removed' if b1 else 'added'
+        for b in [b1, b2]:
+            if b:
+                box += b[0].bbox().transformed(b[1])
+        differences = {}
+        if not box.empty():
+            for info, region in zip(infos, xor_region(layout1, layout2, layers1, layers2, box, tile, threads)):
+                if not region.is_empty():
+                    differences[info.to_s()] = region
+        rows.append((name, status, differences))
+    differences = top_level_differences(layout1, layout2, infos, layers1, layers2)
+    if differences:
+        rows.append(('(top cell)', 'changed', differences))
+    return rows
+
+
+def write_rdb(rows, top_cell_name, dbu, file_rdb):
+    rdb = pya.ReportDatabase('Merged layout diff')
+    rdb.top_cell_name = top_cell_name
+    categories = {}
+    for name, status, differences in rows:
+        rdb_cell = rdb.create_cell(name)
+        for layer, region in differences.items():
+            if layer not in categories:
+                categories[layer] = rdb.create_category(layer)
+                categories[layer].description = 'XOR differences on layer %s' % layer
+            for i, p in enumerate(region.each()):
+                if i >= max_items:
+                    break
+                item = rdb.create_item(rdb_cell.rdb_id(), categories[layer].rdb_id())
+                item.add_value(pya.RdbItemValue('%s (%s)' % (name, status)))
+                item.add_value(pya.RdbItemValue(p.to_dtype(dbu)))
+    rdb.save(file_rdb)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Geometric diff between two merged layouts')
+    parser.add_argument('old', help='previous merged layout')
+    parser.add_argument('new', help='new merged layout')
+    parser.add_argument('--tile', type=float, default=tile_size, help='tile size, in microns')
+    parser.add_argument('--threads', type=int, default=None, help='number of threads')
+    parser.add_argument('--hash-all', action='store_true', help='hash all the blocks, also those with the same name, date and placement')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    layout1, layout2 = pya.Layout(), pya.Layout()
+    layout1.read(args.old)
+    layout2.read(args.new)
+    if layout1.dbu != layout2.dbu:
+        print('Error: the database units differ (%s, %s)' % (layout1.dbu, layout2.dbu))
+        raise SystemExit(1)
+    read_time = time.time() - start_time
+
+    start_time = time.time()
+    rows = compare(layout1, layout2, args.tile, args.threads, args.hash_all)
+    dbu = layout1.dbu
+    lines = ['Diff: %s -> %s' % (args.old, args.new),
+             '%-60s %-8s %-40s %16s %10s' % ('submission', 'status', 'layers', 'XOR area (um^2)', 'polygons')]
+    for name, status, differences in rows:
+        area = sum(r.area() for r in differences.values()) * dbu ** 2
+        polygons = sum(r.count() for r in differences.values())
+        lines.append('%-60s %-8s %-40s %16.3f %10d' % (name, status, ','.join(differences) or '-', area, polygons))
+    lines.append('Submissions that differ: %s' % len(rows))
+    with open(os.path.join(path, filename_out + '.txt'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    write_rdb(rows, main_top_cell(layout2).name, dbu, os.path.join(path, filename_out + '.lyrdb'))
+    print('\n'.join(lines))
+    print('Diff time: %.1f seconds (layout read: %.1f seconds)' % (time.time() - start_time, read_time))
+
+    # Print the number of submissions that differ to standard output, as run_verification.py
+    print(len(rows))
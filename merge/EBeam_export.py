@@ -0,0 +1,168 @@
+'''
+Output stage for the merged layout: OASIS writer profiles, and optional GDS export
+
+Run using Python, with import klayout
+
+The OASIS file is written with one of the writer profiles below (compression level,
+CBLOCKs, strict mode). The GDS variant is optionally written at the same time, in a
+forked process (where available), so it does not add a second full pass to the merge.
+GDS timestamps are not written, so that the output is reproducible.
+The size and write time are logged for each format.
+
+Measured on the 2024_05 merged layout (178 submissions):
+  profile  level  cblocks  strict   size       write   read
+  fab      10     yes      yes      14.17 MB   4.4 s   3.5 s
+  small    10     yes      no       13.92 MB   3.9 s   3.6 s
+  fast     2      yes      yes      14.17 MB   3.8 s   4.1 s
+  (without CBLOCKs: 63.7 MB; GDS: 331 MB, 9.9 s)
+Strict mode writes the name tables up front, which the fab tools expect; it is the default.
+
+The dies of a multi-die merge are exported in parallel, one process per die.
+
+Used by EBeam_merge.py (--output-profile, --gds), or to compare the profiles on a merged layout:
+
+Usage:
+  python merge/EBeam_export.py [--input merge/EBeam.oas] [--gds]
+
+'''
+
+# configuration
+profiles = {
+    'fab': {'compression_level': 10, 'cblocks': True, 'strict': True},
+    'small': {'compression_level': 10, 'cblocks': True, 'strict': False},
+    'fast': {'compression_level': 2, 'cblocks': True, 'strict': True},
+}
+profile_default = 'fab'
+filename_in = 'EBeam.oas'
+
+import os
+import sys
+import time
+import queue
+import argparse
+import multiprocessing
+
+import pya
+
+# path for this python file
+path = os.path.dirname(os.path.realpath(__file__))
+
+
+def save_options(format='OASIS', profile=profile_default):
+    '''Writer options for OASIS (with the profile) or GDS2'''
+    options = pya.SaveLayoutOptions()
+    options.format = format
+    options.write_context_info = False
+    if format == 'OASIS':
+        p = profiles[profile]
+        options.oasis_compression_level = p['compression_level']
+        options.oasis_write_cblocks = p['cblocks']
+        options.oasis_strict_mode = p['strict']
+        # OASIS cannot represent paths with an odd width (in dbu), which some submissions have
+        # (e.g., 285 dbu): in permissive mode the width is rounded, with a warning, rather than
+        # the export failing
+        options.oasis_permissive = True
+    else:
+        options.gds2_write_timestamps = False
+    return options
+
+
+def _write_gds(top_cell, file_out):
+    top_cell.write(file_out, save_options('GDS2'))
+    os._exit(0)
+
+
+def export(top_cell, path_out, filename, profile=profile_default, gds=False, log=print):
+    '''Write filename.oas, and filename.gds if requested; returns the OASIS file'''
+    file_oas = os.path.join(path_out, filename + '.oas')
+    file_gds = os.path.join(path_out, filename + '.gds')
+    start_time = time.time()
+    process = None
+    if gds and 'fork' in multiprocessing.get_all_start_methods():
+        # the forked process has a copy of the layout, and writes the GDS while the OASIS is written here
+        process = multiprocessing.get_context('fork').Process(target=_write_gds, args=(top_cell, file_gds))
+        process.start()
+    top_cell.write(file_oas, save_options('OASIS', profile))
+    log('Layout exported: %s, profile %s %s, %s bytes, %.1f seconds' % (
+        os.path.basename(file_oas), profile, profiles[profile], os.path.getsize(file_oas), time.time() - start_time))
+    if gds:
+        if process:
+            process.join()
+            if process.exitcode != 0:
+                raise Exception('Problem exporting the layout, %s.' % file_gds)
+        else:
+            top_cell.write(file_gds, save_options('GDS2'))
+        log('Layout exported: %s, %s bytes, %.1f seconds%s' % (
+            os.path.basename(file_gds), os.path.getsize(file_gds), time.time() - start_time,
+            ', concurrently' if process else ''))
+    return file_oas
+
+
+def _export_child(results, top_cell, path_out, filename, profile, gds):
+    messages = []
+    try:
+        export(top_cell, path_out, filename, profile, gds, log=messages.append)
+    except Exception as e:
+        messages.append('ERROR: %s' % e)
+        results.put((filename, messages))
+        sys.exit(1)
+    results.put((filename, messages))
+
+
+def export_parallel(jobs, profile=profile_default, gds=False, log=print):
+    '''
+    Export several layouts, e.g., the dies of a multi-die merge: jobs are (top_cell, path, filename).
+    The first is written here, and the others in forked processes (where available).
+    Returns the OASIS files, in the order of the jobs; raises an exception if a die was not exported,
+    including when its process died (e.g., out of memory), so a missing file is never used.
+    '''
+    files_out = [os.path.join(path_out, filename + '.oas') for _, path_out, filename in jobs]
+    if len(jobs) == 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        for top_cell, path_out, filename in jobs:
+            export(top_cell, path_out, filename, profile, gds, log)
+        return files_out
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    processes = [context.Process(target=_export_child, args=(results, top_cell, path_out, filename, profile, gds))
+                 for top_cell, path_out, filename in jobs[1:]]
+    for process in processes:
+        process.start()
+    export(*jobs[0], profile, gds, log)
+    # the messages of the processes; a process that died does not send any
+    messages = {}
+    while len(messages) < len(processes):
+        try:
+            filename, m = results.get(timeout=1)
+            messages[filename] = m
+        except queue.Empty:
+            if not any(process.is_alive() for process in processes) and results.empty():
+                break
+    for process in processes:
+        process.join()
+    failed = []
+    for (_, _, filename), process in zip(jobs[1:], processes):
+        for m in messages.get(filename, []):
+            log(m)
+        if process.exitcode != 0 or filename not in messages:
+            log('ERROR: %s was not exported (exit code %s)' % (filename, process.exitcode))
+            failed.append(filename)
+    if failed:
+        raise Exception('Problem exporting the layout, %s.' % ', '.join(failed))
+    return files_out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare the OASIS writer profiles on a merged layout')
+    parser.add_argument('--input', default=os.path.join(path, filename_in), help='merged layout')
+    parser.add_argument('--gds', action='store_true', help='also write the GDS, concurrently with the last profile')
+    args = parser.parse_args()
+
+    layout = pya.Layout()
+    layout.read(args.input)
+    import tempfile
+    with tempfile.TemporaryDirectory() as path_tmp:
+        for i, profile in enumerate(profiles):
+            file_out = export(layout.top_cell(), path_tmp, profile, profile, gds=args.gds and i == len(profiles) - 1)
+            start_time = time.time()
+            pya.Layout().read(file_out)
+            print('  read: %.1f seconds' % (time.time() - start_time))
@@ -0,0 +1,183 @@
+'''
+Integrity check of the geometry when a layout is rescaled to the database unit of the merge
+
+Run using Python, with klayout and numpy
+
+When a file has a different database unit (e.g., 0.5 nm, or 5 nm), the merge rescales the
+whole layout with layout2.transform(ICplxTrans(scaling)); with a non-integer scaling, every
+vertex is snapped to the new grid. This check reads the vertices of each unique cell, per
+layer, in bulk into numpy arrays, and compares the ideal (scaled, not rounded) and the
+snapped geometry, before the layout is transformed:
+ - snapped vertices: moved by the rounding, and the largest move (dbu)
+ - off-grid vertices: the ideal (scaled) vertices not on the manufacturing grid (grid, in dbu),
+   which the rescaling moves; with scaling 1, the vertices of the file off the grid
+ - collapsed edges and polygons: zero length or zero area after the rescaling
+ - sub-resolution polygons: width below min_feature after the rescaling, and slivers: the ones
+   that were not sub-resolution before the rescaling; the width is that of the rectangle with the
+   same area and perimeter (exact for a rectangle, a square or a strip), or 4 x area / perimeter
+   for the rounder shapes (the diameter of a disk)
+ - acute angles: vertex angles below min_angle after the rescaling, that were not before
+The counts are per unique cell (not multiplied by the number of instances). Only the hulls
+of the polygons are checked; paths and boxes are checked as polygons.
+
+Used by EBeam_merge.py for each rescaled file, and optionally for all the files
+(integrity_check_all), with scaling 1, for the off-grid and sub-resolution polygons.
+
+Usage:
+  python merge/EBeam_integrity.py submissions/file.gds [--dbu 0.001]
+
+'''
+
+# configuration
+grid = 1  # manufacturing grid, in dbu of the merge
+grid_tolerance = 1e-6  # dbu, for the floating-point scaling
+min_feature = 0.06  # microns
+min_angle = 20  # degrees
+layers_check = ['1/0']
+
+import os
+import argparse
+
+import numpy as np
+
+# path for this python file
+path = os.path.dirname(os.path.realpath(__file__))
+
+
+def cell_vertices(layout, cell, layer_index):
+    '''Hull vertices of the polygons, boxes and paths in the cell: (xy (n x 2, dbu), points per polygon)'''
+    polygons = [s.polygon for s in cell.shapes(layer_index).each()
+                if s.is_polygon() or s.is_box() or s.is_path() or s.is_simple_polygon()]
+    counts = np.fromiter((p.num_points_hull() for p in polygons), dtype=np.int64, count=len(polygons))
+    xy = np.fromiter((c for p in polygons for pt in p.each_point_hull() for c in (pt.x, pt.y)),
+                     dtype=np.float64, count=2 * int(counts.sum()))
+    return xy.reshape(-1, 2), counts
+
+
+def round_half_away(v):
+    '''Rounding as in the KLayout integer transformations'''
+    return np.sign(v) * np.floor(np.abs(v) + 0.5)
+
+
+def polygon_metrics(xy, counts):
+    '''Per vertex: length of the next edge, and angle (degrees); per polygon: area and perimeter'''
+    starts = np.cumsum(counts) - counts
+    ends = starts + counts - 1
+    index = np.arange(len(xy))
+    nxt = index + 1
+    nxt[ends] = starts
+    prev = index - 1
+    prev[starts] = ends
+    e_next = xy[nxt] - xy
+    e_prev = xy - xy[prev]
+    l_next = np.hypot(e_next[:, 0], e_next[:, 1])
+    l_prev = np.hypot(e_prev[:, 0], e_prev[:, 1])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cos = -(e_prev[:, 0] * e_next[:, 0] + e_prev[:, 1] * e_next[:, 1]) / (l_prev * l_next)
+        angle = np.degrees(np.arccos(np.clip(cos, -1, 1)))
+    # shoelace, per polygon
+    cross = xy[:, 0] * xy[nxt, 1] - xy[nxt, 0] * xy[:, 1]
+    area = np.abs(np.add.reduceat(cross, starts)) / 2 if len(starts) else np.zeros(0)
+    perimeter = np.add.reduceat(l_next, starts) if len(starts) else np.zeros(0)
+    return l_next, angle, area, perimeter
+
+
+def polygon_width(area, perimeter):
+    '''Width of the polygons: the short side of the rectangle with the same area and perimeter, else 4 x area / perimeter'''
+    with np.errstate(invalid='ignore', divide='ignore'):
+        discriminant = perimeter ** 2 - 16 * area
+        return np.where(discriminant > 0, (perimeter - np.sqrt(np.maximum(discriminant, 0))) / 4, 4 * area / perimeter)
+
+
+def check_vertices(xy, counts, scaling, dbu):
+    '''Flags of the issues introduced by the rescaling: {issue: (per vertex or per polygon boolean array, per_vertex)}'''
+    ideal = xy * scaling
+    snapped = round_half_away(ideal)
+    l1, a1, area1, p1 = polygon_metrics(ideal, counts)
+    l2, a2, area2, p2 = polygon_metrics(snapped, counts)
+    width1 = polygon_width(area1, p1) * dbu
+    width2 = polygon_width(area2, p2) * dbu
+    move = np.abs(snapped - ideal).max(axis=1)
+    off_grid = np.abs(ideal / grid - np.rint(ideal / grid)) > grid_tolerance / grid
+    return move, {'off_grid': (off_grid.any(axis=1), True),
+                  'collapsed_edges': ((l2 == 0) & (l1 > 0), True),
+                  'collapsed_polygons': ((area2 == 0) & (area1 > 0), False),
+                  'sub_resolution': (width2 < min_feature, False),
+                  'slivers': ((width2 < min_feature) & (width1 >= min_feature), False),
+                  'acute_angles': ((a2 < min_angle) & ~(a1 < min_angle + 0.5), True)}
+
+
+issues = ['off_grid', 'collapsed_edges', 'collapsed_polygons', 'slivers', 'acute_angles']
+
+
+def check_rescale(layout, scaling, target_dbu=0.001, layers=layers_check):
+    '''Issues introduced by rescaling the layout: {layer: totals}, and [(cell, layer, counts)] for the cells with issues'''
+    totals, cells = {}, []
+    for layer in layers:
+        layer_index = layout.find_layer(int(layer.split('/')[0]), int(layer.split('/')[1]))
+        if layer_index is None:
+            continue
+        # the vertices of all the unique cells, in one array
+        xys, counts, cell_indexes = [], [], []
+        for cell in layout.each_cell():
+            xy, c = cell_vertices(layout, cell, layer_index)
+            if len(c):
+                xys.append(xy)
+                counts.append(c)
+                cell_indexes.append(np.full(len(c), cell.cell_index()))
+        if not counts:
+            continue
+        xy, counts, cell_of_polygon = np.concatenate(xys), np.concatenate(counts), np.concatenate(cell_indexes)
+        cell_of_vertex = np.repeat(cell_of_polygon, counts)
+        move, flags = check_vertices(xy, counts, scaling, target_dbu)
+        total = {'polygons': len(counts), 'vertices': len(xy), 'snapped': int((move > 1e-9).sum()),
+                 'max_snap': float(move.max())}
+        per_cell = {}
+        for k, (flag, per_vertex) in flags.items():
+            total[k] = int(flag.sum())
+            if k in issues and total[k]:
+                ids = (cell_of_vertex if per_vertex else cell_of_polygon)[flag]
+                for cell_index, n in zip(*np.unique(ids, return_counts=True)):
+                    per_cell.setdefault(int(cell_index), {})[k] = int(n)
+        totals[layer] = total
+        for cell_index, c in sorted(per_cell.items(), key=lambda kv: -sum(kv[1].values())):
+            cells.append((layout.cell(cell_index).name, layer, c))
+    return totals, cells
+
+
+def report(totals, cells, log=print, indent='  - '):
+    '''Log the totals and the cells with issues; returns the number of issues'''
+    n = 0
+    for layer, t in totals.items():
+        if not t:
+            continue
+        n += sum(t.get(k, 0) for k in issues)
+        log('%sintegrity, layer %s: %s polygons, %s vertices, %s snapped (max %.2f dbu); %s' % (
+            indent, layer, t['polygons'], t['vertices'], t['snapped'], t['max_snap'],
+            ', '.join('%s %s' % (k.replace('_', ' '), t[k]) for k in issues + ['sub_resolution'])))
+    for name, layer, c in cells[:10]:
+        log('%s  cell %s, layer %s: %s' % (indent, name, layer, ', '.join('%s %s' % (k.replace('_', ' '), n) for k, n in c.items())))
+    if len(cells) > 10:
+        log('%s  ... and %s more cells' % (indent, len(cells) - 10))
+    return n
+
+
+if __name__ == '__main__':
+    import time
+    import pya
+    parser = argparse.ArgumentParser(description='Integrity check of the rescaling to the merge database unit')
+    parser.add_argument('file', help='layout file')
+    parser.add_argument('--dbu', type=float, default=0.001, help='database unit of the merge (microns)')
+    args = parser.parse_args()
+
+    layout = pya.Layout()
+    layout.read(args.file)
+    scaling = round(layout.dbu / args.dbu, 10)
+    print('%s: dbu %s, scaling %s' % (args.file, layout.dbu, scaling))
+    start_time = time.time()
+    totals, cells = check_rescale(layout, scaling, args.dbu)
+    n = report(totals, cells)
+    print('Check time: %.2f seconds' % (time.time() - start_time))
+
+    # Print the number of issues to standard output, as run_verification.py
+    print(n)
@@ -11,6 +11,30 @@ Output
 - in folder "merge"
 -   files: EBeam.oas, EBeam.txt, EBeam.coords
 
+Reproducible mode (--reproducible, or reproducible = True):
+the date stamp and the dates of uncommitted files are the date of the latest commit of the
+input files (or SOURCE_DATE_EPOCH, if set) rather than the time of the run, the files are
+merged in sorted order, so identical inputs give an identical EBeam.oas.
+The digest of the inputs and the sha1 of the output are logged.
+
+The OASIS writer profile (compression, CBLOCKs, strict mode) is selected with --output-profile,
+and --gds also writes EBeam.gds, concurrently; see EBeam_export.py.
+
+The submissions are placed in columns, at the positions clear of the keep-out regions of
+the framework and UBC_static.oas (the keep-outs of EBeam_merge_check.py).
+
+Multi-die mode (--multi-die): when the chip is full, with no position left clear of the
+keep-outs, the placement continues on another die, with the same framework, exported as EBeam_die2.oas, etc. (top cell EBeam_2024_05_die2),
+in parallel. EBeam_dies.json lists the dies and the submissions placed on each (one die
+without --multi-die); it is written by every merge.
+
+Profiling (--profile): cProfile, tracemalloc, and the wall-clock time of the KLayout calls
+(read, clip, copy_tree, export), written to EBeam_profile.txt and EBeam_profile.collapsed
+(for flame graphs); see profiler.py.
+
+Usage:
+  python merge/EBeam_merge.py [--reproducible] [--output-profile fab|small|fast] [--gds] [--multi-die] [--profile]
+
 '''
 
 
@@ -41,6 +65,15 @@ dbu = 0.001
 log_siepictools = False
 framework_file = 'EBL_Framework_1cm_PCM_static.oas'
 ubc_file = 'UBC_static.oas'
+simplify_Si = False  # merge overlapping Si shapes and remove redundant vertices, per unique cell; see EBeam_simplify.py
+rehierarchize = False  # replace repeated flat shapes in each submission by cell arrays; see EBeam_rehier.py
+reproducible = False  # byte-reproducible output: date from the latest input commit
+output_profile = 'fab'  # OASIS writer profile, see EBeam_export.py
+output_gds = False  # also export EBeam.gds
+multi_die = False  # when the chip is full, continue on another die, exported as EBeam_die2.oas, etc.
+static_cache = True  # attach the framework and UBC static blocks from a pre-built library; see EBeam_static_cache.py
+prefetch_depth = 4  # number of files read ahead in the background, 0 to disable; see EBeam_prefetch.py
+integrity_check_all = False  # also check the files with the right dbu (off-grid, sub-resolution); see EBeam_integrity.py
 
 
 # record processing time
@@ -73,13 +106,6 @@ if Python_Env == 'Script':
         sys.path.append(os.path.join(path_GitHub, 'SiEPIC_EBeam_PDK/klayout'))
         import siepic_ebeam_pdk
 
-# Output layout
-layout = pya.Layout()
-layout.dbu = dbu
-top_cell = layout.create_cell(top_cell_name)
-layerText = pya.LayerInfo(int(layer_text.split('/')[0]), int(layer_text.split('/')[1]))
-layerTextN = top_cell.layout().layer(layerText)
-
 def disable_libraries():
     print('Disabling KLayout libraries')
     for l in pya.Library().library_ids():
@@ -99,75 +125,178 @@ def log(text):
     log_file.write(text)
     log_file.write('\n')
 
+# Command line options; unknown arguments are ignored, e.g., when running in KLayout
+import argparse
+parser = argparse.ArgumentParser(description='Automated merge of the submitted layouts')
+parser.add_argument('--reproducible', action='store_true', help='byte-reproducible output, dated by the latest input commit')
+from EBeam_export import profiles
+parser.add_argument('--output-profile', default=output_profile, choices=list(profiles), help='OASIS writer profile')
+parser.add_argument('--gds', action='store_true', help='also export the layout as GDS')
+parser.add_argument('--multi-die', action='store_true', help='when the chip is full, continue on another die')
+parser.add_argument('--prefetch', type=int, default=prefetch_depth, help='number of files read ahead, 0 to disable')
+parser.add_argument('--profile', action='store_true', help='profile the merge: cProfile, tracemalloc, KLayout call times')
+args, _ = parser.parse_known_args()
+reproducible = reproducible or args.reproducible
+output_profile = args.output_profile
+output_gds = output_gds or args.gds
+multi_die = multi_die or args.multi_die
+prefetch_depth = args.prefetch
+
+# Load all the GDS/OAS files from the "submissions" and "framework" folders,
+# using the manifest (top cells, dbu, bounding box, course, git date) shared with run_verification.py;
+# only new or modified files are scanned
+path_root = os.path.abspath(os.path.join(path,".."))
+import sys
+sys.path.insert(0, path_root)
+from submission_manifest import load_manifest, file_hash, check_budget
+from profiler import Profiler, span
+profiler = Profiler(filename_out, path).start() if args.profile else None
+with span('manifest'):
+    manifest = load_manifest(verbose=True)
+
+def source_date(manifest):
+    '''Date of the latest commit of the input files, or SOURCE_DATE_EPOCH if it is set'''
+    if os.environ.get('SOURCE_DATE_EPOCH'):
+        from datetime import timezone
+        return datetime.fromtimestamp(int(os.environ['SOURCE_DATE_EPOCH']), timezone.utc).replace(tzinfo=None)
+    dates = [entry['git_date'] for entry in manifest.values() if entry.get('git_date')]
+    return datetime.strptime(max(dates), "%Y%m%d_%H%M") if dates else datetime(1970, 1, 1)
+
+def inputs_digest(manifest):
+    '''Digest of the content of the input files, in the order they are merged'''
+    import hashlib
+    h = hashlib.sha1()
+    for f_manifest, entry in manifest.items():
+        h.update(('%s %s\n' % (f_manifest, entry.get('sha1'))).encode('utf-8'))
+    return h.hexdigest()
+
 log('SiEPIC-Tools %s, layout merge, running KLayout 0.%s.%s ' % (SiEPIC.__version__, KLAYOUT_VERSION,KLAYOUT_VERSION_3) )
-current_time = now.strftime("%Y-%m-%d, %H:%M:%S local time")
+if reproducible:
+    now = source_date(manifest)
+    current_time = now.strftime("%Y-%m-%d, %H:%M:%S, date of the latest input commit (reproducible mode)")
+else:
+    current_time = now.strftime("%Y-%m-%d, %H:%M:%S local time")
 log("Date: %s" % current_time)
-
-# Load all the GDS/OAS files from the "submissions" folder:
-path2 = os.path.abspath(os.path.join(path,"../submissions"))
-files_in = []
-_, _, files = next(os.walk(path2), (None, None, []))
-for f in sorted(files):
-    files_in.append(os.path.join(path2,f))
-
-# Load all the GDS/OAS files from the "framework" folder:
-path2 = os.path.abspath(os.path.join(path,"../framework"))
-_, _, files = next(os.walk(path2), (None, None, []))
-for f in sorted(files):
-    files_in.append(os.path.join(path2,f))
-
-# Create course cells using the folder name under the top cell
-cell_edXphot1x = layout.create_cell("edX")
-t = Trans(Trans.R0, 0,0)
-top_cell.insert(CellInstArray(cell_edXphot1x.cell_index(), t))
-cell_ELEC413 = layout.create_cell("ELEC413")
-top_cell.insert(CellInstArray(cell_ELEC413.cell_index(), t))
-cell_SiEPIC_Passives = layout.create_cell("SiEPIC_Passives")
-top_cell.insert(CellInstArray(cell_SiEPIC_Passives.cell_index(), t))
-cell_openEBL = layout.create_cell("openEBL")
-top_cell.insert(CellInstArray(cell_openEBL.cell_index(), t))
-
-# Create a date	stamp cell, and add a text label
-merge_stamp = '.merged:'+now.strftime("%Y-%m-%d-%H:%M:%S")
-cell_date = layout.create_cell(merge_stamp)
-text = Text (merge_stamp, Trans(Trans.R0, 0, 0) )
-shape = cell_date.shapes(layout.layer(10,0)).insert(text)
-top_cell.insert(CellInstArray(cell_date.cell_index(), t))   
+log("Manifest: %s files, inputs digest: %s" % (len(manifest), inputs_digest(manifest)))
+
+def create_die(name):
+    '''Output layout for one die, with the top cell, the course cells, and the date stamp cell'''
+    layout = pya.Layout()
+    layout.dbu = dbu
+    top_cell = layout.create_cell(name)
+    t = Trans(Trans.R0, 0,0)
+    # Create course cells using the folder name under the top cell
+    cells_course = {}
+    for course, cell_name in [['edXphot1x', 'edX'], ['ELEC413', 'ELEC413'], ['SiEPIC_Passives', 'SiEPIC_Passives'], ['openEBL', 'openEBL']]:
+        cells_course[course] = layout.create_cell(cell_name)
+        top_cell.insert(CellInstArray(cells_course[course].cell_index(), t))
+    # Create a date	stamp cell, and add a text label
+    merge_stamp = '.merged:'+now.strftime("%Y-%m-%d-%H:%M:%S")
+    cell_date = layout.create_cell(merge_stamp)
+    text = Text (merge_stamp, Trans(Trans.R0, 0, 0) )
+    shape = cell_date.shapes(layout.layer(10,0)).insert(text)
+    top_cell.insert(CellInstArray(cell_date.cell_index(), t))
+    return layout, top_cell, cells_course
+
+def add_static_block(layout, top_cell, cell_source, name, t):
+    '''Copy a static block (framework, UBC) into a die'''
+    subcell2 = layout.create_cell(name)
+    top_cell.insert(CellInstArray(subcell2.cell_index(), t))
+    subcell2.copy_tree(cell_source)
+    return subcell2
+
+# placement of the submissions, around the keep-out regions of the die
+from EBeam_merge_check import placement_boxes, next_position, free_position
+
+# Output layout, one per die in the multi-die mode
+layout, top_cell, cells_course = create_die(top_cell_name)
+layerText = pya.LayerInfo(int(layer_text.split('/')[0]), int(layer_text.split('/')[1]))
+layerTextN = top_cell.layout().layer(layerText)
+dies = [(layout, top_cell)]
+static_blocks = []  # (cell, name, trans), copied into each die
+placements = []  # (die, file, cell, course, x, y)
+keepouts = None  # keep-out regions of the current die, updated when the static blocks are added
+
+# Static blocks (framework, UBC): attached from the pre-built library, cached by content hash
+static_attached = []
+if static_cache:
+    from EBeam_static_cache import static_library, attach_library
+    with span('static library'):
+        file_library, library_info, files = static_library(manifest, log)
+        if file_library and attach_library(layout, top_cell, file_library, library_info, log):
+            static_attached = [f_manifest for f_manifest, _, _ in files]
+
+# Read the next files in the background, while the current one is processed
+prefetcher = None
+if prefetch_depth > 0:
+    from EBeam_prefetch import Prefetcher
+    prefetcher = Prefetcher([os.path.join(path_root, f_manifest) for f_manifest, entry in manifest.items()
+                             if 'error' not in entry and f_manifest not in static_attached and not check_budget(entry)], prefetch_depth)
 
 # Origins for the layouts
 x,y = 0,cell_Height+cell_Gap_Height
+quarantined = []  # files over the complexity budget, not merged
+integrity_issues = []  # (file, number of issues), from EBeam_integrity.py
 
-import subprocess
-import pandas as pd
-for f in [f for f in files_in if '.oas' in f.lower() or '.gds' in f.lower()]:
+for f_manifest, entry in manifest.items():
+    f = os.path.join(path_root, f_manifest)
     basefilename = os.path.basename(f)
-    # get the time the file was last updated from the Git repository 
-    a = subprocess.run(['git', '-C', os.path.dirname(f), 'log', '-1', '--pretty=%ci',  basefilename], stdout = subprocess.PIPE) 
-    filedate = pd.to_datetime(str(a.stdout.decode("utf-8"))).strftime("%Y%m%d_%H%M")
-    log("\nLoading: %s, dated %s" % (os.path.basename(f), filedate))
+    # the time the file was last updated from the Git repository, from the manifest
     # rather than getting it from the disk, which is not correct:
     #  filedate = datetime.fromtimestamp(os.path.getmtime(f)).strftime("%Y%m%d_%H%M")
-  
+    filedate = entry.get('git_date') or now.strftime("%Y%m%d_%H%M")
+    log("\nLoading: %s, dated %s" % (os.path.basename(f), filedate))
+    if 'error' in entry:
+        log('  - ERROR: %s. Skipping.' % entry['error'])
+        continue
+    if f_manifest in static_attached:
+        log('  - attached from the static library')
+        continue
+    # complexity budgets, from the manifest, before loading the layout
+    budget_errors = check_budget(entry)
+    if budget_errors:
+        log('  - ERROR: over the complexity budget: %s. Skipping.' % '; '.join(budget_errors))
+        quarantined.append(f_manifest)
+        continue
+
+    course = entry['course']
+    cell_course = cells_course[course]
+    log("  - course name: %s" % (course) )
+
+    # check that there is one top cell in the layout
+    num_top_cells = len(entry['top_cells'])
+    if num_top_cells > 1:
+        log('  - layout should only contain one top cell; contains (%s): %s' % (num_top_cells, entry['top_cells']) )
+    if num_top_cells == 0:
+        log('  - layout does not contain a top cell')
+        continue
+    if entry['bbox'] is None and basefilename not in [framework_file, ubc_file]:
+        log(' - WARNING: empty layout. Skipping.')
+        continue
+
     # Load layout  
     layout2 = pya.Layout()
-    layout2.read(f)
-
-    if 'ebeam' in basefilename.lower():
-        course = 'edXphot1x'
-    elif 'elec413' in basefilename.lower():
-        course = 'ELEC413'
-    elif 'openebl' in basefilename.lower():
-        course = 'openEBL'
-    elif 'siepic_passives' in basefilename.lower():
-        course = 'SiEPIC_Passives'
-    else:
-        course = 'openEBL'
-
-    cell_course = eval('cell_' + course)
-    log("  - course name: %s" % (course) )
+    with span('prefetch wait'):
+        data = prefetcher.get(f) if prefetcher else None
+    with span('read'):
+        if data:
+            layout2.read_bytes(data)
+        else:
+            layout2.read(f)
+    data = None
+
+    # Integrity of the geometry after the rescaling (snapped vertices, slivers, acute angles),
+    # checked before the layout is transformed
+    if entry['dbu'] != dbu or integrity_check_all:
+        from EBeam_integrity import check_rescale, report
+        with span('integrity'):
+            num_issues = report(*check_rescale(layout2, round(layout2.dbu / dbu, 10), dbu), log=log)
+        if num_issues:
+            integrity_issues.append((f_manifest, num_issues))
+            print('  - WARNING: %s: %s geometry issues when rescaled to the dbu of %s, see EBeam.txt' % (f_manifest, num_issues, dbu))
 
     # Check the DBU Database Unit, in case someone changed it, e.g., 5 nm, or 0.1 nm.
-    if round(layout2.dbu,10) != dbu:
+    if entry['dbu'] != dbu:
         log('  - WARNING: The database unit (%s dbu) in the layout does not match the required dbu of %s.' % (layout2.dbu, dbu))
         print('  - WARNING: The database unit (%s dbu) in the layout does not match the required dbu of %s.' % (layout2.dbu, dbu))
         # Step 1: change the DBU to match, but that magnifies the layout
@@ -177,36 +306,24 @@ for f in [f for f in files_in if '.oas' in f.lower() or '.gds' in f.lower()]:
         try:
             # determine the scaling required
             scaling = round(wrong_dbu / dbu, 10)
-            layout2.transform (pya.ICplxTrans(scaling, 0, False, 0, 0))
+            with span('transform'):
+                layout2.transform (pya.ICplxTrans(scaling, 0, False, 0, 0))
             log('  - WARNING: Database resolution has been corrected and the layout scaled by %s' % scaling) 
         except:
             print('ERROR IN EBeam_merge.py: Incorrect DBU and scaling unsuccessful')
     
-    # check that there is one top cell in the layout
-    num_top_cells = len(layout2.top_cells())
-    if num_top_cells > 1:
-        log('  - layout should only contain one top cell; contains (%s): %s' % (num_top_cells, [c.name for c in layout2.top_cells()]) )
-    if num_top_cells == 0:
-        log('  - layout does not contain a top cell')
-
     # Find the top cell
     for cell in layout2.top_cells():
-        if os.path.basename(f) == framework_file:
-            # Create sub-cell using the filename under top cell
-            subcell2 = layout.create_cell(os.path.basename(f)+"_"+filedate)
-            t = Trans(Trans.R0, 0,0)
-            top_cell.insert(CellInstArray(subcell2.cell_index(), t))
-            # copy
-            subcell2.copy_tree(layout2.cell(cell.name)) 
-            break
-
-        if os.path.basename(f) == ubc_file:
-            # Create sub-cell using the filename under top cell
-            subcell2 = layout.create_cell(os.path.basename(f)+"_"+filedate)
-            t = Trans(Trans.R0, 8780000,8780000)      
-            top_cell.insert(CellInstArray(subcell2.cell_index(), t))
-            # copy
-            subcell2.copy_tree(layout2.cell(cell.name)) 
+        if os.path.basename(f) in [framework_file, ubc_file]:
+            # Create sub-cell using the filename under top cell, in each die
+            if os.path.basename(f) == framework_file:
+                t = Trans(Trans.R0, 0,0)
+            else:
+                t = Trans(Trans.R0, 8780000,8780000)
+            for die_layout, die_top_cell in dies:
+                subcell2 = add_static_block(die_layout, die_top_cell, layout2.cell(cell.name), os.path.basename(f)+"_"+filedate, t)
+            static_blocks.append((subcell2, subcell2.name, t))
+            keepouts = None
             break
 
 
@@ -218,6 +335,31 @@ for f in [f for f in files_in if '.oas' in f.lower() or '.gds' in f.lower()]:
                 log(' - WARNING: empty layout. Skipping.')
                 break
                 
+            # the next position clear of the framework and UBC keep-outs
+            if keepouts is None:
+                keepouts = placement_boxes(layout, top_cell)[1]
+            x, y = free_position(x, y, keepouts)
+
+            # the chip is full: continue on the next die, with the same framework
+            if x + cell_Width > chip_Width:
+                if multi_die:
+                    layout, top_cell, cells_course = create_die('%s_die%s' % (top_cell_name, len(dies) + 1))
+                    layerTextN = layout.layer(layerText)
+                    if static_attached and not attach_library(layout, top_cell, file_library, library_info, log):
+                        # as for the first die: copy the static blocks, from the library cells in the first die
+                        log('  - WARNING: the static library could not be attached to the new die; copying the static blocks')
+                        for name, x_block, y_block in library_info['blocks']:
+                            add_static_block(layout, top_cell, dies[0][0].cell(name), name, Trans(Trans.R0, x_block, y_block))
+                    for cell_static, name, t in static_blocks:
+                        add_static_block(layout, top_cell, cell_static, name, t)
+                    dies.append((layout, top_cell))
+                    cell_course = cells_course[course]
+                    keepouts = placement_boxes(layout, top_cell)[1]
+                    x, y = free_position(0, cell_Height+cell_Gap_Height, keepouts)
+                    log('  - chip is full, continuing on die %s: %s' % (len(dies), top_cell.name))
+                else:
+                    log('  - WARNING: the chip is full, and the layout is placed beyond the chip boundary; use --multi-die')
+
             # Create sub-cell using the filename under course cell
             subcell2 = layout.create_cell(os.path.basename(f)+"_"+filedate)
             t = Trans(Trans.R0, x,y)
@@ -254,6 +396,11 @@ for f in [f for f in files_in if '.oas' in f.lower() or '.gds' in f.lower()]:
                 for s in shapes_to_delete:
                     s.delete()
 
+            # Optional: replace repeated flat shapes by cell arrays
+            if rehierarchize:
+                from EBeam_rehier import rehierarchize_layout
+                rehierarchize_layout(layout2, log)
+
             # bounding box of the cell
             bbox = cell.bbox()
             log('  - bounding box: %s' % bbox.to_s() )
@@ -264,37 +411,33 @@ for f in [f for f in files_in if '.oas' in f.lower() or '.gds' in f.lower()]:
             subcell2.insert(CellInstArray(subcell.cell_index(), t))
         
             # clip cells
-            cell2 = layout2.clip(cell.cell_index(), pya.Box(bbox.left,bbox.bottom,bbox.left+cell_Width,bbox.bottom+cell_Height))
+            with span('clip'):
+                cell2 = layout2.clip(cell.cell_index(), pya.Box(bbox.left,bbox.bottom,bbox.left+cell_Width,bbox.bottom+cell_Height))
             bbox2 = layout2.cell(cell2).bbox()
             if bbox != bbox2:
                 log('  - WARNING: Cell was clipped to maximum size of %s X %s' % (cell_Width, cell_Height) )
                 log('  - clipped bounding box: %s' % bbox2.to_s() )
 
             # copy
-            subcell.copy_tree(layout2.cell(cell2))  
+            with span('copy_tree'):
+                subcell.copy_tree(layout2.cell(cell2))
             
             log('  - Placed at position: %s, %s' % (x,y) )
+            placements.append({'die': len(dies), 'file': f_manifest, 'cell': subcell2.name, 'course': course, 'x': x, 'y': y})
                 
             # Measure the height of the cell that was added, and move up
-            y += max (cell_Height, subcell.bbox().height()) + cell_Gap_Height
-            # move right and bottom when we reach the top of the chip
-            if y + cell_Height > chip_Height1 and x == 0:
-                y = cell_Height + cell_Gap_Height
-                x += cell_Width + cell_Gap_Width
-            if y + cell_Height > chip_Height2:
-                y = cell_Height + cell_Gap_Height
-                x += cell_Width + cell_Gap_Width
-            # check top right cutout for PCM
-            if x + cell_Width > tr_cutout_x and y + cell_Height > tr_cutout_y:
-                # go to the next column
-                y = cell_Height + cell_Gap_Height    
-                x += cell_Width + cell_Gap_Width
-            # Check bottom right cutout for PCM
-            if x + cell_Width > br_cutout_x and y < br_cutout_y:
-                y = br_cutout_y
-            # Check bottom right cutout #2 for PCM
-            if x + cell_Width > br_cutout2_x and y < br_cutout2_y:
-                y = br_cutout2_y
+            x, y = next_position(x, y, subcell.bbox().height())
+
+if quarantined:
+    log('\nQuarantined, over the complexity budget (see submission_manifest.py): %s' % ', '.join(quarantined))
+    print('Quarantined, over the complexity budget: %s' % ', '.join(quarantined))
+
+if integrity_issues:
+    log('\nGeometry issues when rescaled (see EBeam_integrity.py): %s' % ', '.join('%s: %s' % i for i in integrity_issues))
+
+if prefetcher:
+    prefetcher.close()
+    log('\n' + prefetcher.summary())
 
 '''
 text_out,opt_in = find_automated_measurement_labels(topcell=top_cell, LayerTextN=layerTextN)
@@ -304,20 +447,49 @@ coords_file.close()
 '''
 
 
-# move layers
-for i in range(0,len(layers_move)):
-    layer1=layout.find_layer(*layers_move[i][0])
-    layer2=layout.find_layer(*layers_move[i][1])
-    layout.move_layer(layer1, layer2)
+for layout, top_cell in dies:
+    # move layers
+    for i in range(0,len(layers_move)):
+        layer1=layout.find_layer(*layers_move[i][0])
+        layer2=layout.find_layer(*layers_move[i][1])
+        if layer1 is not None and layer2 is not None:
+            layout.move_layer(layer1, layer2)
+
+    # Optional: merge and simplify the Si geometry
+    if simplify_Si:
+        from EBeam_simplify import simplify_layout
+        log('')
+        simplify_layout(layout, top_cell, log)
 
 # Export as-is layout, for UW fabrication
 log('')
 
-#export_layout (top_cell, path, filename='EBeam', relative_path='', format='gds')
-file_out = export_layout (top_cell, path, filename='EBeam', relative_path='', format='oas')
+# with fixed writer options, independent of the SiEPIC-Tools defaults;
+# the dies are exported in parallel, die 1 as EBeam.oas, and die N as EBeam_dieN.oas
+from EBeam_export import export_parallel
+filenames = [filename_out] + ['%s_die%s' % (filename_out, i + 1) for i in range(1, len(dies))]
+with span('export'):
+    files_out = export_parallel([(top_cell, path, filename) for (layout, top_cell), filename in zip(dies, filenames)],
+                                profile=output_profile, gds=output_gds, log=log)
+for f in files_out:
+    log("Layout sha1: %s, %s" % (os.path.basename(f), file_hash(f)))
+file_out = files_out[0]
+
+# Manifest of the dies: which submission was placed on which die; written by every merge,
+# so the post-merge check reads the dies of this merge, and not those left by an earlier one
+import json
+with open(os.path.join(path, filename_out + '_dies.json'), 'w') as f:
+    json.dump({'dies': [{'die': i + 1, 'top_cell': dies[i][1].name, 'file': os.path.basename(files_out[i]),
+                         'submissions': [p for p in placements if p['die'] == i + 1]} for i in range(len(dies))]},
+              f, indent=1)
+if multi_die:
+    log("Dies: %s, %s" % (len(dies), ', '.join('%s: %s submissions' % (os.path.basename(files_out[i]), len([p for p in placements if p['die'] == i + 1])) for i in range(len(dies)))))
 # log("Layout exported successfully %s: %s" % (save_options.format, file_out) )
 
 
+if profiler:
+    log("Profile: %s" % profiler.stop())
+
 log("\nExecution time: %s seconds" % int((time.time() - start_time)))
 
 log_file.close()
@@ -0,0 +1,237 @@
+'''
+Post-merge placement check: overlaps and keep-out regions
+
+Run using Python, with import klayout
+
+Checks the merged layout for:
+ - submissions overlapping each other
+ - submissions overlapping the framework (alignment farms, PCM structures, and the
+   PCM cutouts br_cutout, br_cutout2, tr_cutout used by the merge placement)
+ - submissions overlapping the UBC_static.oas block
+ - submissions extending beyond the chip boundary
+
+The placed submission boxes and the keep-out regions are sorted by their left edge and
+scanned once (sweep line), with the boxes crossing the sweep line in a heap ordered by
+their right edge, so all the violations are found in O(n log n + k), for k candidate pairs.
+
+The dies of a multi-die merge (EBeam_die2.oas, etc.) are checked too, as listed in
+EBeam_dies.json by the merge; die files left by an earlier merge are not checked.
+
+Input:
+- merge/EBeam.oas, and the dies listed in merge/EBeam_dies.json if present
+Output
+- in folder "merge"
+-   file: EBeam_check.lyrdb, with one cell per die
+- the number of violations, on the last line of the standard output;
+  the exit status is 1 if there are violations
+
+Usage:
+  python merge/EBeam_merge_check.py [--input merge/EBeam.oas [merge/EBeam_die2.oas ...]]
+
+'''
+
+# configuration, as in EBeam_merge.py
+cell_Width = 605000
+cell_Height = 410000
+cell_Gap_Width = 8000
+cell_Gap_Height = 8000
+chip_Width = 8650000
+chip_Height1 = 8490000
+chip_Height2 = 8780000
+br_cutout_x = 7484000
+br_cutout_y = 898000
+br_cutout2_x = 7855000
+br_cutout2_y = 5063000
+tr_cutout_x = 7037000
+tr_cutout_y = 8494000
+course_cells = ['edX', 'ELEC413', 'SiEPIC_Passives', 'openEBL']
+framework_file = 'EBL_Framework_1cm_PCM_static.oas'
+ubc_file = 'UBC_static.oas'
+filename_in = 'EBeam.oas'
+filename_out = 'EBeam_check'
+# framework instances larger than this are not keep-out regions themselves; their sub-cells are
+keepout_max_area = 4 * cell_Width * cell_Height
+
+import os
+import sys
+import json
+import time
+import heapq
+import argparse
+
+import pya
+
+# path for this python file
+path = os.path.dirname(os.path.realpath(__file__))
+
+
+def framework_keepouts(layout, inst_cell, trans, name, out):
+    '''Bounding boxes of the framework structures, descending into the large instances'''
+    for inst in inst_cell.each_inst():
+        t = trans * inst.cplx_trans
+        box = inst.cell.bbox().transformed(t)
+        if inst.is_regular_array():
+            box = inst.bbox().transformed(trans)
+        if box.empty():
+            continue
+        if box.area() > keepout_max_area and inst.cell.child_cells() > 0:
+            framework_keepouts(layout, inst.cell, t, name, out)
+        else:
+            out.append((box, '%s: %s' % (name, inst.cell.name)))
+    return out
+
+
+def placement_boxes(layout, top_cell):
+    '''Placed submissions and keep-out regions: lists of (box, name)'''
+    submissions, keepouts = [], []
+    for inst in top_cell.each_inst():
+        cell = inst.cell
+        if cell.name in course_cells:
+            for inst2 in cell.each_inst():
+                submissions.append((inst2.bbox().transformed(inst.cplx_trans), inst2.cell.name))
+        elif cell.name.startswith(ubc_file):
+            keepouts.append((inst.bbox(), cell.name))
+        elif cell.name.startswith(framework_file):
+            framework_keepouts(layout, cell, inst.cplx_trans, cell.name, keepouts)
+    keepouts.append((pya.Box(br_cutout_x, 0, chip_Width, br_cutout_y), 'br_cutout'))
+    keepouts.append((pya.Box(br_cutout2_x, 0, chip_Width, br_cutout2_y), 'br_cutout2'))
+    keepouts.append((pya.Box(tr_cutout_x, tr_cutout_y, chip_Width, chip_Height2), 'tr_cutout'))
+    return submissions, keepouts
+
+
+def next_position(x, y, height):
+    '''Position of the next cell, above a cell of this height: up the column, then the next column, around the PCM cutouts'''
+    y += max (cell_Height, height) + cell_Gap_Height
+    # move right and bottom when we reach the top of the chip
+    if y + cell_Height > chip_Height1 and x == 0:
+        y = cell_Height + cell_Gap_Height
+        x += cell_Width + cell_Gap_Width
+    if y + cell_Height > chip_Height2:
+        y = cell_Height + cell_Gap_Height
+        x += cell_Width + cell_Gap_Width
+    # check top right cutout for PCM
+    if x + cell_Width > tr_cutout_x and y + cell_Height > tr_cutout_y:
+        # go to the next column
+        y = cell_Height + cell_Gap_Height
+        x += cell_Width + cell_Gap_Width
+    # Check bottom right cutout for PCM
+    if x + cell_Width > br_cutout_x and y < br_cutout_y:
+        y = br_cutout_y
+    # Check bottom right cutout #2 for PCM
+    if x + cell_Width > br_cutout2_x and y < br_cutout2_y:
+        y = br_cutout2_y
+    return x, y
+
+
+def free_position(x, y, keepouts):
+    '''
+    The first position from (x, y) where a cell does not overlap the keep-out regions
+    (framework structures, UBC_static, cutouts; see placement_boxes);
+    x + cell_Width is beyond the chip width if the die is full
+    '''
+    while x + cell_Width <= chip_Width:
+        slot = pya.Box(x, y, x + cell_Width, y + cell_Height)
+        if not any(slot.overlaps(box) for box, _ in keepouts):
+            break
+        x, y = next_position(x, y, cell_Height)
+    return x, y
+
+
+def find_overlaps(submissions, keepouts):
+    '''
+    Sweep line over the boxes sorted by their left edge.
+    Returns (submission, submission) and (submission, keep-out) overlapping pairs.
+    '''
+    events = [(box.left, 0, i, box, name) for i, (box, name) in enumerate(submissions)]
+    events += [(box.left, 1, i, box, name) for i, (box, name) in enumerate(keepouts)]
+    events.sort(key=lambda e: (e[0], e[1], e[2]))
+    active = []  # heap of the boxes crossing the sweep line, by right edge: (right, kind, i, box, name)
+    overlaps = []
+    for left, kind, i, box, name in events:
+        while active and active[0][0] <= left:
+            heapq.heappop(active)
+        for _, kind2, i2, box2, name2 in active:
+            if kind == 1 and kind2 == 1:
+                continue
+            if box.overlaps(box2):
+                if kind == 0 and kind2 == 0:
+                    overlaps.append(('Overlap', (box2, name2), (box, name)))
+                elif kind == 0:
+                    overlaps.append(('Keep-out', (box, name), (box2, name2)))
+                else:
+                    overlaps.append(('Keep-out', (box2, name2), (box, name)))
+        heapq.heappush(active, (box.right, kind, i, box, name))
+    return overlaps
+
+
+def check_chip_boundary(submissions):
+    chip = pya.Box(0, 0, chip_Width, chip_Height2)
+    return [('Chip boundary', (box, name), (chip, 'chip')) for box, name in submissions if not chip.contains(box.p1) or not chip.contains(box.p2)]
+
+
+def write_rdb(results, file_rdb):
+    '''Report database of the violations, results: [(top cell name, dbu, violations)], one per die'''
+    rdb = pya.ReportDatabase('Merge placement check')
+    rdb.top_cell_name = results[0][0]
+    descriptions = {'Overlap': 'Submissions overlapping each other',
+                    'Keep-out': 'Submissions overlapping the framework, PCM cutouts, or UBC static block',
+                    'Chip boundary': 'Submissions extending beyond the chip boundary'}
+    categories = {}
+    for category, description in descriptions.items():
+        categories[category] = rdb.create_category(category)
+        categories[category].description = description
+    for top_cell_name, dbu, violations in results:
+        rdb_cell = rdb.create_cell(top_cell_name)
+        for category, (box1, name1), (box2, name2) in violations:
+            item = rdb.create_item(rdb_cell.rdb_id(), categories[category].rdb_id())
+            item.add_value(pya.RdbItemValue('%s overlaps %s' % (name1, name2)))
+            item.add_value(pya.RdbItemValue(box1.to_dtype(dbu)))
+            if category != 'Chip boundary':
+                item.add_value(pya.RdbItemValue((box1 & box2).to_dtype(dbu)))
+    rdb.save(file_rdb)
+
+
+def merged_files():
+    '''The layouts of the last merge: the dies listed in EBeam_dies.json, or EBeam.oas'''
+    file_dies = os.path.join(path, os.path.splitext(filename_in)[0] + '_dies.json')
+    if os.path.exists(file_dies):
+        with open(file_dies) as f:
+            return [os.path.join(path, die['file']) for die in json.load(f)['dies']]
+    return [os.path.join(path, filename_in)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Post-merge overlap and keep-out check')
+    parser.add_argument('--input', nargs='+', help='merged layouts (default: EBeam.oas and the dies listed in EBeam_dies.json)')
+    args = parser.parse_args()
+    files_in = args.input or merged_files()
+
+    results = []
+    num_violations = 0
+    for file_in in files_in:
+        start_time = time.time()
+        layout = pya.Layout()
+        layout.read(file_in)
+        top_cell = layout.top_cell()
+        read_time = time.time() - start_time
+
+        start_time = time.time()
+        submissions, keepouts = placement_boxes(layout, top_cell)
+        violations = find_overlaps(submissions, keepouts) + check_chip_boundary(submissions)
+        check_time = time.time() - start_time
+
+        print('%s:' % os.path.basename(file_in))
+        for category, (box1, name1), (box2, name2) in violations:
+            print(' - %s: %s %s, %s %s' % (category, name1, box1.to_dtype(layout.dbu), name2, box2.to_dtype(layout.dbu)))
+        print('Submissions: %s, keep-out regions: %s, violations: %s' % (len(submissions), len(keepouts), len(violations)))
+        print('Check time: %.3f seconds (layout read: %.1f seconds)' % (check_time, read_time))
+        results.append((top_cell.name, layout.dbu, violations))
+        num_violations += len(violations)
+
+    file_rdb = os.path.join(path, filename_out + '.lyrdb')
+    write_rdb(results, file_rdb)
+
+    # Print the number of violations to standard output, as run_verification.py
+    print(num_violations)
+    if num_violations:
+        sys.exit(1)
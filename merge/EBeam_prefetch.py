@@ -0,0 +1,83 @@
+'''
+Prefetch of the submission files for the merge
+
+The merge processes one submission at a time: read, check, clip, copy. With the prefetch,
+a background thread reads the next files (raw bytes) while the current submission is
+processed, so the disk (or network storage) and the CPU are busy at the same time.
+The layout is then parsed from memory, with Layout.read_bytes.
+
+The queue holds at most "depth" files, which caps the memory used.
+The time spent reading in the background, and the time the merge waited for a file
+(stalls), are recorded, and logged by the merge.
+
+Usage, in EBeam_merge.py:
+  prefetcher = Prefetcher(files, depth=4)
+  data = prefetcher.get(filename)  # bytes, or None if the file was not prefetched
+  prefetcher.close()
+  log(prefetcher.summary())
+
+'''
+
+import time
+import queue
+import threading
+
+
+class Prefetcher:
+    '''Reads the files in order, in a background thread, into a bounded queue'''
+    def __init__(self, files, depth=4):
+        self.files = list(files)
+        self.files_set = set(self.files)
+        self.depth = depth
+        self.queue = queue.Queue(maxsize=depth)
+        self.stopped = False
+        self.read_time = 0.0
+        self.read_bytes = 0
+        self.stall_time = 0.0
+        self.stalls = 0
+        self.max_stall = 0.0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        for f in self.files:
+            start_time = time.time()
+            try:
+                with open(f, 'rb') as fp:
+                    data = fp.read()
+            except OSError:
+                data = None
+            self.read_time += time.time() - start_time
+            self.read_bytes += len(data) if data else 0
+            # wait for room in the queue, unless the merge is done
+            while not self.stopped:
+                try:
+                    self.queue.put((f, data), timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if self.stopped:
+                return
+
+    def get(self, f):
+        '''The content of the file; files that were skipped by the merge are discarded'''
+        if f not in self.files_set:
+            return None
+        while True:
+            start_time = time.time()
+            f2, data = self.queue.get()
+            stall = time.time() - start_time
+            self.stall_time += stall
+            self.max_stall = max(self.max_stall, stall)
+            if stall > 0.001:
+                self.stalls += 1
+            if f2 == f:
+                return data
+
+    def close(self):
+        self.stopped = True
+        self.thread.join()
+
+    def summary(self):
+        return 'Prefetch: depth %s, %s files, %.1f MB read in the background in %.1f seconds; waited %.1f seconds (%s stalls, longest %.2f seconds)' % (
+            self.depth, len(self.files), self.read_bytes / 1e6, self.read_time, self.stall_time, self.stalls, self.max_stall)
@@ -0,0 +1,191 @@
+'''
+Re-hierarchization of flattened, repetitive layouts
+
+Run using Python, with import klayout
+
+Some submissions are exported flat, so every grating period or repeated device is stored
+as an individual polygon. For each unique cell, and each layer, the polygons and boxes are
+grouped by their shape (normalized to the lower-left corner of their bounding box), and
+the positions of identical shapes are searched for regular 1D and 2D arrays (constant pitch).
+Each array of at least min_array shapes is replaced by a new cell containing the shape,
+placed with a CellInstArray. Repeated polygon groups (e.g., a grating period made of
+several polygons) become one array per polygon, with the same pitch.
+The positions are reproduced exactly, so the flattened geometry is unchanged.
+Black-box cells (as found by EBeam_BB_replace.py) and their sub-cells are not modified, so
+that they can be verified and replaced.
+
+Optional stage of EBeam_merge.py (rehierarchize = True), applied to each submission, or:
+
+Input:
+- layout files, e.g., from the submissions folder
+Output
+- in folder "merge/rehier": the re-hierarchized layouts, and the compression ratios
+
+Usage:
+  python merge/EBeam_rehier.py submissions/EBeam_JohnGerguis_A.gds [...] [--verify]
+
+'''
+
+# configuration
+min_array = 4  # minimum number of shapes replaced by an array
+folder_out = 'rehier'
+
+import os
+import sys
+import time
+import argparse
+
+import pya
+
+# path for this python file
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, path)
+from EBeam_BB_replace import BB_subtree
+
+
+def find_runs(values, min_length):
+    '''
+    Split sorted integers into runs with a constant step.
+    Returns (runs, rest): runs are (start, step, count), rest are the values not in a run.
+    '''
+    runs, rest = [], []
+    i = 0
+    while i < len(values):
+        j = i + 1
+        if j < len(values):
+            step = values[j] - values[i]
+            while j + 1 < len(values) and values[j + 1] - values[j] == step:
+                j += 1
+            if j - i + 1 >= min_length and step != 0:
+                runs.append((values[i], step, j - i + 1))
+                i = j + 1
+                continue
+        rest.append(values[i])
+        i += 1
+    return runs, rest
+
+
+def find_arrays(points, min_count):
+    '''
+    Regular arrays in a list of (x, y) positions.
+    Returns (arrays, rest): arrays are (x, y, dx, dy, nx, ny), rest are the other positions.
+    '''
+    # rows: runs along x, at the same y
+    rows = {}
+    for x, y in points:
+        rows.setdefault(y, []).append(x)
+    row_runs = {}  # (x, dx, nx): [y]
+    for y, xs in rows.items():
+        runs, rest = find_runs(sorted(set(xs)), 2)
+        for x, dx, nx in runs:
+            row_runs.setdefault((x, dx, nx), []).append(y)
+        for x in rest:
+            row_runs.setdefault((x, 0, 1), []).append(y)
+    # columns: identical rows, repeated along y with a constant pitch
+    arrays, rest = [], []
+    for (x, dx, nx), ys in row_runs.items():
+        runs, rest_y = find_runs(sorted(ys), 2 if nx > 1 else min_count)
+        for y, dy, ny in runs:
+            if nx * ny >= min_count:
+                arrays.append((x, y, dx, dy, nx, ny))
+            else:
+                rest_y += [y + i * dy for i in range(ny)]
+        for y in rest_y:
+            if nx >= min_count:
+                arrays.append((x, y, dx, 0, nx, 1))
+            else:
+                rest += [(x + i * dx, y) for i in range(nx)]
+    return arrays, rest
+
+
+def rehierarchize_cell(layout, cell, layer_index):
+    '''Replace the arrays of identical shapes on one layer of a cell; returns the number of shapes replaced'''
+    shapes = cell.shapes(layer_index)
+    groups = {}
+    for s in shapes.each():
+        if not (s.is_box() or s.is_polygon() or s.is_simple_polygon()):
+            continue
+        p = s.polygon
+        p1 = p.bbox().p1
+        key = (s.is_box(), p.moved(-p1.x, -p1.y).to_s())
+        groups.setdefault(key, []).append((p1.x, p1.y, s))
+    replaced = 0
+    for (is_box, key), members in groups.items():
+        if len(members) < min_array:
+            continue
+        arrays, _ = find_arrays([(x, y) for x, y, _ in members], min_array)
+        if not arrays:
+            continue
+        # one cell for the shape, placed in arrays
+        s0 = members[0][2]
+        p = s0.polygon.moved(-members[0][0], -members[0][1])
+        shape_cell = layout.create_cell('%s_%s_%s' % (cell.name, layout.get_info(layer_index).to_s().replace('/', '_'), 'array'))
+        if is_box:
+            shape_cell.shapes(layer_index).insert(p.bbox())
+        else:
+            shape_cell.shapes(layer_index).insert(p)
+        by_position = {(x, y): s for x, y, s in members}
+        for x, y, dx, dy, nx, ny in arrays:
+            cell.insert(pya.CellInstArray(shape_cell.cell_index(), pya.Trans(x, y),
+                                          pya.Vector(dx, 0), pya.Vector(0, dy), nx, ny))
+            for i in range(nx):
+                for j in range(ny):
+                    shapes.erase(by_position.pop((x + i * dx, y + j * dy)))
+                    replaced += 1
+    return replaced
+
+
+def rehierarchize_layout(layout, log=print):
+    '''Re-hierarchize every unique cell, on every layer; returns the number of shapes replaced'''
+    cells_BB = BB_subtree(layout)
+    replaced = 0
+    for ci in list(layout.each_cell_bottom_up()):
+        if ci in cells_BB:
+            continue
+        cell = layout.cell(ci)
+        for li in layout.layer_indexes():
+            if cell.shapes(li).size() >= min_array:
+                n = rehierarchize_cell(layout, cell, li)
+                if n:
+                    log('  - %s, layer %s: %s shapes replaced by arrays' % (cell.name, layout.get_info(li).to_s(), n))
+                replaced += n
+    return replaced
+
+
+def xor_check(layout1, layout2):
+    '''Number of XOR differences between the flattened top cells, on all layers'''
+    differences = 0
+    for li in layout1.layer_indexes():
+        info = layout1.get_info(li)
+        li2 = layout2.find_layer(info)
+        r1 = pya.Region(layout1.top_cell().begin_shapes_rec(li))
+        r2 = pya.Region(layout2.top_cell().begin_shapes_rec(li2)) if li2 is not None else pya.Region()
+        differences += (r1 ^ r2).count()
+    return differences
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Re-hierarchization of flattened, repetitive layouts')
+    parser.add_argument('files', nargs='+', help='layout files')
+    parser.add_argument('--verify', action='store_true', help='check that the flattened geometry is unchanged (XOR)')
+    args = parser.parse_args()
+
+    path_out = os.path.join(path, folder_out)
+    os.makedirs(path_out, exist_ok=True)
+    for f in args.files:
+        start_time = time.time()
+        layout = pya.Layout()
+        layout.read(f)
+        shapes_before = sum(c.shapes(li).size() for c in layout.each_cell() for li in layout.layer_indexes())
+        print('%s:' % os.path.basename(f))
+        replaced = rehierarchize_layout(layout)
+        shapes_after = sum(c.shapes(li).size() for c in layout.each_cell() for li in layout.layer_indexes())
+        file_out = os.path.join(path_out, os.path.basename(f))
+        layout.write(file_out)
+        size_before, size_after = os.path.getsize(f), os.path.getsize(file_out)
+        print('  shapes: %s -> %s, file size: %s -> %s bytes, compression ratio %.2f (%.1f seconds)' % (
+            shapes_before, shapes_after, size_before, size_after, size_before / size_after, time.time() - start_time))
+        if args.verify:
+            original = pya.Layout()
+            original.read(f)
+            print('  XOR differences: %s' % xor_check(original, layout))
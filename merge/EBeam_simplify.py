@@ -0,0 +1,180 @@
+'''
+Merge and simplify the Si geometry, per unique cell
+
+Run using Python, with import klayout
+
+For each unique cell (once, regardless of the number of instances), the Si (1/0) polygons
+and boxes are merged (overlapping and abutting shapes become one polygon), and vertices
+that deviate by less than the tolerance (at most 1 dbu) from a straight line are removed,
+keeping horizontal and vertical edges. Paths and texts are left unchanged.
+The result is only kept for a cell if it reduces the number of vertices.
+Black-box cells (as found by EBeam_BB_replace.py) and their sub-cells are not modified, so
+that they can be verified and replaced.
+Shapes are not merged across cells, so the hierarchy is unchanged, and the printed
+geometry changes by at most the tolerance.
+
+The reduction in vertices and bytes (OASIS) is reported for each submission.
+
+Optional stage of EBeam_merge.py (simplify_Si = True), or after the merge:
+
+Input:
+- merge/EBeam.oas
+Output
+- in folder "merge"
+-   files: EBeam_simplified.oas, EBeam_simplified.txt
+
+Usage:
+  python merge/EBeam_simplify.py [--tolerance 1]
+
+'''
+
+# configuration
+layer_Si = '1/0'
+tolerance = 1  # dbu
+course_cells = ['edX', 'ELEC413', 'SiEPIC_Passives', 'openEBL']
+filename_in = 'EBeam.oas'
+filename_out = 'EBeam_simplified'
+
+import os
+import sys
+import time
+import argparse
+
+import pya
+
+# path for this python file
+path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, path)
+from EBeam_BB_replace import BB_subtree
+
+
+def num_vertices(shape):
+    return 4 if shape.is_box() else shape.polygon.num_points()
+
+
+def simplify_cell(cell, layer_index, tolerance):
+    '''Merge and simplify the polygons and boxes in one cell; returns the vertices (before, after)'''
+    shapes = cell.shapes(layer_index)
+    polygons = [s for s in shapes.each() if s.is_box() or s.is_polygon() or s.is_simple_polygon()]
+    before = sum(num_vertices(s) for s in polygons)
+    if not polygons:
+        return 0, 0
+    region = pya.Region()
+    for s in polygons:
+        region.insert(s.polygon)
+    region = region.merged()
+    if tolerance > 0:
+        region = region.smoothed(tolerance, True)
+    after = sum(4 if p.is_box() else p.num_points() for p in region.each())
+    if after >= before:
+        return before, before
+    for s in polygons:
+        shapes.erase(s)
+    for p in region.each():
+        if p.is_box():
+            shapes.insert(p.bbox())
+        else:
+            shapes.insert(p)
+    return before, after
+
+
+def vertices_per_cell(layout, layer_index):
+    '''Number of vertices of the polygons, boxes and paths in each cell, including its sub-cells'''
+    totals = {}
+    for ci in layout.each_cell_bottom_up():
+        cell = layout.cell(ci)
+        n = 0
+        for s in cell.shapes(layer_index).each():
+            if s.is_box():
+                n += 4
+            elif s.is_polygon() or s.is_simple_polygon():
+                n += s.polygon.num_points()
+            elif s.is_path():
+                n += s.path.num_points()
+        for inst in cell.each_inst():
+            n += inst.cell_inst.size() * totals[inst.cell_index]
+        totals[ci] = n
+    return totals
+
+
+def submission_cells(top_cell):
+    '''The placed submissions: (cell, course) for the cells in the course cells'''
+    out = []
+    for inst in top_cell.each_inst():
+        if inst.cell.name in course_cells:
+            out += [(inst2.cell, inst.cell.name) for inst2 in inst.cell.each_inst()]
+    return out
+
+
+def oasis_bytes(layout, cell):
+    '''Size of the OASIS file for a cell and its sub-cells'''
+    save_options = pya.SaveLayoutOptions()
+    save_options.format = 'OASIS'
+    save_options.oasis_compression_level = 10
+    save_options.write_context_info = False
+    save_options.select_cell(cell.cell_index())
+    return len(layout.write_bytes(save_options))
+
+
+def simplify_layout(layout, top_cell, log, tolerance=tolerance, measure_bytes=True):
+    '''Merge and simplify the Si geometry in every unique cell, and log the reduction per submission'''
+    if tolerance > 1:
+        raise ValueError('The simplification tolerance must be at most 1 dbu, not %s' % tolerance)
+    layer_index = layout.find_layer(int(layer_Si.split('/')[0]), int(layer_Si.split('/')[1]))
+    if layer_index is None:
+        return
+    start_time = time.time()
+    submissions = submission_cells(top_cell)
+    vertices_before = vertices_per_cell(layout, layer_index)
+    bytes_before = {c.cell_index(): oasis_bytes(layout, c) for c, _ in submissions} if measure_bytes else {}
+
+    cells_BB = BB_subtree(layout)
+    cells_simplified = 0
+    for cell in layout.each_cell():
+        if cell.cell_index() in cells_BB:
+            continue
+        before, after = simplify_cell(cell, layer_index, tolerance)
+        if after < before:
+            cells_simplified += 1
+
+    vertices_after = vertices_per_cell(layout, layer_index)
+    log('Si merge and simplification (%s, tolerance %s dbu): %s of %s cells simplified' % (
+        layer_Si, tolerance, cells_simplified, layout.cells()))
+    log('  %-60s %14s %14s %12s %12s' % ('submission', 'vertices', 'after', 'bytes', 'after'))
+    for cell, course in submissions:
+        ci = cell.cell_index()
+        if vertices_after[ci] == vertices_before[ci]:
+            continue
+        log('  %-60s %14d %14d %12s %12s' % (cell.name, vertices_before[ci], vertices_after[ci],
+            bytes_before.get(ci, ''), oasis_bytes(layout, cell) if measure_bytes else ''))
+    ci = top_cell.cell_index()
+    log('  %-60s %14d %14d' % ('total', vertices_before[ci], vertices_after[ci]))
+    log('  time: %.1f seconds' % (time.time() - start_time))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Merge and simplify the Si geometry, per unique cell')
+    parser.add_argument('--input', default=os.path.join(path, filename_in), help='merged layout')
+    parser.add_argument('--tolerance', type=int, default=tolerance, help='simplification tolerance, in dbu (0 or 1)')
+    args = parser.parse_args()
+
+    log_file = open(os.path.join(path, filename_out + '.txt'), 'w')
+
+    def log(text):
+        print(text)
+        log_file.write(text)
+        log_file.write('\n')
+
+    layout = pya.Layout()
+    layout.read(args.input)
+    top_cell = layout.top_cell()
+    simplify_layout(layout, top_cell, log, args.tolerance)
+
+    save_options = pya.SaveLayoutOptions()
+    save_options.format = 'OASIS'
+    save_options.oasis_compression_level = 10
+    save_options.write_context_info = False
+    file_out = os.path.join(path, filename_out + '.oas')
+    layout.write(file_out, save_options)
+    log('Layout exported: %s, %s bytes (input: %s bytes)' % (file_out, os.path.getsize(file_out), os.path.getsize(args.input)))
+    log_file.close()
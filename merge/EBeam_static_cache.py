@@ -0,0 +1,124 @@
+'''
+Pre-built library of the static blocks: framework and UBC_static.oas
+
+Run using Python, with import klayout
+
+The static blocks almost never change, but reading them (with CBLOCK decompression) and
+copying them into the merged layout takes a few seconds on every merge. They are
+pre-processed once into a library: each block is a top cell named as in the merge
+(filename_date), and the library is written as OASIS without compression, which is the
+fastest to read. The library is cached in the folder "merge/static_cache", keyed by the
+content hash (sha1) and the date of the static files, so any change rebuilds it.
+
+The merge reads the library directly into the new (empty) layout, and places the blocks.
+The time to build the library is saved along with it, and the time saved is logged.
+
+Input:
+- the static files, from the manifest
+Output
+- in folder "merge/static_cache": static_<key>.oas, static_<key>.json
+
+Usage, to build the library ahead of the merge:
+  python merge/EBeam_static_cache.py
+
+'''
+
+# configuration
+folder_cache = 'static_cache'
+# placement of each static block in the merged layout, as in EBeam_merge.py
+static_placement = {'EBL_Framework_1cm_PCM_static.oas': (0, 0),
+                    'UBC_static.oas': (8780000, 8780000)}
+
+import os
+import sys
+import json
+import time
+import hashlib
+
+import pya
+
+# path for this python file
+path = os.path.dirname(os.path.realpath(__file__))
+path_root = os.path.abspath(os.path.join(path, '..'))
+
+
+def static_files(manifest):
+    '''The static files in the manifest, with their block cell names'''
+    out = []
+    for f_manifest, entry in manifest.items():
+        basefilename = os.path.basename(f_manifest)
+        if basefilename in static_placement and 'error' not in entry and entry.get('top_cells'):
+            out.append((f_manifest, entry, '%s_%s' % (basefilename, entry.get('git_date'))))
+    return out
+
+
+def library_key(files):
+    h = hashlib.sha1()
+    for f_manifest, entry, name in files:
+        h.update(('%s %s %s\n' % (f_manifest, entry['sha1'], name)).encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+def build_library(files, file_library):
+    '''Read and copy the static blocks into one library, as the merge does; returns the info'''
+    start_time = time.time()
+    library = pya.Layout()
+    library.dbu = 0.001
+    blocks = []
+    for f_manifest, entry, name in files:
+        layout2 = pya.Layout()
+        layout2.read(os.path.join(path_root, f_manifest))
+        cell = library.create_cell(name)
+        cell.copy_tree(layout2.top_cells()[0])
+        blocks.append([name] + list(static_placement[os.path.basename(f_manifest)]))
+    build_time = time.time() - start_time
+    save_options = pya.SaveLayoutOptions()
+    save_options.format = 'OASIS'
+    save_options.oasis_compression_level = 0
+    save_options.oasis_write_cblocks = False
+    save_options.write_context_info = False
+    library.write(file_library, save_options)
+    info = {'blocks': blocks, 'cells': sorted(c.name for c in library.each_cell()), 'build_time': build_time}
+    with open(file_library.replace('.oas', '.json'), 'w') as f:
+        json.dump(info, f, indent=1)
+    return info
+
+
+def static_library(manifest, log=print):
+    '''The cached library for the static files in the manifest, built if needed: (file, info, files)'''
+    files = static_files(manifest)
+    if not files:
+        return None, None, files
+    os.makedirs(os.path.join(path, folder_cache), exist_ok=True)
+    file_library = os.path.join(path, folder_cache, 'static_%s.oas' % library_key(files))
+    if os.path.exists(file_library) and os.path.exists(file_library.replace('.oas', '.json')):
+        with open(file_library.replace('.oas', '.json')) as f:
+            return file_library, json.load(f), files
+    info = build_library(files, file_library)
+    log('Static library built: %s, %s blocks, %.1f seconds' % (os.path.basename(file_library), len(info['blocks']), info['build_time']))
+    return file_library, info, files
+
+
+def attach_library(layout, top_cell, file_library, info, log=print):
+    '''
+    Read the library into the layout, and place the blocks in the top cell.
+    Returns False, without changing the layout, if a library cell name is already in use.
+    '''
+    if any(layout.has_cell(name) for name in info['cells']):
+        return False
+    start_time = time.time()
+    layout.read(file_library)
+    for name, x, y in info['blocks']:
+        top_cell.insert(pya.CellInstArray(layout.cell(name).cell_index(), pya.Trans(pya.Trans.R0, x, y)))
+    attach_time = time.time() - start_time
+    log('Static blocks attached from the library %s: %s, %.1f seconds (time saved: %.1f seconds)' % (
+        os.path.basename(file_library), ', '.join(b[0] for b in info['blocks']), attach_time, info['build_time'] - attach_time))
+    return True
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, path_root)
+    from submission_manifest import load_manifest
+    file_library, info, files = static_library(load_manifest(verbose=True))
+    if file_library:
+        print('Static library: %s, %s cells, blocks: %s' % (file_library, len(info['cells']), info['blocks']))
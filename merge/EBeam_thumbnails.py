@@ -0,0 +1,239 @@
+'''
+Thumbnails of the submissions, and a multi-resolution overview of the merged chip
+
+Run using Python, with klayout (headless layout view) and Pillow
+
+Input:
+- the GDS/OAS files in the "submissions" folder (content hashes from submission_manifest.py)
+- optionally, the merged layout (merge/EBeam.oas)
+Output
+- in folder "merge/thumbnails"
+-   <submission>.png: thumbnail, and <submission>_preview.png: larger preview
+-   chip/<level>/<column>_<row>.png: 256 x 256 tiles of the merged chip, level 0 is the
+    full resolution (overview_size), and each following level is half the size
+-   contact_sheet.png: all the thumbnails, with their names
+-   index.html: the thumbnails, linked to the previews, and the chip overview
+-   index.json: content hash of each rendered file
+
+The submissions are rendered in parallel, and a file is only rendered again if its content
+hash changed, so only the changed designs are rendered in each run.
+The layer colours are those of the PDK (EBeam.lyp), when siepic_ebeam_pdk is installed.
+
+Usage:
+  python merge/EBeam_thumbnails.py [--layout merge/EBeam.oas] [--no-chip] [--jobs N]
+
+'''
+
+# configuration
+thumbnail_size = 256
+preview_size = 1024
+overview_size = 4096
+tile_size = 256
+columns_contact_sheet = 12
+layers_visible = ['1/0', '4/0', '99/0', '200/0']  # Si, SiN, Floorplan, SEM
+folder_out = 'thumbnails'
+index_file = 'index.json'
+
+import os
+import sys
+import html
+import json
+import time
+import argparse
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageDraw
+
+# path for this python file
+path = os.path.dirname(os.path.realpath(__file__))
+path_root = os.path.join(path, '..')
+sys.path.insert(0, path_root)
+from submission_manifest import load_manifest, file_hash
+
+
+def layer_properties():
+    '''The PDK layer properties file, without importing the PDK'''
+    spec = importlib.util.find_spec('siepic_ebeam_pdk')
+    if spec and spec.origin:
+        lyp = os.path.join(os.path.dirname(spec.origin), 'EBeam.lyp')
+        if os.path.exists(lyp):
+            return lyp
+    return None
+
+
+view = None
+
+
+def new_view():
+    import pya
+    v = pya.LayoutView()
+    v.set_config('grid-visible', 'false')
+    v.set_config('background-color', '#ffffff')
+    v.set_config('text-visible', 'false')
+    return v
+
+
+def show_layers(view):
+    '''Only show the layers_visible, e.g., not the text, pins and device recognition layers'''
+    it = view.begin_layers()
+    while not it.at_end():
+        lp = it.current().dup()
+        # groups stay visible, for their children
+        lp.visible = lp.has_children() or '%s/%s' % (lp.source_layer, lp.source_datatype) in layers_visible
+        view.set_layer_properties(it, lp)
+        it.next()
+
+
+def render(filename, outputs, lyp=None):
+    '''Render the top cell of a layout, at each (image file, size)'''
+    global view
+    if view is None:
+        view = new_view()
+    view.load_layout(filename, False)
+    if lyp:
+        view.load_layer_props(lyp)
+    cellview = view.active_cellview()
+    layout = cellview.layout()
+    # same top cell as the merge: "top", otherwise the first one
+    cell = layout.top_cells()[0]
+    for c in layout.top_cells():
+        if c.name.lower() == 'top':
+            cell = c
+    cellview.cell = cell
+    show_layers(view)
+    view.max_hier()
+    view.zoom_fit()
+    for file_image, size in outputs:
+        view.save_image(file_image, size, size)
+
+
+def render_submission(args):
+    f, sha1, lyp = args
+    name = os.path.splitext(os.path.basename(f))[0]
+    path_out = os.path.join(path, folder_out)
+    start_time = time.time()
+    try:
+        render(os.path.join(path_root, f), [(os.path.join(path_out, name + '.png'), thumbnail_size),
+                                            (os.path.join(path_out, name + '_preview.png'), preview_size)], lyp)
+    except Exception as e:
+        return f, {'sha1': sha1, 'error': str(e)}
+    return f, {'sha1': sha1, 'thumbnail': name + '.png', 'preview': name + '_preview.png',
+               'time': round(time.time() - start_time, 2)}
+
+
+def build_pyramid(image, folder):
+    '''Tiles of the image, at each level; returns the number of levels'''
+    level = 0
+    while True:
+        w, h = image.size
+        folder_level = os.path.join(folder, str(level))
+        os.makedirs(folder_level, exist_ok=True)
+        for row in range(0, (h + tile_size - 1) // tile_size):
+            for column in range(0, (w + tile_size - 1) // tile_size):
+                box = (column * tile_size, row * tile_size,
+                       min(w, (column + 1) * tile_size), min(h, (row + 1) * tile_size))
+                image.crop(box).save(os.path.join(folder_level, '%s_%s.png' % (column, row)))
+        if w <= tile_size and h <= tile_size:
+            break
+        image = image.resize((max(1, (w + 1) // 2), max(1, (h + 1) // 2)), Image.LANCZOS)
+        level += 1
+    return level + 1
+
+
+def contact_sheet(entries, filename):
+    '''All the thumbnails in one image, with their names'''
+    entries = [(f, e) for f, e in entries if 'thumbnail' in e]
+    label_height = 14
+    rows = max(1, (len(entries) + columns_contact_sheet - 1) // columns_contact_sheet)
+    sheet = Image.new('RGB', (columns_contact_sheet * thumbnail_size, rows * (thumbnail_size + label_height)), 'white')
+    draw = ImageDraw.Draw(sheet)
+    for i, (f, e) in enumerate(entries):
+        x = (i % columns_contact_sheet) * thumbnail_size
+        y = (i // columns_contact_sheet) * (thumbnail_size + label_height)
+        with Image.open(os.path.join(path, folder_out, e['thumbnail'])) as image:
+            sheet.paste(image.convert('RGB'), (x, y))
+        draw.text((x + 2, y + thumbnail_size), os.path.basename(f)[:40], fill='black')
+    sheet.save(filename)
+
+
+def write_html(entries, chip, filename):
+    lines = ['<!DOCTYPE html>', '<html><head><meta charset="utf-8"><title>Submissions</title>',
+             '<style>body{font-family:sans-serif} figure{display:inline-block;margin:4px;width:%spx}'
+             'figcaption{font-size:11px;word-wrap:break-word} .error{color:red}</style></head><body>' % thumbnail_size]
+    if chip:
+        lines.append('<h2>Merged chip</h2>')
+        lines.append('<p>%s: <a href="chip/%s/0_0.png"><img src="chip/%s/0_0.png"></a> (%s levels of %s x %s tiles, in chip/&lt;level&gt;/&lt;column&gt;_&lt;row&gt;.png)</p>' % (
+            html.escape(chip['layout']), chip['levels'] - 1, chip['levels'] - 1, chip['levels'], tile_size, tile_size))
+    lines.append('<h2>Submissions: %s</h2>' % len(entries))
+    for f, e in entries:
+        if 'thumbnail' in e:
+            lines.append('<figure><a href="%s"><img src="%s" width="%s" height="%s"></a><figcaption>%s</figcaption></figure>' % (
+                html.escape(e['preview']), html.escape(e['thumbnail']), thumbnail_size, thumbnail_size, html.escape(os.path.basename(f))))
+        else:
+            lines.append('<figure><figcaption>%s<br><span class="error">%s</span></figcaption></figure>' % (
+                html.escape(os.path.basename(f)), html.escape(e.get('error', ''))))
+    lines.append('</body></html>')
+    with open(filename, 'w') as fp:
+        fp.write('\n'.join(lines) + '\n')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Thumbnails of the submissions, and overview of the merged chip')
+    parser.add_argument('--layout', default=os.path.join(path, 'EBeam.oas'), help='merged layout')
+    parser.add_argument('--no-chip', action='store_true', help='do not render the merged chip')
+    parser.add_argument('--jobs', type=int, default=None, help='number of processes')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    path_out = os.path.join(path, folder_out)
+    os.makedirs(path_out, exist_ok=True)
+    lyp = layer_properties()
+
+    # previous index, to only render new or modified files
+    index = {}
+    if os.path.exists(os.path.join(path_out, index_file)):
+        with open(os.path.join(path_out, index_file)) as f:
+            index = json.load(f)
+    submissions = index.get('submissions', {})
+
+    manifest = load_manifest()
+    files = [f for f in manifest if f.startswith('submissions/')]
+    submissions = {f: submissions[f] for f in files if f in submissions}
+    todo = []
+    for f in files:
+        e = submissions.get(f)
+        if e and e.get('sha1') == manifest[f]['sha1'] and (
+                'error' in e or os.path.exists(os.path.join(path_out, e['thumbnail']))):
+            continue
+        todo.append((f, manifest[f]['sha1'], lyp))
+
+    print('Submissions: %s, to render: %s' % (len(files), len(todo)))
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        for f, entry in executor.map(render_submission, todo, chunksize=max(1, len(todo) // (4 * (args.jobs or os.cpu_count())))):
+            print(' - %s: %s' % (f, entry.get('error') or '%.2f seconds' % entry['time']))
+            submissions[f] = entry
+    index['submissions'] = submissions
+
+    # merged chip: rendered once at full resolution, and reduced for each level
+    chip = index.get('chip')
+    if not args.no_chip and os.path.exists(args.layout):
+        sha1 = file_hash(args.layout)
+        if not chip or chip.get('sha1') != sha1:
+            print('Rendering the merged chip: %s' % args.layout)
+            file_image = os.path.join(path_out, 'chip.png')
+            render(args.layout, [(file_image, overview_size)], lyp)
+            with Image.open(file_image) as image:
+                levels = build_pyramid(image.convert('RGB'), os.path.join(path_out, 'chip'))
+            chip = {'sha1': sha1, 'layout': os.path.basename(args.layout), 'levels': levels}
+        index['chip'] = chip
+
+    entries = sorted(submissions.items())
+    contact_sheet(entries, os.path.join(path_out, 'contact_sheet.png'))
+    write_html(entries, index.get('chip'), os.path.join(path_out, 'index.html'))
+    with open(os.path.join(path_out, index_file), 'w') as f:
+        json.dump(index, f, indent=1)
+    print('Thumbnails: %s, time: %.1f seconds' % (os.path.join(path_out, 'index.html'), time.time() - start_time))
+
+    # Print the number of submissions rendered to standard output
+    print(len(todo))
@@ -0,0 +1,174 @@
+'''
+E-beam write-time and shot-count estimate, per submission and per course
+
+Run using Python, with import klayout
+
+For each unique cell, on the written layers: the number of figures, vertices, the area,
+the number of trapezoids after fracturing, and the number of shots (each trapezoid is split
+into shots of at most max_shot_size). Each unique cell is evaluated once, and the totals
+are accumulated bottom-up, multiplied by the number of instances (including arrays), and
+for the area and the shots by the square of the magnification.
+
+The write time is estimated as the exposure time (area x dose / beam current) plus a fixed
+settling time per shot.
+
+Input:
+- merge/EBeam.oas, or the layout files given on the command line
+Output
+- in folder "merge"
+-   file: EBeam_writetime.txt, per-submission and per-course tables
+
+Usage:
+  python merge/EBeam_writetime.py [--cap 10]
+  python merge/EBeam_writetime.py submissions/EBeam_LukasChrostowski_rings.oas [...]
+
+'''
+
+# configuration
+layers_write = ['1/0', '31/0']  # 31/0 is moved to 1/0 by the merge
+max_shot_size = 2.0  # microns
+dose = 2000  # uC/cm^2, HSQ
+beam_current = 8  # nA
+shot_settling_time = 100e-9  # seconds
+# course cells of the merged layout: course, as in the manifest (submission_manifest.course_name)
+course_cells = {'edX': 'edXphot1x', 'ELEC413': 'ELEC413', 'SiEPIC_Passives': 'SiEPIC_Passives', 'openEBL': 'openEBL'}
+filename_in = 'EBeam.oas'
+filename_out = 'EBeam_writetime'
+
+import os
+import sys
+import time
+import argparse
+
+import pya
+
+# path for this python file
+path = os.path.dirname(os.path.realpath(__file__))
+path_root = os.path.join(path, '..')
+sys.path.insert(0, path_root)
+from submission_manifest import course_name
+from opt_in_labels import submission_name
+
+# statistics, in this order: figures, vertices, area (dbu^2), trapezoids, shots
+n_stats = 5
+
+
+def cell_stats(layout, cell, layers, shot_size):
+    '''Statistics for the shapes in one cell (not its sub-cells)'''
+    figures = vertices = area = trapezoids = shots = 0
+    for li in layers:
+        if cell.shapes(li).is_empty():
+            continue
+        region = pya.Region(cell.shapes(li))
+        region.merged_semantics = False
+        figures += region.count()
+        for p in region.each():
+            vertices += p.num_points()
+        area += region.area()
+        for t in region.decompose_trapezoids_to_region().each():
+            b = t.bbox()
+            trapezoids += 1
+            shots += (-(-b.width() // shot_size)) * (-(-b.height() // shot_size))
+    return [figures, vertices, area, trapezoids, shots]
+
+
+def hierarchical_stats(layout, layers, shot_size):
+    '''Statistics for each cell including its sub-cells: {cell_index: [figures, vertices, area, trapezoids, shots]}'''
+    totals = {}
+    for ci in layout.each_cell_bottom_up():
+        cell = layout.cell(ci)
+        total = cell_stats(layout, cell, layers, shot_size)
+        for inst in cell.each_inst():
+            n = inst.cell_inst.size()
+            mag2 = inst.cplx_trans.mag ** 2
+            child = totals[inst.cell_index]
+            for i in range(n_stats):
+                # area and shots scale with the magnified size, the counts of figures do not
+                total[i] += n * child[i] * (mag2 if i in (2, 4) else 1)
+        totals[ci] = total
+    return totals
+
+
+def write_time(area, shots, dbu):
+    '''Estimated write time in seconds, for an area in dbu^2'''
+    area_cm2 = area * dbu ** 2 * 1e-8
+    return area_cm2 * dose * 1e-6 / (beam_current * 1e-9) + shots * shot_settling_time
+
+
+def layer_indexes(layout, layers):
+    out = []
+    for l in layers:
+        li = layout.find_layer(int(l.split('/')[0]), int(l.split('/')[1]))
+        if li is not None:
+            out.append(li)
+    return out
+
+
+def estimate(filename):
+    '''Rows (submission, course, stats) for a merged layout, or for a single submission'''
+    layout = pya.Layout()
+    layout.read(filename)
+    shot_size = int(round(max_shot_size / layout.dbu))
+    totals = hierarchical_stats(layout, layer_indexes(layout, layers_write), shot_size)
+    rows = []
+    for top_cell in layout.top_cells():
+        courses = [inst for inst in top_cell.each_inst() if inst.cell.name in course_cells]
+        if not courses:
+            rows.append((os.path.basename(filename), course_name(os.path.basename(filename)),
+                         totals[top_cell.cell_index()], layout.dbu))
+        for inst in courses:
+            for inst2 in inst.cell.each_inst():
+                rows.append((submission_name(inst2.cell.name), course_cells[inst.cell.name], totals[inst2.cell_index], layout.dbu))
+        if courses:
+            # the framework and other blocks placed directly in the top cell
+            for inst in top_cell.each_inst():
+                if inst.cell.name not in course_cells and totals[inst.cell_index][0] > 0:
+                    rows.append((submission_name(inst.cell.name), '(top)', totals[inst.cell_index], layout.dbu))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='E-beam write-time and shot-count estimate')
+    parser.add_argument('files', nargs='*', help='layout files (default: the merged layout)')
+    parser.add_argument('--cap', type=float, default=None, help='flag submissions with a write time above this (minutes)')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    rows = []
+    for f in args.files or [os.path.join(path, filename_in)]:
+        rows += estimate(f)
+
+    lines = []
+    lines.append('E-beam write-time estimate: dose %s uC/cm^2, beam current %s nA, shot size %s um, %s ns per shot' % (
+        dose, beam_current, max_shot_size, shot_settling_time * 1e9))
+    header = '%-60s %-16s %10s %12s %14s %12s %12s %10s' % (
+        'submission', 'course', 'figures', 'vertices', 'area (um^2)', 'trapezoids', 'shots', 'time (min)')
+    lines += ['', header]
+    courses = {}
+    num_over_cap = 0
+    for name, course, s, dbu in sorted(rows, key=lambda r: -write_time(r[2][2], r[2][4], r[3])):
+        t = write_time(s[2], s[4], dbu) / 60
+        flag = ''
+        if args.cap is not None and t > args.cap:
+            flag = '  > cap'
+            num_over_cap += 1
+        lines.append('%-60s %-16s %10d %12d %14.1f %12d %12d %10.2f%s' % (
+            name, course, s[0], s[1], s[2] * dbu ** 2, s[3], s[4], t, flag))
+        c = courses.setdefault(course, [0] * n_stats + [0.0])
+        for i in range(n_stats):
+            c[i] += s[i] * (dbu ** 2 if i == 2 else 1)
+        c[n_stats] += t
+
+    lines += ['', header.replace('submission', 'course    ')]
+    for course, c in sorted(courses.items(), key=lambda item: -item[1][n_stats]):
+        lines.append('%-60s %-16s %10d %12d %14.1f %12d %12d %10.2f' % (course, '', c[0], c[1], c[2], c[3], c[4], c[5]))
+    total = sum(c[n_stats] for c in courses.values())
+    lines += ['', 'Total write time: %.1f minutes' % total]
+    if args.cap is not None:
+        lines.append('Submissions above the cap of %s minutes: %s' % (args.cap, num_over_cap))
+
+    with open(os.path.join(path, filename_out + '.txt'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    print('\n'.join(lines[:20]))
+    print('...\n' + '\n'.join(lines[-3:]))
+    print('Execution time: %.1f seconds' % (time.time() - start_time))
@@ -0,0 +1,103 @@
+'''
+Hierarchical cell content hashes, for the merge tools
+
+The hash of a cell depends only on its contents: the shapes on each layer, and the
+instances of its sub-cells (by their content hash, not by their name), so that
+identical cells copied into the merged layout under different names (e.g., "cell$3")
+have the same hash.
+
+With fast=True, the shapes are keyed by their KLayout hash value, rather than their
+coordinates as text, which is about 10x faster on a full merged layout (for comparing
+two layouts, as in EBeam_diff.py); the hashes differ from the default ones.
+
+The flat hash of a cell depends only on its flattened geometry (merged polygons) and
+texts (string and position), on the given layers: it does not depend on how the cell
+is split into sub-cells, or on the text size and alignment that OASIS files do not
+store, so that a cell flattened or re-saved in a submission has the same flat hash as
+the original (used by EBeam_BB_replace.py, against the cells in the PDK).
+
+Usage:
+  cache = {}
+  h = cell_hash(layout, cell.cell_index(), cache)
+  h = flat_cell_hash(layout, cell.cell_index(), layers)
+
+'''
+
+import hashlib
+
+import pya
+
+
+def shape_key(shape, fast=False):
+    '''Canonical string for a shape; boxes, paths and polygons are compared as polygons'''
+    if shape.is_text():
+        return 'T' + shape.text.to_s()
+    if shape.is_box() or shape.is_polygon() or shape.is_path() or shape.is_simple_polygon():
+        if fast:
+            p = shape.polygon
+            return 'P%x %d' % (p.hash(), p.num_points())
+        return 'P' + shape.polygon.to_s()
+    return 'S' + shape.to_s()
+
+
+def shapes_digest(cell, layer_index, fast=False):
+    '''Hash of the shapes in a cell, on one layer; None if there are none'''
+    shapes = cell.shapes(layer_index)
+    if shapes.is_empty():
+        return None
+    h = hashlib.sha1()
+    for key in sorted(shape_key(s, fast) for s in shapes.each()):
+        h.update(key.encode())
+        h.update(b'\n')
+    return h.hexdigest()
+
+
+def instance_key(layout, inst, cache, layers, fast=False):
+    a = inst.cell_inst
+    key = '%s %s' % (cell_hash(layout, a.cell_index, cache, layers, fast), a.cplx_trans.to_s())
+    if a.is_regular_array():
+        key += ' %s %s %s %s' % (a.a.to_s(), a.b.to_s(), a.na, a.nb)
+    return key
+
+
+def cell_hash(layout, cell_index, cache, layers=None, fast=False):
+    '''
+    Content hash of a cell and its sub-cells.
+    cache: dict {cell_index: hash}, shared between calls on the same layout (and fast setting)
+    layers: list of layer indexes to include (default: all layers)
+    '''
+    if cell_index in cache:
+        return cache[cell_index]
+    cell = layout.cell(cell_index)
+    h = hashlib.sha1()
+    for li in (layout.layer_indexes() if layers is None else layers):
+        d = shapes_digest(cell, li, fast)
+        if d:
+            h.update(('%s:%s\n' % (layout.get_info(li).to_s(), d)).encode())
+    for key in sorted(instance_key(layout, inst, cache, layers, fast) for inst in cell.each_inst()):
+        h.update(key.encode())
+        h.update(b'\n')
+    cache[cell_index] = h.hexdigest()
+    return cache[cell_index]
+
+
+def flat_cell_hash(layout, cell_index, layers):
+    '''
+    Content hash of the flattened cell, independent of its hierarchy.
+    layers: list of layer indexes to include
+    '''
+    cell = layout.cell(cell_index)
+    h = hashlib.sha1()
+    for li in layers:
+        region = pya.Region(cell.begin_shapes_rec(li))
+        region.merge()
+        keys = ['P' + p.to_s() for p in region.each()]
+        it = cell.begin_shapes_rec(li)
+        while not it.at_end():
+            if it.shape().is_text():
+                text = it.shape().text.transformed(it.trans())
+                keys.append('T%s %s' % (text.string, text.trans.disp.to_s()))
+            it.next()
+        if keys:
+            h.update(('%s:%s\n' % (layout.get_info(li).to_s(), '\n'.join(sorted(keys)))).encode())
+    return h.hexdigest()
@@ -0,0 +1,367 @@
+'''
+Parser and parameter index for the opt_in measurement labels
+
+The automated measurement labels encode the device, e.g.,
+  opt_in_TE_1550_device_LukasChrostowski_RingDoubleTEr10g80
+  opt_in_TE_1550_device_contraDC1000N316period100g100wa560wb440dwa50dwb50sine0a2.7
+  opt_in_TE_1310_PCM_PCM_Bragg_O_800N282nmPeriod350nmW15nmdW0Apo
+Each label is parsed into:
+ - polarization (TE, TM) and wavelength (nm)
+ - group: device, PCM, openEBL or ELEC413, if the label starts with one of them (else None)
+ - designer: the first field after "device_", "openEBL_" or "ELEC413_", if there are more fields
+ - device: the rest of the label; type: the leading name of its first field that is not a
+   parameter (e.g., RingDoubleTE, contraDC, MZI, Bragg; not R in R7_B30.0), without the
+   repeated group prefix (PCM_PCM_Bragg), and without a parameter name written at its end,
+   before a number (BraggStripPeriod320: type BraggStrip, Period 320; param_suffixes)
+ - params: the numbers in the device name, with their names, as written in the label (no unit
+   conversion, e.g., g80 is 80 nm); units: the nm/um suffixes of the numbers (282nmPeriod).
+   The fields ("_") are parsed one at a time: names precede the numbers (r10g80), unless the
+   field starts with a number and ends with a name (800N282nmPeriod), as in the contra-DC and
+   PCM Bragg labels. A number without a name is "n". A TE/TM suffix is not a parameter name.
+The labels, with their position and submission, are read from the merged layout (or from the
+submissions manifest, without positions), and stored in an index with a sorted column per
+parameter, for range queries, e.g., all the rings with r = 10 and 80 <= g <= 110:
+  index.query(type='RingDoubleTE', r=10, g=(80, 110))
+The labels of the merged layout are saved in merge/EBeam_opt_in.json, and read again, without
+loading the layout, as long as the layout has not changed.
+
+Usage:
+  python opt_in_labels.py [--layout merge/EBeam.oas | --manifest] [--type RingDoubleTE] [--param r=10 --param g=80:110] [--csv]
+  python opt_in_labels.py --check
+      parse all the labels in the submissions manifest, and list those not parsed as expected:
+      parameters that are not numbers, units or groups parsed as names, types ending with a
+      parameter name, and numbers without a name after a named parameter
+
+  from opt_in_labels import parse_label, load_index
+  index = load_index()
+  for label in index.query(type='RingDoubleTE', r=10, g=(80, 110)):
+      print(index.records[label])
+
+'''
+
+# configuration
+layout_file = 'merge/EBeam.oas'
+index_file = 'merge/EBeam_opt_in.json'
+layer_text = '10/0'
+course_cells = ['edX', 'ELEC413', 'SiEPIC_Passives', 'openEBL']
+
+import os
+import re
+import json
+import bisect
+
+# path for this python file, the root of the repository
+path = os.path.dirname(os.path.realpath(__file__))
+
+label_pattern = re.compile(r'^opt_in_(TE|TM)_(\d+)_(.*)$')
+# a number, with an optional unit, or a name
+token_pattern = re.compile(r'(-?\d+(?:\.\d+)?)(nm|um)?|([A-Za-z]+)')
+# parameter names written at the end of the type, before their number, e.g., BraggStripPeriod320,
+# DiskDia3um, MZIdelta25, MZIBraggv2 (version)
+param_suffixes = ['Period', 'period', 'Dia', 'delta', 'Gap', 'gap', 'Len', 'N', 'W', 'v']
+# parameter name at the end of the type, e.g., RingDoubleTE r, rand R
+type_param_pattern = re.compile(r'^(.*[A-Z]{2})([a-z]{1,2})$|^(.*[a-z])([A-Z])$')
+groups = ['device', 'PCM', 'openEBL', 'ELEC413']
+# groups followed by the designer
+designer_groups = ['device', 'openEBL', 'ELEC413']
+
+
+def to_number(s):
+    return float(s) if '.' in s else int(s)
+
+
+def tokenize(field):
+    '''Tokens of a field: (name, None, None) or (None, number, unit)'''
+    tokens = [(name or None, to_number(number) if number else None, unit or None)
+              for number, unit, name in token_pattern.findall(field)]
+    # polarization suffix, e.g., SpiralWG40304TM
+    if len(tokens) > 1 and tokens[-1][0] in ['TE', 'TM'] and tokens[-2][0] is None:
+        tokens = tokens[:-1]
+    return tokens
+
+
+def is_parameter_field(tokens):
+    '''A field starting with a short name and a number, e.g., R7 or B30.0, is a parameter, not the type'''
+    return len(tokens) > 1 and tokens[0][0] is not None and len(tokens[0][0]) <= 2 and tokens[1][0] is None
+
+
+def split_type(device_type):
+    '''Type and the parameter name at its end, before a number: (type, name), or (type, None)'''
+    for suffix in sorted(param_suffixes, key=len, reverse=True):
+        if device_type.endswith(suffix) and len(device_type) - len(suffix) >= 2:
+            return device_type[:-len(suffix)], suffix
+    m = type_param_pattern.match(device_type)
+    if m:
+        return (m.group(1), m.group(2)) if m.group(1) else (m.group(3), m.group(4))
+    return device_type, None
+
+
+def parse_device(device, group=None):
+    '''Device type, parameters and their units, from the device name: (type, {name: value}, {name: unit})'''
+    fields = [f for f in device.split('_') if f]
+    # repeated group prefix, e.g., PCM_PCM_Bragg or PCMmziSWGA
+    if group and fields and fields[0].startswith(group) and group not in designer_groups:
+        fields[0] = fields[0][len(group):]
+    device_type = ''
+    params, units = {}, {}
+
+    def add(name, value, unit):
+        if name not in params:
+            params[name] = value
+            if unit:
+                units[name] = unit
+
+    for field in fields:
+        tokens = tokenize(field)
+        if not tokens:
+            continue
+        if not device_type and tokens[0][0] is not None and not is_parameter_field(tokens):
+            device_type, tokens = tokens[0][0], tokens[1:]
+            if tokens and tokens[0][0] is None:
+                device_type, name = split_type(device_type)
+                if name:
+                    tokens = [(name, None, None)] + tokens
+        if tokens and tokens[0][0] is None and tokens[-1][0] is not None:
+            # value before its name: 1000N316period..., 800N282nmPeriod...
+            value = None
+            for name, number, unit in tokens:
+                if name is None:
+                    value = (number, unit)
+                elif value is not None:
+                    add(name, *value)
+                    value = None
+        else:
+            # name before its value: r10g80
+            last = None
+            for name, number, unit in tokens:
+                if name is None:
+                    add(last or 'n', number, unit)
+                    last = None
+                else:
+                    last = name
+    return device_type, params, units
+
+
+def parse_label(label):
+    '''Fields of an opt_in label, or None if it is not a measurement label'''
+    m = label_pattern.match(label)
+    if not m:
+        return None
+    fields = m.group(3).split('_')
+    group, designer = None, None
+    if fields[0] in groups or fields[0].lower() == 'device':
+        group, fields = fields[0], fields[1:]
+        if group.lower() in [g.lower() for g in designer_groups] and len(fields) > 1:
+            designer, fields = fields[0], fields[1:]
+    device = '_'.join(fields)
+    device_type, params, units = parse_device(device, group)
+    return {'polarization': m.group(1), 'wavelength': int(m.group(2)), 'group': group,
+            'designer': designer, 'device': device, 'type': device_type, 'params': params, 'units': units}
+
+
+def check_labels(labels):
+    '''Labels that are not parsed as expected: [(label, message)]'''
+    problems = []
+    records = {label: parse_label(label) for label in labels}
+    # parameter names: the configured ones, and those of 3 letters or more used as parameters in the labels
+    # of at least two designers, that are not types (e.g., Period, but not MZI)
+    designers, types = {}, {r['type'] for r in records.values() if r}
+    for r in records.values():
+        for name in (r['params'] if r else []):
+            if len(name) >= 3 and name not in types:
+                designers.setdefault(name, set()).add(r['designer'])
+    names_used = set(param_suffixes) | {name for name, d in designers.items() if len(d) >= 2}
+    for label, record in records.items():
+        if record is None:
+            problems.append((label, 'not a measurement label'))
+            continue
+        for name, value in record['params'].items():
+            if not isinstance(value, (int, float)):
+                problems.append((label, 'parameter %s is not a number: %r' % (name, value)))
+            if name in ['nm', 'um']:
+                problems.append((label, 'unit %s parsed as a parameter' % name))
+        if record['type'] in groups and record['device'].split('_')[0] == record['type']:
+            problems.append((label, 'group %s parsed as the type' % record['type']))
+        # a parameter name at the end of the type, followed by its number, e.g., BraggStripPeriod320
+        suffix = [s for s in names_used if record['type'].endswith(s) and len(record['type']) - len(s) >= 2]
+        if suffix and re.search(re.escape(record['type']) + r'-?\d', record['device']):
+            problems.append((label, 'type %s ends with the parameter name %s' % (record['type'], suffix[0])))
+        names = list(record['params'])
+        if 'n' in names and names.index('n') > 0:
+            problems.append((label, 'number without a name after the parameter %s' % names[names.index('n') - 1]))
+    return problems
+
+
+def submission_name(name):
+    '''Submission file, from the cell name added by the merge (without the date suffix)'''
+    return re.sub(r'_\d{8}_\d{4}$', '', name)
+
+
+def instance_submission(it):
+    '''Submission of a shape, from the instance path of a RecursiveShapeIterator (the cells added by the merge)'''
+    names = [e.inst().cell.name for e in it.path()]
+    if len(names) > 1 and names[0] in course_cells:
+        return submission_name(names[1])
+    elif names:
+        return submission_name(names[0])
+    return ''
+
+
+def layout_labels(filename):
+    '''opt_in labels in the merged layout: [(label, x, y (microns), submission)]'''
+    import pya
+    layout = pya.Layout()
+    layout.read(filename)
+    return labels_in_layout(layout)
+
+
+def labels_in_layout(layout):
+    '''opt_in labels in a layout: [(label, x, y (microns), submission)]'''
+    import pya
+    layer_index = layout.find_layer(int(layer_text.split('/')[0]), int(layer_text.split('/')[1]))
+    out = []
+    if layer_index is None:
+        return out
+    for top_cell in layout.top_cells():
+        it = top_cell.begin_shapes_rec(layer_index)
+        it.shape_flags = pya.Shapes.STexts
+        while not it.at_end():
+            text = it.shape().text
+            if text.string.startswith('opt_in'):
+                p = (it.trans() * text).trans.disp
+                out.append((text.string, p.x * layout.dbu, p.y * layout.dbu, instance_submission(it)))
+            it.next()
+    return out
+
+
+def manifest_labels():
+    '''opt_in labels in the submissions manifest: [(label, None, None, file)]'''
+    from submission_manifest import load_manifest
+    return [(label, None, None, f) for f, e in load_manifest().items() for label in e.get('opt_in', [])]
+
+
+class LabelIndex:
+    '''Parsed labels, with sorted columns for the range queries on the parameters'''
+    def __init__(self, labels):
+        self.records = {}
+        self.fields = {}  # (field, value): set of labels
+        self.columns = {}  # parameter: ([values], [labels]), sorted by value
+        for label, x, y, submission in labels:
+            record = parse_label(label)
+            if record is None:
+                continue
+            record.update({'label': label, 'x': x, 'y': y, 'submission': submission})
+            if label in self.records:
+                # a label used more than once: keep all positions
+                self.records[label].setdefault('duplicates', []).append((x, y, submission))
+                continue
+            self.records[label] = record
+            for field in ['polarization', 'wavelength', 'group', 'designer', 'type', 'submission']:
+                self.fields.setdefault((field, record[field]), set()).add(label)
+            for name, value in record['params'].items():
+                if isinstance(value, (int, float)):
+                    self.columns.setdefault(name, []).append((value, label))
+        for name in self.columns:
+            pairs = sorted(self.columns[name])
+            self.columns[name] = ([v for v, _ in pairs], [label for _, label in pairs])
+
+    def __len__(self):
+        return len(self.records)
+
+    def range(self, name, low, high):
+        '''Labels with low <= parameter <= high'''
+        values, labels = self.columns.get(name, ([], []))
+        return set(labels[bisect.bisect_left(values, low):bisect.bisect_right(values, high)])
+
+    def query(self, **conditions):
+        '''Labels matching all the conditions: field=value, parameter=value or parameter=(low, high); sorted'''
+        result = None
+        for key, value in conditions.items():
+            if key in ['polarization', 'wavelength', 'group', 'designer', 'type', 'submission']:
+                labels = self.fields.get((key, value), set())
+            elif isinstance(value, (tuple, list)):
+                labels = self.range(key, value[0], value[1])
+            else:
+                labels = self.range(key, value, value)
+            result = labels if result is None else result & labels
+            if not result:
+                break
+        return sorted(self.records if result is None else result)
+
+    def save(self, filename, source=None):
+        with open(filename, 'w') as f:
+            json.dump({'source': source, 'labels': [(r['label'], r['x'], r['y'], r['submission'])
+                                                    for r in self.records.values()]}, f, indent=1)
+
+
+def source_key(filename):
+    st = os.stat(filename)
+    return [os.path.abspath(filename), st.st_size, st.st_mtime]
+
+
+def load_index(filename=None):
+    '''Index of the labels in the merged layout, from the saved index if the layout has not changed'''
+    filename = filename or os.path.join(path, layout_file)
+    saved = os.path.join(path, index_file)
+    if os.path.exists(saved):
+        with open(saved) as f:
+            data = json.load(f)
+        if data.get('source') == source_key(filename):
+            return LabelIndex(data['labels'])
+    index = LabelIndex(layout_labels(filename))
+    index.save(saved, source_key(filename))
+    return index
+
+
+if __name__ == '__main__':
+    import csv
+    import sys
+    import time
+    import argparse
+    parser = argparse.ArgumentParser(description='Parse and query the opt_in measurement labels')
+    parser.add_argument('--layout', default=os.path.join(path, layout_file), help='merged layout')
+    parser.add_argument('--manifest', action='store_true', help='use the submissions manifest instead of the merged layout (no positions)')
+    for field in ['type', 'designer', 'polarization', 'group', 'submission']:
+        parser.add_argument('--' + field, help='%s (exact)' % field)
+    parser.add_argument('--wavelength', type=int, help='wavelength (nm)')
+    parser.add_argument('--param', action='append', default=[], help='parameter: name=value or name=low:high')
+    parser.add_argument('--csv', action='store_true', help='write the matching labels as CSV to the standard output')
+    parser.add_argument('--check', action='store_true', help='parse all the labels in the submissions manifest, and list the problems')
+    args = parser.parse_args()
+
+    if args.check:
+        labels = sorted({label for label, _, _, _ in manifest_labels()})
+        problems = check_labels(labels)
+        for label, message in problems:
+            print('%s: %s' % (label, message))
+        print('Labels checked: %s, problems: %s' % (len(labels), len(problems)))
+        sys.exit(1 if problems else 0)
+
+    start_time = time.time()
+    index = LabelIndex(manifest_labels()) if args.manifest else load_index(args.layout)
+    load_time = time.time() - start_time
+
+    conditions = {k: getattr(args, k) for k in ['type', 'designer', 'polarization', 'group', 'submission', 'wavelength']
+                  if getattr(args, k) is not None}
+    for p in args.param:
+        name, value = p.split('=', 1)
+        conditions[name] = tuple(float(v) for v in value.split(':')) if ':' in value else float(value)
+    start_time = time.time()
+    labels = index.query(**conditions)
+    query_time = time.time() - start_time
+
+    if args.csv:
+        w = csv.writer(sys.stdout)
+        names = sorted({n for label in labels for n in index.records[label]['params']})
+        w.writerow(['label', 'x', 'y', 'submission', 'polarization', 'wavelength', 'designer', 'type'] + names)
+        for label in labels:
+            r = index.records[label]
+            w.writerow([label, r['x'], r['y'], r['submission'], r['polarization'], r['wavelength'], r['designer'], r['type']]
+                       + [r['params'].get(n, '') for n in names])
+    else:
+        for label in labels:
+            r = index.records[label]
+            position = '(%.1f, %.1f)' % (r['x'], r['y']) if r['x'] is not None else ''
+            print('%-80s %-20s %-16s %s %s' % (label, r['type'], r['designer'] or '', position,
+                                              ' '.join('%s=%s%s' % (k, v, r['units'].get(k, '')) for k, v in r['params'].items())))
+        print('Labels: %s of %s, query: %.2f ms, index: %.1f seconds' % (len(labels), len(index), 1000 * query_time, load_time))
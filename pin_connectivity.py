@@ -0,0 +1,293 @@
+'''
+Pin connectivity of a layout, with spatial hashing: disconnected pins, mismatched pin widths
+and overlapping components
+
+The same definitions as the functional verification of SiEPIC-Tools (layout_check):
+ - a component is a DevRec (68/0) shape, in the cell that contains it
+ - its optical pins are the 2-point paths on PinRec (1/10) in that cell (and its sub-cells),
+   with a text label on PinRec inside the path; the path points out of the component
+ - two pins of different components, with touching bounding boxes, are connected when
+   their centres are the same, and they face each other (180 degrees); the widths must match
+ - components overlap when their DevRec shapes overlap (touching is ok)
+The pins are read once per unique component cell, and transformed to all the instances of
+the cell at once, with array operations. The pins are matched with a hash of their centre,
+and the components with a grid of bins (bin_size), so the time is linear in the number of
+pins and components, instead of comparing all the pairs of components.
+
+Used by run_verification.py (--connectivity), after layout_check, with a comparison of the
+counts with the items of the same categories in the .lyrdb file.
+
+Usage:
+  python pin_connectivity.py submissions/EBeam_LukasChrostowski_MZI.oas [--lyrdb file.lyrdb]
+
+  from pin_connectivity import check_connectivity, report
+  result = check_connectivity(top_cell)
+  num_issues = report(result)
+
+'''
+
+# configuration
+layer_pinrec = '1/10'
+layer_devrec = '68/0'
+bin_size = 100  # microns, grid for the overlapping components
+lyrdb_categories = {'disconnected': 'Connectivity/Disconnected pin',
+                    'mismatched': 'Connectivity/Mismatched pin',
+                    'overlapping': 'Component/Overlapping component'}
+
+import os
+
+import numpy as np
+
+# path for this python file, the root of the repository
+path = os.path.dirname(os.path.realpath(__file__))
+
+
+def find_layer(layout, layer):
+    return layout.find_layer(int(layer.split('/')[0]), int(layer.split('/')[1]))
+
+
+def round_half_away(v):
+    '''Rounding as in the KLayout integer transformations'''
+    return np.sign(v) * np.floor(np.abs(v) + 0.5)
+
+
+def cell_pins(cell, layer_index):
+    '''Optical pins of a component cell, in its coordinates: (end points (n x 4), widths, names, number of invalid pins)'''
+    paths, texts = [], []
+    it = cell.begin_shapes_rec(layer_index)
+    while not it.at_end():
+        shape = it.shape()
+        if shape.is_path():
+            paths.append((it.cell_index(), shape.path.transformed(it.trans())))
+        elif shape.is_text():
+            texts.append((it.cell_index(), shape.text.transformed(it.trans())))
+        it.next()
+    ends, widths, names, invalid = [], [], [], 0
+    for cell_index, p in paths:
+        box = p.bbox()
+        # pin name: a text in the same cell, inside the path
+        name = None
+        for ci, t in texts:
+            if ci == cell_index and box.contains(t.trans.disp.to_p()):
+                name = t.string
+        points = list(p.each_point())
+        if name is None or len(points) != 2:
+            invalid += 1
+            continue
+        ends.append((points[0].x, points[0].y, points[1].x, points[1].y))
+        widths.append(p.width)
+        names.append(name)
+    return np.array(ends, dtype=float).reshape(-1, 4), np.array(widths, dtype=float), names, invalid
+
+
+def find_components(cell, layer_index):
+    '''DevRec shapes in the cell, with the cell that contains them: [(cell_index, ICplxTrans, polygon)]'''
+    components = []
+    it = cell.begin_shapes_rec(layer_index)
+    while not it.at_end():
+        shape = it.shape()
+        if shape.is_box() or shape.is_polygon() or shape.is_simple_polygon() or shape.is_path():
+            components.append((it.cell_index(), it.trans(), shape.polygon.transformed(it.trans())))
+        it.next()
+    return components
+
+
+def transform_pins(ends, widths, transformations):
+    '''Pins of one cell, in all its instances: centres, directions (m x k x 2) and widths (m x k)'''
+    angle = np.radians([t.angle for t in transformations])
+    mag = np.array([t.mag for t in transformations])
+    mirror = np.array([-1.0 if t.is_mirror() else 1.0 for t in transformations])
+    exact = np.array([t.angle % 90 == 0 for t in transformations])
+    cos = np.where(exact, np.round(np.cos(angle)), np.cos(angle))[:, None] * mag[:, None]
+    sin = np.where(exact, np.round(np.sin(angle)), np.sin(angle))[:, None] * mag[:, None]
+    dx = np.array([t.disp.x for t in transformations])[:, None]
+    dy = np.array([t.disp.y for t in transformations])[:, None]
+    m = mirror[:, None]
+
+    def transform(x, y):
+        return round_half_away(cos * x - sin * m * y + dx), round_half_away(sin * x + cos * m * y + dy)
+
+    x1, y1 = transform(ends[None, :, 0], ends[None, :, 1])
+    x2, y2 = transform(ends[None, :, 2], ends[None, :, 3])
+    # centre of the transformed pin path, rounded as in SiEPIC (Point * 0.5)
+    centres = np.stack([round_half_away((x1 + x2) / 2), round_half_away((y1 + y2) / 2)], axis=-1)
+    return centres, np.stack([x2 - x1, y2 - y1], axis=-1), round_half_away(widths[None, :] * mag[:, None])
+
+
+def match_pins(centres, directions, component, boxes):
+    '''Connected pins, with a hash of the pin centres: [(pin, pin)]; boxes: bounding boxes of the components'''
+    buckets = {}
+    for i, key in enumerate(map(tuple, centres.astype(np.int64).tolist())):
+        buckets.setdefault(key, []).append(i)
+    directions, pairs = directions.tolist(), []
+    for pins in buckets.values():
+        for a in range(len(pins)):
+            for b in range(a + 1, len(pins)):
+                i, j = pins[a], pins[b]
+                (x1, y1), (x2, y2) = directions[i], directions[j]
+                # different components, facing each other
+                if component[i] == component[j] or x1 * y2 - y1 * x2 != 0 or x1 * x2 + y1 * y2 >= 0:
+                    continue
+                # and touching components, as in layout_check: in a cell with more than one DevRec
+                # shape, each one is a component with all the pins of the cell
+                (l1, b1, r1, t1), (l2, b2, r2, t2) = boxes[component[i]], boxes[component[j]]
+                if l1 <= r2 and l2 <= r1 and b1 <= t2 and b2 <= t1:
+                    pairs.append((i, j))
+    return pairs
+
+
+def overlapping_components(polygons, dbu):
+    '''Pairs of overlapping DevRec polygons, with a grid of bins: [(component, component, overlap bounding box)]'''
+    import pya
+    if not polygons:
+        return []
+    boxes = np.array([(b.left, b.bottom, b.right, b.top) for b in (p.bbox() for p in polygons)], dtype=float)
+    size = bin_size / dbu
+    bins = np.floor(boxes / size).astype(np.int64)
+    grid = {}
+    for i, (bx1, by1, bx2, by2) in enumerate(bins.tolist()):
+        for bx in range(bx1, bx2 + 1):
+            for by in range(by1, by2 + 1):
+                grid.setdefault((bx, by), []).append(i)
+    pairs = []
+    for (bx, by), members in grid.items():
+        if len(members) < 2:
+            continue
+        idx = np.array(members)
+        b = boxes[idx]
+        # boxes overlapping (not only touching)
+        overlap = ((b[:, None, 0] < b[None, :, 2]) & (b[None, :, 0] < b[:, None, 2]) &
+                   (b[:, None, 1] < b[None, :, 3]) & (b[None, :, 1] < b[:, None, 3]))
+        # each pair only in the bin containing the lower left corner of the overlap
+        corner_x = np.floor(np.maximum(b[:, None, 0], b[None, :, 0]) / size) == bx
+        corner_y = np.floor(np.maximum(b[:, None, 1], b[None, :, 1]) / size) == by
+        for a, c in zip(*np.nonzero(np.triu(overlap & corner_x & corner_y, 1))):
+            i, j = idx[a], idx[c]
+            if polygons[i].is_box() and polygons[j].is_box():
+                pairs.append((i, j, polygons[i].bbox() & polygons[j].bbox()))
+            # the boolean of the (waveguide) polygons is slow: only for the polygons touching each other
+            elif (polygons[j].touches(polygons[i].bbox()) and polygons[i].touches(polygons[j].bbox())
+                  and polygons[i].touches(polygons[j])):
+                region = pya.Region(polygons[i]) & pya.Region(polygons[j])
+                if not region.is_empty():
+                    pairs.append((i, j, region.bbox()))
+    return sorted(pairs)
+
+
+def component_pins(layout, components):
+    '''
+    Pins of the components, read once per unique component cell, and transformed to all its instances at once:
+    (centres, directions (n x 2), widths, component indexes, [(cell_index, pin name)], number of invalid pins)
+    '''
+    layer_index = find_layer(layout, layer_pinrec)
+    groups = {}
+    for c, (cell_index, trans, polygon) in enumerate(components):
+        groups.setdefault(cell_index, []).append(c)
+    centres, directions, widths, component, names, num_invalid = [], [], [], [], [], 0
+    for cell_index, members in groups.items():
+        if layer_index is None:
+            break
+        ends, w, pin_names, invalid = cell_pins(layout.cell(cell_index), layer_index)
+        num_invalid += invalid * len(members)
+        if not len(w):
+            continue
+        c, d, w = transform_pins(ends, w, [components[i][1] for i in members])
+        centres.append(c.reshape(-1, 2))
+        directions.append(d.reshape(-1, 2))
+        widths.append(w.reshape(-1))
+        component.append(np.repeat(members, len(pin_names)))
+        names += [(cell_index, n) for _ in members for n in pin_names]
+    if not centres:
+        return np.zeros((0, 2)), np.zeros((0, 2)), np.zeros(0), np.zeros(0, dtype=int), names, num_invalid
+    return (np.concatenate(centres), np.concatenate(directions), np.concatenate(widths),
+            np.concatenate(component), names, num_invalid)
+
+
+def check_connectivity(cell):
+    '''Components, pins and connectivity issues of a cell: dict'''
+    layout = cell.layout()
+    dbu = layout.dbu
+    result = {'components': 0, 'pins': 0, 'nets': 0, 'invalid_pins': 0,
+              'disconnected': [], 'mismatched': [], 'overlapping': []}
+    layer_devrec_index = find_layer(layout, layer_devrec)
+    if layer_devrec_index is None:
+        return result
+    components = find_components(cell, layer_devrec_index)
+    result['components'] = len(components)
+
+    centres, directions, widths, component, names, result['invalid_pins'] = component_pins(layout, components)
+    if len(centres):
+        boxes = [(b.left, b.bottom, b.right, b.top) for b in (c[2].bbox() for c in components)]
+        pairs = match_pins(centres, directions, component, boxes)
+        connected = np.zeros(len(centres), dtype=bool)
+        for i, j in pairs:
+            connected[i] = connected[j] = True
+        result['pins'], result['nets'] = len(centres), len(pairs)
+
+        def pin(i):
+            return (layout.cell(names[i][0]).basic_name(), names[i][1],
+                    centres[i][0] * dbu, centres[i][1] * dbu, widths[i] * dbu)
+        result['disconnected'] = [pin(i) for i in np.nonzero(~connected)[0]]
+        result['mismatched'] = [(pin(i), pin(j)) for i, j in pairs if widths[i] != widths[j]]
+
+    result['overlapping'] = [(layout.cell(components[i][0]).basic_name(), layout.cell(components[j][0]).basic_name(), box.to_dtype(dbu))
+                             for i, j, box in overlapping_components([c[2] for c in components], dbu)]
+    return result
+
+
+def report(result, log=print, indent=' - '):
+    '''Log the connectivity issues; returns the number of issues'''
+    log('Connectivity: %s components, %s pins, %s connections, %s invalid pins' % (
+        result['components'], result['pins'], result['nets'], result['invalid_pins']))
+    for name, pin_name, x, y, w in result['disconnected']:
+        log('%sdisconnected pin: %s, %s, at (%.3f, %.3f)' % (indent, name, pin_name, x, y))
+    for p1, p2 in result['mismatched']:
+        log('%smismatched pin widths: %s, %s (%.3f), %s, %s (%.3f), at (%.3f, %.3f)' % (
+            indent, p1[0], p1[1], p1[4], p2[0], p2[1], p2[4], p1[2], p1[3]))
+    for name1, name2, box in result['overlapping']:
+        log('%soverlapping components: %s, %s, at %s' % (indent, name1, name2, box))
+    return sum(len(result[k]) for k in lyrdb_categories)
+
+
+def compare_lyrdb(result, file_lyrdb):
+    '''Counts of the issues, and of the items of the same categories in the .lyrdb file of layout_check: {issue: (count, lyrdb count)}'''
+    import pya
+    from verification_results import rdb_items
+    rdb = pya.ReportDatabase('')
+    rdb.load(file_lyrdb)
+    counts = {}
+    for row in rdb_items(rdb):
+        counts[row[0]] = counts.get(row[0], 0) + 1
+    return {k: (len(result[k]), counts.get(category, 0)) for k, category in lyrdb_categories.items()}
+
+
+def log_comparison(comparison, log=print):
+    '''Log the comparison with layout_check; returns the number of differences'''
+    n = 0
+    for k, (count, count_lyrdb) in comparison.items():
+        log('Connectivity, %s: %s, layout_check: %s%s' % (k, count, count_lyrdb, '' if count == count_lyrdb else ' (different)'))
+        n += count != count_lyrdb
+    return n
+
+
+if __name__ == '__main__':
+    import time
+    import argparse
+    import pya
+    parser = argparse.ArgumentParser(description='Pin connectivity of a layout')
+    parser.add_argument('file', help='layout file')
+    parser.add_argument('--lyrdb', default=None, help='results of layout_check, for a comparison of the counts')
+    args = parser.parse_args()
+
+    layout = pya.Layout()
+    layout.read(args.file)
+    start_time = time.time()
+    result = check_connectivity(layout.top_cell())
+    check_time = time.time() - start_time
+    n = report(result)
+    if args.lyrdb:
+        log_comparison(compare_lyrdb(result, args.lyrdb))
+    print('Check time: %.2f seconds' % check_time)
+
+    # Print the number of issues to standard output, as run_verification.py
+    print(n)
@@ -0,0 +1,156 @@
+'''
+Opt-in profiler for the merge and the verification (--profile)
+
+When enabled, for the whole run:
+ - cProfile: the Python functions, by cumulative time
+ - tracemalloc: the top allocations, by source line, and the peak memory (Python objects
+   only; the layouts are allocated by KLayout, outside of Python)
+ - spans: wall-clock time of the named sections around the KLayout calls (read, clip,
+   copy_tree, layout_check, export), with their count, total and longest time
+ - collapsed stacks for flame graphs (e.g., flamegraph.pl, speedscope), from the cProfile
+   call graph: the KLayout calls appear as frames, e.g., {method 'read' of 'Layout' objects};
+   the time of a function is split among its callers in proportion to the time of each call
+   (a stack sampler would not see the KLayout calls, which hold the Python interpreter lock)
+Output, in the given folder:
+ - <name>_profile.txt: spans, functions and allocations
+ - <name>_profile.collapsed: one line per stack, "frame;frame;... microseconds"
+
+When profiling is off, span() returns a shared no-op context manager, and nothing else runs.
+
+Usage:
+  python merge/EBeam_merge.py --profile
+  python run_verification.py submissions/EBeam_LukasChrostowski_MZI.oas --profile
+
+  from profiler import Profiler, span
+  profiler = Profiler('EBeam', folder).start()   # only when profiling
+  with span('read'):
+      layout.read(filename)
+  profiler.stop()  # writes the reports
+
+'''
+
+# configuration
+min_stack_time = 1e-4  # seconds, smaller stacks are not written
+top_functions = 40
+top_allocations = 25
+traceback_frames = 1
+
+import os
+import time
+import contextlib
+
+_null = contextlib.nullcontext()
+_active = None
+
+
+def span(name):
+    '''Context manager timing a named section, when a profiler is running'''
+    if _active is None:
+        return _null
+    return _active.span(name)
+
+
+def frame_name(func):
+    filename, line, name = func
+    if filename == '~':
+        # built-in, e.g., KLayout: {method 'read' of 'klayout.dbcore.Layout' objects}
+        return name
+    return '%s (%s:%s)' % (name, os.path.basename(filename), line)
+
+
+def collapsed_stacks(stats):
+    '''Collapsed stacks from the cProfile call graph: {stack: self time (seconds)}'''
+    callees = {}
+    for func, (cc, nc, tt, ct, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    out = {}
+
+    def walk(func, stack, funcs, fraction):
+        stack = stack + [frame_name(func)]
+        tt = stats[func][2] * fraction
+        if tt >= min_stack_time:
+            key = ';'.join(stack)
+            out[key] = out.get(key, 0) + tt
+        for callee, edge_time in callees.get(func, []):
+            total = stats[callee][3]
+            if callee in funcs or total <= 0 or edge_time * fraction < min_stack_time:
+                continue
+            walk(callee, stack, funcs | {callee}, fraction * min(1.0, edge_time / total))
+
+    for func, v in stats.items():
+        if not v[4]:
+            walk(func, [], {func}, 1.0)
+    return out
+
+
+class _Span:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+
+    def __exit__(self, *exc):
+        t = time.perf_counter() - self.start_time
+        count, total, longest = self.profiler.spans.get(self.name, (0, 0.0, 0.0))
+        self.profiler.spans[self.name] = (count + 1, total + t, max(longest, t))
+
+
+class Profiler:
+    def __init__(self, name, folder):
+        self.name = name
+        self.folder = folder
+        self.spans = {}  # name: (count, total, longest)
+
+    def start(self):
+        global _active
+        import cProfile
+        import tracemalloc
+        _active = self
+        self.start_time = time.perf_counter()
+        tracemalloc.start(traceback_frames)
+        self.cprofile = cProfile.Profile()
+        self.cprofile.enable()
+        return self
+
+    def span(self, name):
+        return _Span(self, name)
+
+    def stop(self):
+        '''Stop profiling, and write the reports; returns the report file name'''
+        global _active
+        import io
+        import pstats
+        import tracemalloc
+        self.cprofile.disable()
+        wall_time = time.perf_counter() - self.start_time
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        _active = None
+
+        lines = ['Profile: %s, wall time %.2f seconds' % (self.name, wall_time), '',
+                 'Spans (wall clock):',
+                 '  %-30s %8s %12s %12s %7s' % ('span', 'count', 'total (s)', 'longest (s)', '%')]
+        for name, (count, total, longest) in sorted(self.spans.items(), key=lambda kv: -kv[1][1]):
+            lines.append('  %-30s %8d %12.3f %12.3f %6.1f%%' % (name, count, total, longest, 100 * total / wall_time))
+
+        stream = io.StringIO()
+        pstats.Stats(self.cprofile, stream=stream).sort_stats('cumulative').print_stats(top_functions)
+        lines += ['', 'Functions (cProfile, by cumulative time):', stream.getvalue().strip()]
+
+        lines += ['', 'Allocations (tracemalloc, Python objects): current %.1f MB, peak %.1f MB' % (current / 1e6, peak / 1e6)]
+        for stat in snapshot.statistics('lineno')[:top_allocations]:
+            frame = stat.traceback[0]
+            lines.append('  %10.1f kB %8d blocks  %s:%s' % (stat.size / 1e3, stat.count, frame.filename, frame.lineno))
+
+        os.makedirs(self.folder, exist_ok=True)
+        file_report = os.path.join(self.folder, self.name + '_profile.txt')
+        with open(file_report, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        with open(os.path.join(self.folder, self.name + '_profile.collapsed'), 'w') as f:
+            for stack, t in sorted(collapsed_stacks(pstats.Stats(self.cprofile).stats).items()):
+                f.write('%s;%s %d\n' % (self.name, stack, round(t * 1e6)))
+        return file_report
@@ -7,61 +7,122 @@ from SiEPIC.utils import get_technology_by_name
 import siepic_ebeam_pdk
 import os
 import sys
+from submission_manifest import layout_entry, check_budget
+from verification_results import store_results
+from profiler import Profiler, span
+from pin_connectivity import check_connectivity, report, compare_lyrdb, log_comparison
 """
 Script to load .gds file passed in through commmand line and run verification using layout_check().
+Also used by watch_verification.py, with: from run_verification import verify
 Ouput lyrdb file is saved to path specified by 'file_lyrdb' variable in the script.
+With --profile, the verification is profiled (see profiler.py), and the reports are saved
+next to the lyrdb file: <file>_profile.txt, <file>_profile.collapsed
+With --connectivity, the pins and components are also checked with pin_connectivity.py, and
+its counts are compared with those of layout_check (the number of errors is not changed)
 
 Jasmina Brar 12/08/23, and Lukas Chrostowski
 
 """
 
-# gds file to run verification on
-gds_file = sys.argv[1]
-
-try:
-   # load into layout
-   layout = pya.Layout()
-   layout.read(gds_file)
-except:
-   print('Error loading layout')
-   num_errors = 1
-
-try:
-   # get top cell from layout
-   if len(layout.top_cells()) != 1:
-      print('Error: layout does not have 1 top cell. It has %s.' % len(layout.top_cells()))
-      num_errors += 1
-
-   top_cell = layout.top_cell()
-
-   # set layout technology because the technology seems to be empty, and we cannot load the technology using TECHNOLOGY = get_technology() because this isn't GUI mode
-   # refer to line 103 in layout_check()
-   # tech = layout.technology()
-   # print("Tech:", tech.name)
-   layout.TECHNOLOGY = get_technology_by_name('EBeam')
-
-   # run verification
-   zoom_out(top_cell)
-
-   # get file path, filename, path for output lyrdb file
-   path = os.path.dirname(os.path.realpath(__file__))
-   filename = gds_file.split(".")[0]
-   file_lyrdb = os.path.join(path,filename+'.lyrdb')
-
-   # run verification
-   num_errors = layout_check(cell = top_cell, verbose=False, GUI=True, file_rdb=file_lyrdb)
-
-   # Make sure layout extent fits within the allocated area.
-   cell_Width = 605000
-   cell_Height = 410000
-   bbox = top_cell.bbox()
-   if bbox.width() > cell_Width or bbox.height() > cell_Height:
-      print('Error: Cell bounding box / extent (%s, %s) is larger than the maximum size of %s X %s microns' % (bbox.width()/1000, bbox.height()/1000, cell_Width/1000, cell_Height/1000) )
-      num_errors += 1
-except:
-   print('Unknown error occurred')
-   num_errors = 1
-
-# Print the result value to standard output
-print(num_errors)
+def verify(gds_file, connectivity=False):
+   '''Verify one layout file, write the lyrdb next to it, and return the number of errors'''
+   file_lyrdb = None
+   try:
+      # file size budget, before loading the file
+      budget_errors = check_budget({'size': os.path.getsize(gds_file)})
+      if not budget_errors:
+         # load into layout
+         layout = pya.Layout()
+         with span('read'):
+            layout.read(gds_file)
+   except:
+      # a missing or unreadable file is counted as an error, as before
+      print('Error loading layout')
+      return 1
+   if budget_errors:
+      for error in budget_errors:
+         print('Error: layout is over the complexity budget: %s' % error)
+      return len(budget_errors)
 
+   # complexity budgets (shapes, vertices, instances, hierarchy depth), counted as in the
+   # manifest without flattening, from the layout loaded above: reject pathological files
+   # before the verification
+   with span('manifest'):
+      entry = layout_entry(gds_file, layout)
+   budget_errors = check_budget(entry)
+   if budget_errors:
+      for error in budget_errors:
+         print('Error: layout is over the complexity budget: %s' % error)
+      return len(budget_errors)
+
+   try:
+      # top cells and bounding box, as recorded in the manifest
+      # get top cell from layout
+      if len(entry['top_cells']) != 1:
+         print('Error: layout does not have 1 top cell. It has %s.' % len(entry['top_cells']))
+         num_errors += 1
+
+      top_cell = layout.top_cell()
+
+      # set layout technology because the technology seems to be empty, and we cannot load the technology using TECHNOLOGY = get_technology() because this isn't GUI mode
+      # refer to line 103 in layout_check()
+      # tech = layout.technology()
+      # print("Tech:", tech.name)
+      layout.TECHNOLOGY = get_technology_by_name('EBeam')
+
+      # run verification
+      zoom_out(top_cell)
+
+      # get file path, filename, path for output lyrdb file
+      path = os.path.dirname(os.path.realpath(__file__))
+      filename = gds_file.split(".")[0]
+      file_lyrdb = os.path.join(path,filename+'.lyrdb')
+
+      # run verification
+      with span('layout_check'):
+         num_errors = layout_check(cell = top_cell, verbose=False, GUI=True, file_rdb=file_lyrdb)
+
+      # pin connectivity with spatial hashing, compared with layout_check
+      if connectivity:
+         with span('connectivity'):
+            result = check_connectivity(top_cell)
+         report(result)
+         log_comparison(compare_lyrdb(result, file_lyrdb))
+
+      # Make sure layout extent fits within the allocated area.
+      cell_Width = 605000
+      cell_Height = 410000
+      bbox = pya.Box(*entry['bbox']) if entry['bbox'] else pya.Box()
+      if bbox.width() > cell_Width or bbox.height() > cell_Height:
+         print('Error: Cell bounding box / extent (%s, %s) is larger than the maximum size of %s X %s microns' % (bbox.width()/1000, bbox.height()/1000, cell_Width/1000, cell_Height/1000) )
+         num_errors += 1
+   except:
+      print('Unknown error occurred')
+      num_errors = 1
+
+   # add the results to the store for the whole run, verification_results.sqlite
+   if file_lyrdb and os.path.exists(file_lyrdb):
+      try:
+         with span('store results'):
+            store_results(gds_file, file_lyrdb, num_errors)
+      except Exception as e:
+         print('Warning: results not stored: %s' % e)
+
+   return num_errors
+
+
+if __name__ == '__main__':
+   # gds file to run verification on
+   gds_file = sys.argv[1]
+
+   profiler = None
+   if '--profile' in sys.argv[2:]:
+      profiler = Profiler(os.path.splitext(os.path.basename(gds_file))[0], os.path.dirname(os.path.abspath(gds_file))).start()
+
+   num_errors = verify(gds_file, connectivity='--connectivity' in sys.argv[2:])
+
+   if profiler:
+      print('Profile: %s' % profiler.stop())
+
+   # Print the result value to standard output
+   print(num_errors)
@@ -0,0 +1,281 @@
+'''
+Manifest of the layouts in the "submissions" and "framework" folders
+
+For each GDS/OAS file, the manifest records the facts that the verification and the
+merge would otherwise rediscover by loading every file:
+ - content hash (sha1), file size, date of the last commit in the Git repository
+ - top cells, database unit, bounding box of the top cell (in database units), layers
+ - course (from the filename prefix) and the opt_in measurement labels
+ - complexity of the top cell: flattened shapes, vertices and instances, and hierarchy depth,
+   counted per unique cell and multiplied by the number of placements (no flattening)
+
+The manifest is stored as JSON, and only new or modified files are scanned again.
+
+The complexity budgets protect the verification and the merge from pathological files
+(millions of shapes, deep hierarchy, huge arrays): files over budget are rejected, with
+a message, before any expensive operation. Files larger than the file size budget are
+not loaded at all. The vertices are only counted if the unique shapes are within budget.
+
+Usage:
+  python submission_manifest.py [--course ELEC413] [--capacity] [--complexity]
+
+Used by run_verification.py and merge/EBeam_merge.py:
+  from submission_manifest import load_manifest
+  manifest = load_manifest()
+  entry = manifest['submissions/EBeam_LukasChrostowski_rings.oas']
+  errors = check_budget(entry)
+
+Used by run_verification.py, for a layout it has already loaded (no manifest cache needed):
+  entry = layout_entry(gds_file, layout)
+
+'''
+
+# configuration
+folders = ['submissions', 'framework']
+manifest_file = 'submissions_manifest.json'
+layer_text = '10/0'
+manifest_version = 2
+# complexity budgets, per file
+complexity_budget = {'file_size': 100e6,  # bytes
+                     'shapes': 20e6,  # flattened
+                     'vertices': 200e6,  # flattened
+                     'depth': 20,  # hierarchy levels
+                     'instances': 2e6}  # flattened, counting each array element
+
+import os
+import json
+import hashlib
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+# path for this python file, the root of the repository
+path = os.path.dirname(os.path.realpath(__file__))
+
+
+def course_name(basefilename):
+    '''Course, from the filename prefix'''
+    if 'ebeam' in basefilename.lower():
+        return 'edXphot1x'
+    elif 'elec413' in basefilename.lower():
+        return 'ELEC413'
+    elif 'openebl' in basefilename.lower():
+        return 'openEBL'
+    elif 'siepic_passives' in basefilename.lower():
+        return 'SiEPIC_Passives'
+    else:
+        return 'openEBL'
+
+
+def file_hash(filename):
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def git_date(filename):
+    '''Date of the last commit of the file, as YYYYmmdd_HHMM, or None if it is not committed'''
+    a = subprocess.run(['git', '-C', os.path.dirname(filename), 'log', '-1', '--pretty=%ci', os.path.basename(filename)],
+                       stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    # e.g., 2024-05-18 10:20:30 -0700
+    date = a.stdout.decode('utf-8').strip()
+    if not date:
+        return None
+    return date[0:4] + date[5:7] + date[8:10] + '_' + date[11:13] + date[14:16]
+
+
+def complexity(layout, cell):
+    '''Flattened shapes, vertices and instances, and hierarchy depth, counted per unique cell'''
+    import pya
+    shapes, vertices, instances, depth = {}, {}, {}, {}
+    unique_shapes = sum(c.shapes(li).size() for c in layout.each_cell() for li in layout.layer_indexes())
+    count_vertices = unique_shapes <= complexity_budget['shapes']
+    for ci in layout.each_cell_bottom_up():
+        c = layout.cell(ci)
+        n = v = 0
+        for li in layout.layer_indexes():
+            n += c.shapes(li).size()
+            if count_vertices:
+                for s in c.shapes(li).each(pya.Shapes.SBoxes):
+                    v += 4
+                for s in c.shapes(li).each(pya.Shapes.SPolygons | pya.Shapes.SPaths):
+                    v += s.polygon.num_points()
+        i, d = 0, 0
+        for inst in c.each_inst():
+            size = inst.cell_inst.size()
+            n += size * shapes[inst.cell_index]
+            v += size * vertices[inst.cell_index]
+            i += size * (1 + instances[inst.cell_index])
+            d = max(d, depth[inst.cell_index])
+        shapes[ci], vertices[ci], instances[ci], depth[ci] = n, v, i, d + 1
+    ci = cell.cell_index()
+    return {'shapes': shapes[ci], 'vertices': vertices[ci] if count_vertices else None,
+            'instances': instances[ci], 'depth': depth[ci], 'unique_shapes': unique_shapes}
+
+
+def check_budget(entry, budget=complexity_budget):
+    '''Messages for the complexity budgets exceeded by a manifest entry'''
+    errors = []
+    if entry.get('size', 0) > budget['file_size']:
+        errors.append('file size of %s bytes exceeds the budget of %d' % (entry['size'], budget['file_size']))
+    c = entry.get('complexity') or {}
+    if c.get('vertices') is None and c.get('unique_shapes', 0) > budget['shapes']:
+        errors.append('%s unique shapes exceed the budget of %d shapes' % (c['unique_shapes'], budget['shapes']))
+    for key in ['shapes', 'vertices', 'instances', 'depth']:
+        if c.get(key) is not None and c[key] > budget[key]:
+            errors.append('%s %s exceed the budget of %d' % (c[key], 'hierarchy levels' if key == 'depth' else key, budget[key]))
+    return errors
+
+
+def scan_file(filename):
+    '''Load a layout and extract the facts for the manifest'''
+    import pya
+    entry = {'sha1': file_hash(filename), 'size': os.path.getsize(filename),
+             'git_date': git_date(filename), 'course': course_name(os.path.basename(filename))}
+    if check_budget(entry):
+        entry['error'] = 'Over the complexity budget: %s' % '; '.join(check_budget(entry))
+        return entry
+    layout = pya.Layout()
+    try:
+        layout.read(filename)
+    except Exception as e:
+        entry['error'] = 'Error loading layout: %s' % e
+        return entry
+    return scan_layout(entry, layout)
+
+
+def layout_entry(filename, layout):
+    '''
+    The manifest facts for a layout already loaded, e.g., by the verification, without
+    reading the file again; the content hash and the commit date are not computed
+    '''
+    entry = {'size': os.path.getsize(filename), 'course': course_name(os.path.basename(filename))}
+    return scan_layout(entry, layout)
+
+
+def scan_layout(entry, layout):
+    '''Add the facts from a loaded layout to a manifest entry'''
+    entry['dbu'] = round(layout.dbu, 10)
+    entry['top_cells'] = [c.name for c in layout.top_cells()]
+    entry['layers'] = sorted(li.to_s() for li in layout.layer_infos())
+    entry['bbox'] = None
+    entry['opt_in'] = []
+    if len(layout.top_cells()) > 0:
+        cell = layout.top_cells()[0]
+        for c in layout.top_cells():
+            if c.name.lower() == 'top':
+                cell = c
+        if not cell.bbox().empty():
+            bbox = cell.bbox()
+            entry['bbox'] = [bbox.left, bbox.bottom, bbox.right, bbox.top]
+        entry['complexity'] = complexity(layout, cell)
+        if check_budget(entry):
+            return entry
+        layer_index = layout.find_layer(int(layer_text.split('/')[0]), int(layer_text.split('/')[1]))
+        if layer_index is not None:
+            s = cell.begin_shapes_rec(layer_index)
+            while not s.at_end():
+                if s.shape().is_text() and s.shape().text.string.startswith('opt_in'):
+                    entry['opt_in'].append(s.shape().text.string)
+                s.next()
+    return entry
+
+
+def layout_files(folders=folders):
+    '''GDS/OAS files in the folders, relative to the repository, sorted as in the merge'''
+    files = []
+    for folder in folders:
+        _, _, names = next(os.walk(os.path.join(path, folder)), (None, None, []))
+        for f in sorted(names):
+            if '.oas' in f.lower() or '.gds' in f.lower():
+                files.append(folder + '/' + f)
+    return files
+
+
+def update_manifest(files=None, filename=None, jobs=None, verbose=False):
+    '''Load the manifest, scan the new or modified files, and save it'''
+    filename = filename or os.path.join(path, manifest_file)
+    manifest = {}
+    if os.path.exists(filename):
+        with open(filename) as f:
+            data = json.load(f)
+        if data.get('version') == manifest_version:
+            manifest = data['files']
+    all_files = files is None
+    files = layout_files() if all_files else files
+
+    todo = []
+    for f in files:
+        entry = manifest.get(f)
+        full = os.path.join(path, f)
+        # fast path: unchanged size and modification time, then the content hash
+        if entry and entry.get('size') == os.path.getsize(full) and entry.get('mtime') == os.path.getmtime(full):
+            continue
+        if entry and entry.get('sha1') == file_hash(full):
+            entry['mtime'] = os.path.getmtime(full)
+            continue
+        todo.append(f)
+
+    if todo:
+        if verbose:
+            print('Manifest: scanning %s of %s files' % (len(todo), len(files)))
+        if len(todo) == 1:
+            entries = [scan_file(os.path.join(path, todo[0]))]
+        else:
+            with ProcessPoolExecutor(max_workers=jobs) as executor:
+                entries = list(executor.map(scan_file, [os.path.join(path, f) for f in todo]))
+        for f, entry in zip(todo, entries):
+            entry['mtime'] = os.path.getmtime(os.path.join(path, f))
+            manifest[f] = entry
+    if all_files:
+        manifest = {f: manifest[f] for f in files}
+
+    with open(filename, 'w') as fp:
+        json.dump({'version': manifest_version, 'files': manifest}, fp, indent=1, sort_keys=True)
+    return manifest
+
+
+def load_manifest(files=None, jobs=None, verbose=False):
+    '''The manifest, up to date for the given files (default: all the files in the folders)'''
+    return update_manifest(files=files, jobs=jobs, verbose=verbose)
+
+
+def manifest_entry(filename):
+    '''The manifest entry for one layout file (path absolute or relative to the repository)'''
+    f = os.path.relpath(os.path.abspath(filename), path).replace(os.sep, '/')
+    if f.startswith('..'):
+        return scan_file(filename)
+    return load_manifest(files=[f])[f]
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Manifest of the submitted layouts')
+    parser.add_argument('--course', help='only list the files for this course')
+    parser.add_argument('--capacity', action='store_true', help='estimate the chip area used by the submissions')
+    parser.add_argument('--jobs', type=int, default=None, help='number of processes for scanning')
+    parser.add_argument('--complexity', action='store_true', help='list the complexity of each file, and the files over budget')
+    args = parser.parse_args()
+
+    manifest = load_manifest(jobs=args.jobs, verbose=True)
+    files = [f for f in manifest if not args.course or manifest[f].get('course') == args.course]
+    for f in files:
+        e = manifest[f]
+        bbox = e.get('bbox')
+        size = '%.1f x %.1f um' % ((bbox[2] - bbox[0]) * e['dbu'], (bbox[3] - bbox[1]) * e['dbu']) if bbox else 'empty'
+        print('%-60s %-16s %-12s %s, %s opt_in labels' % (f, e.get('course'), e.get('git_date'), size, len(e.get('opt_in', []))))
+        if args.complexity:
+            print('    %s' % e.get('complexity'))
+            for error in check_budget(e):
+                print('    Over the complexity budget: %s' % error)
+    print('Files: %s' % len(files))
+    if args.complexity:
+        print('Files over the complexity budget: %s' % len([f for f in files if check_budget(manifest[f])]))
+
+    if args.capacity:
+        # same placement pitch as in merge/EBeam_merge.py: each submission uses one cell_Width x cell_Height slot
+        cell_Height, cell_Gap_Height, chip_Height = 410000, 8000, 8780000
+        slots_per_column = (chip_Height - cell_Height - cell_Gap_Height) // (cell_Height + cell_Gap_Height)
+        slots = len([f for f in files if f.startswith('submissions/') and manifest[f].get('bbox')])
+        print('Capacity: %s submissions, %.1f columns of %s' % (slots, slots / slots_per_column, slots_per_column))
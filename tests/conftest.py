@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the scripts import their modules from their own folder
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+for folder in ['', 'merge', 'measurements']:
+    sys.path.insert(0, os.path.join(root, folder))
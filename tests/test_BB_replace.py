@@ -0,0 +1,97 @@
+import pya
+
+import EBeam_BB_replace as BB
+from cell_hash import flat_cell_hash
+
+
+def BB_cell(layout, name, box, label=None):
+    cell = layout.create_cell(name)
+    cell.shapes(layout.layer(1, 0)).insert(box)
+    if label:
+        cell.shapes(layout.layer(10, 0)).insert(pya.Text(label, pya.Trans()))
+    return cell
+
+
+def chip(*cells):
+    '''Layout with the BB cells (name, box, label), each placed twice in a submission'''
+    layout = pya.Layout()
+    top = layout.create_cell('top')
+    for i, (name, box, label) in enumerate(cells):
+        cell = BB_cell(layout, name, box, label)
+        for j in range(2):
+            top.insert(pya.CellInstArray(cell.cell_index(), pya.Trans(i * 100000, j * 100000)))
+    return layout
+
+
+def reference_of(*cells):
+    reference = {}
+    for name, box, label in cells:
+        layout = chip((name, box, label))
+        ci = layout.cell(name).cell_index()
+        reference.setdefault(name, []).append(flat_cell_hash(layout, ci, BB.layer_indexes(layout, BB.layers_hash)))
+    return reference
+
+
+gc = ('GC_TE_BB', pya.Box(0, 0, 1000, 500), 'TE')
+gc_tm = ('GC_TM_BB', pya.Box(0, 0, 1000, 500), 'TM')
+ybranch = ('Y_BB', pya.Box(0, 0, 2000, 800), None)
+
+
+def check(layout, reference, library=None):
+    messages = []
+    flagged = BB.check_and_replace(layout, reference, library, messages.append)
+    return flagged, messages
+
+
+def test_verified():
+    flagged, messages = check(chip(gc, ybranch), reference_of(gc, ybranch))
+    assert flagged == 0
+    assert ' - verified: GC_TE_BB (1 copies, 2 instances)' in messages
+
+
+def test_shared_hash_verified():
+    # two names with the same contents are each accepted under their own name
+    reference = reference_of(gc, ybranch)
+    reference['Y_copy_BB'] = reference['Y_BB']
+    flagged, messages = check(chip(('Y_copy_BB',) + ybranch[1:], ybranch), reference)
+    assert flagged == 0
+    assert ' - verified: Y_BB (1 copies, 2 instances), contents also match Y_copy_BB' in messages
+
+
+def test_labels_tell_apart():
+    reference = reference_of(gc, gc_tm)
+    assert reference['GC_TE_BB'] != reference['GC_TM_BB']
+    flagged, _ = check(chip(gc, gc_tm), reference)
+    assert flagged == 0
+
+
+def test_renamed():
+    flagged, messages = check(chip(('My_GC_BB',) + gc[1:]), reference_of(gc))
+    assert flagged == 1
+    assert any(m.startswith(' - ERROR: renamed BB cell: My_GC_BB, contents match GC_TE_BB') for m in messages)
+
+
+def test_unknown():
+    flagged, messages = check(chip(('Other_BB', pya.Box(0, 0, 10, 10), None)), reference_of(gc))
+    assert flagged == 1
+    assert any(m.startswith(' - ERROR: unknown BB cell: Other_BB') for m in messages)
+
+
+def test_modified():
+    flagged, messages = check(chip(('GC_TE_BB', pya.Box(0, 0, 1001, 500), 'TE')), reference_of(gc))
+    assert flagged == 1
+    assert any(m.startswith(' - ERROR: modified BB cell: GC_TE_BB') for m in messages)
+
+
+def test_replaced_once_per_name():
+    layout = chip(gc)
+    # a second copy of the same cell, as added by the merge for another submission
+    copy = BB_cell(layout, 'GC_TE_BB$1', gc[1], gc[2])
+    layout.cell('top').insert(pya.CellInstArray(copy.cell_index(), pya.Trans(0, 500000)))
+    library = pya.Layout()
+    BB_cell(library, 'GC_TE_BB', pya.Box(0, 0, 1000, 600))
+    flagged, messages = check(layout, reference_of(gc), library)
+    assert flagged == 0
+    assert ' - replaced: GC_TE_BB (2 copies, 3 instances)' in messages
+    assert layout.cell('GC_TE_BB$1') is None
+    assert layout.cell('top').bbox() == pya.Box(0, 0, 1000, 500600)
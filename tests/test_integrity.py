@@ -0,0 +1,66 @@
+import math
+
+import numpy as np
+import pya
+
+import EBeam_integrity as integrity
+
+
+def vertices(*polygons):
+    xy = np.array([p for polygon in polygons for p in polygon], dtype=np.float64)
+    return xy, np.array([len(polygon) for polygon in polygons], dtype=np.int64)
+
+
+rectangle = [(0, 0), (100, 0), (100, 20), (0, 20)]
+
+
+def test_polygon_width():
+    xy, counts = vertices(rectangle, [(0, 0), (50, 0), (50, 50), (0, 50)])
+    _, _, area, perimeter = integrity.polygon_metrics(xy, counts)
+    assert list(area) == [2000, 2500]
+    assert np.allclose(integrity.polygon_width(area, perimeter), [20, 50])
+    # a disk: its diameter
+    n = 256
+    disk = [(100 * math.cos(2 * math.pi * i / n), 100 * math.sin(2 * math.pi * i / n)) for i in range(n)]
+    xy, counts = vertices(disk)
+    _, _, area, perimeter = integrity.polygon_metrics(xy, counts)
+    assert abs(integrity.polygon_width(area, perimeter)[0] - 200) < 0.1
+
+
+def test_off_grid():
+    xy, counts = vertices(rectangle, [(1, 1), (3, 1), (3, 3)])
+    # scaling 0.5 (0.5 nm dbu): the odd coordinates are off the 1 nm grid
+    _, flags = integrity.check_vertices(xy, counts, 0.5, 0.001)
+    assert list(flags['off_grid'][0]) == [False, False, False, False, True, True, True]
+    for scaling in [1, 5]:
+        _, flags = integrity.check_vertices(xy, counts, scaling, 0.001)
+        assert not flags['off_grid'][0].any()
+
+
+def test_slivers_and_collapsed(monkeypatch):
+    # 0.5 nm dbu to 1 nm: a 100 nm x 200 nm strip, a 50 nm strip, and a 0.5 nm polygon that collapses
+    strip = [(0, 0), (200, 0), (200, 400), (0, 400)]
+    thin = [(0, 1000), (100, 1000), (100, 1400), (0, 1400)]
+    dot = [(1001, 1001), (1002, 1001), (1002, 1002), (1001, 1002)]
+    xy, counts = vertices(strip, thin, dot)
+    _, flags = integrity.check_vertices(xy, counts, 0.5, 0.001)
+    assert list(flags['sub_resolution'][0]) == [False, True, False]
+    assert list(flags['slivers'][0]) == [False, False, False]
+    assert list(flags['collapsed_polygons'][0]) == [False, False, True]
+    # a 60.5 nm strip becomes 60 nm: a sliver with a 60.3 nm minimum feature
+    monkeypatch.setattr(integrity, 'min_feature', 0.0603)
+    xy, counts = vertices([(1, 0), (122, 0), (122, 400), (1, 400)])
+    _, flags = integrity.check_vertices(xy, counts, 0.5, 0.001)
+    assert list(flags['slivers'][0]) == [True]
+
+
+def test_check_rescale():
+    layout = pya.Layout()
+    layout.dbu = 0.0005
+    cell = layout.create_cell('top')
+    cell.shapes(layout.layer(1, 0)).insert(pya.Box(0, 0, 1001, 400))
+    cell.shapes(layout.layer(1, 0)).insert(pya.Box(0, 1000, 2000, 1400))
+    totals, cells = integrity.check_rescale(layout, 0.5)
+    assert totals['1/0']['polygons'] == 2
+    assert totals['1/0']['off_grid'] == 2
+    assert cells == [('top', '1/0', {'off_grid': 2})]
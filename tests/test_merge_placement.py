@@ -0,0 +1,60 @@
+import pya
+
+import EBeam_merge_check as check
+from EBeam_merge_check import cell_Width, cell_Height, cell_Gap_Width, cell_Gap_Height, chip_Width
+
+
+def place(n, keepouts):
+    '''Positions of n cells, as placed by EBeam_merge.py on one die'''
+    x, y = 0, cell_Height + cell_Gap_Height
+    positions = []
+    for _ in range(n):
+        x, y = check.free_position(x, y, keepouts)
+        if x + cell_Width > chip_Width:
+            break
+        positions.append((x, y))
+        x, y = check.next_position(x, y, cell_Height)
+    return positions
+
+
+def boxes(positions):
+    return [(pya.Box(x, y, x + cell_Width, y + cell_Height), 'cell%s' % i) for i, (x, y) in enumerate(positions)]
+
+
+def test_next_position_up_the_column():
+    assert check.next_position(0, 418000, cell_Height) == (0, 418000 + cell_Height + cell_Gap_Height)
+    # a taller cell
+    assert check.next_position(0, 418000, 500000) == (0, 418000 + 500000 + cell_Gap_Height)
+
+
+def test_next_position_next_column():
+    x, y = check.next_position(0, check.chip_Height1 - cell_Height, cell_Height)
+    assert (x, y) == (cell_Width + cell_Gap_Width, cell_Height + cell_Gap_Height)
+
+
+def test_free_position_keepout():
+    keepout = [(pya.Box(0, 800000, 700000, 900000), 'framework: alignment')]
+    x, y = check.free_position(0, 418000, keepout)
+    assert (x, y) == (0, 418000 + 2 * (cell_Height + cell_Gap_Height))
+
+
+def test_full_die_no_violations():
+    layout = pya.Layout()
+    top_cell = layout.create_cell('top')
+    keepouts = check.placement_boxes(layout, top_cell)[1]
+    keepouts.append((pya.Box(2000000, 2000000, 3000000, 3000000), 'UBC_static.oas'))
+    positions = place(1000, keepouts)
+    assert 100 < len(positions) < 1000
+    submissions = boxes(positions)
+    assert check.find_overlaps(submissions, keepouts) == []
+    assert check.check_chip_boundary(submissions) == []
+    # the die is full
+    x, y = check.next_position(*positions[-1], cell_Height)
+    assert check.free_position(x, y, keepouts)[0] + cell_Width > chip_Width
+
+
+def test_overlaps_found():
+    submissions = boxes([(0, 0), (cell_Width // 2, 0)])
+    keepouts = [(pya.Box(0, 0, 10, 10), 'keep-out')]
+    kinds = sorted(v[0] for v in check.find_overlaps(submissions, keepouts))
+    assert kinds == ['Keep-out', 'Overlap']
@@ -0,0 +1,58 @@
+import pytest
+
+from opt_in_labels import parse_label, check_labels, split_type, submission_name
+
+
+@pytest.mark.parametrize('label, designer, device_type, params, units', [
+    ('opt_in_TE_1550_device_LukasChrostowski_RingDoubleTEr10g80',
+     'LukasChrostowski', 'RingDoubleTE', {'r': 10, 'g': 80}, {}),
+    ('opt_in_TE_1550_device_Jane_BraggStripPeriod320DW30',
+     'Jane', 'BraggStrip', {'Period': 320, 'DW': 30}, {}),
+    ('opt_in_TE_1550_device_Jane_MZIBraggv2', 'Jane', 'MZIBragg', {'v': 2}, {}),
+    ('opt_in_TE_1310_PCM_PCM_Bragg_O_800N282nmPeriod350nmW15nmdW0Apo',
+     None, 'Bragg', {'N': 800, 'Period': 282, 'W': 350, 'dW': 15, 'Apo': 0},
+     {'Period': 'nm', 'W': 'nm', 'dW': 'nm'}),
+    ('opt_in_TM_1550_device_Jane_SpiralWG40304TM', 'Jane', 'SpiralWG', {'n': 40304}, {}),
+    ('opt_in_TE_1550_openEBL_Jane_R7_B30.0_MZI', 'Jane', 'MZI', {'R': 7, 'B': 30.0}, {}),
+])
+def test_parse_label(label, designer, device_type, params, units):
+    record = parse_label(label)
+    assert record['designer'] == designer
+    assert record['type'] == device_type
+    assert record['params'] == params
+    assert record['units'] == units
+
+
+def test_parse_label_fields():
+    record = parse_label('opt_in_TM_1310_device_Jane_Ring_r10')
+    assert (record['polarization'], record['wavelength'], record['group']) == ('TM', 1310, 'device')
+    assert parse_label('hello') is None
+
+
+def test_split_type():
+    assert split_type('BraggStripPeriod') == ('BraggStrip', 'Period')
+    assert split_type('RingDoubleTEr') == ('RingDoubleTE', 'r')
+    # only split before a number
+    assert parse_label('opt_in_TE_1550_device_Jane_Chebyshev_r10')['type'] == 'Chebyshev'
+    # the suffix is not the whole type
+    assert split_type('Wv') == ('Wv', None)
+
+
+def test_check_labels():
+    labels = ['opt_in_TE_1550_device_A_Ring_r10Width500',
+              'opt_in_TE_1550_device_B_Ring_r10Width500',
+              # Width is a parameter name of two designers
+              'opt_in_TE_1550_device_C_RingWidth500',
+              # a number without a name after a named parameter
+              'opt_in_TE_1550_device_C_Ring_r10_5',
+              'opt_in_TE_1550_device_C_Chebyshev',
+              'hello']
+    assert check_labels(labels) == [
+        ('opt_in_TE_1550_device_C_RingWidth500', 'type RingWidth ends with the parameter name Width'),
+        ('opt_in_TE_1550_device_C_Ring_r10_5', 'number without a name after the parameter r'),
+        ('hello', 'not a measurement label')]
+
+
+def test_submission_name():
+    assert submission_name('openEBL_Jane.gds_20261019_0537') == 'openEBL_Jane.gds'
+    assert submission_name('openEBL_Jane.gds') == 'openEBL_Jane.gds'
@@ -0,0 +1,183 @@
+'''
+Store of the verification results, for a whole verification run
+
+run_verification.py writes one .lyrdb file per submission. The results are also added to
+one SQLite database, verification_results.sqlite, indexed by run, file, check category,
+cell and location, so that a whole run can be triaged with one query, e.g., which designs
+have disconnected pins. Each item is stored with its category (e.g., "Connectivity/
+Disconnected pin"), cell, description, bounding box (microns) and values, so the .lyrdb
+file of a submission can be exported again from the store.
+
+The run is identified by VERIFICATION_RUN or GITHUB_RUN_ID (in the GitHub Action),
+or "local"; verifying a file again replaces its results in the run.
+
+Usage:
+  python verification_results.py [--run latest] [--summary]
+  python verification_results.py --category "Disconnected pin" [--file rings] [--cell name] [--box x1,y1,x2,y2]
+  python verification_results.py --export submissions/EBeam_LukasChrostowski_rings.oas [--run ID]
+
+'''
+
+# configuration
+results_file = 'verification_results.sqlite'
+
+import os
+import sqlite3
+from datetime import datetime
+
+# path for this python file, the root of the repository
+path = os.path.dirname(os.path.realpath(__file__))
+
+schema = '''
+create table if not exists files (run text, file text, num_errors integer, sha1 text, date text, primary key (run, file));
+create table if not exists results (run text, file text, category text, cell text, description text,
+                                    left real, bottom real, right real, top real, vals text);
+create index if not exists results_file on results (run, file);
+create index if not exists results_category on results (category);
+create index if not exists results_cell on results (cell);
+create index if not exists results_location on results (left, bottom);
+'''
+
+
+def connect(filename=None):
+    db = sqlite3.connect(filename or os.path.join(path, results_file))
+    db.executescript(schema)
+    return db
+
+
+def current_run():
+    return os.environ.get('VERIFICATION_RUN') or os.environ.get('GITHUB_RUN_ID') or 'local'
+
+
+def category_path(rdb, category_id):
+    '''Category name, with its parents, e.g., Connectivity/Disconnected pin'''
+    c = rdb.category_by_id(category_id)
+    names = []
+    while c is not None:
+        names.insert(0, c.name())
+        c = c.parent()
+    return '/'.join(names)
+
+
+def rdb_items(rdb):
+    '''The items of a report database, as rows (category, cell, description, left, bottom, right, top, values)'''
+    import pya
+    for item in rdb.each_item():
+        box = pya.DBox()
+        description, values = [], []
+        for v in item.each_value():
+            values.append(v.to_s())
+            if v.is_string():
+                description.append(v.string())
+            elif v.is_box():
+                box += v.box()
+            elif v.is_polygon():
+                box += v.polygon().bbox()
+            elif v.is_path():
+                box += v.path().bbox()
+            elif v.is_edge():
+                box += v.edge().bbox()
+            elif v.is_edge_pair():
+                box += v.edge_pair().bbox()
+        cell = rdb.cell_by_id(item.cell_id())
+        b = [None] * 4 if box.empty() else [box.left, box.bottom, box.right, box.top]
+        yield [category_path(rdb, item.category_id()), cell.name() if cell else '', '; '.join(description)] + b + ['\n'.join(values)]
+
+
+def store_results(filename, file_lyrdb, num_errors, run=None, db=None):
+    '''Add the results of one file (from its .lyrdb) to the store, replacing previous results in the run'''
+    import pya
+    from submission_manifest import file_hash
+    run = run or current_run()
+    f = os.path.relpath(os.path.abspath(filename), path).replace(os.sep, '/')
+    rdb = pya.ReportDatabase('')
+    rdb.load(file_lyrdb)
+    db = db or connect()
+    with db:
+        db.execute('delete from results where run = ? and file = ?', (run, f))
+        db.execute('insert or replace into files values (?, ?, ?, ?, ?)',
+                   (run, f, num_errors, file_hash(filename), datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        # streamed from the report database, without building a list
+        db.executemany('insert into results values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       ([run, f] + row for row in rdb_items(rdb)))
+
+
+def latest_run(db):
+    row = db.execute('select run from files order by date desc limit 1').fetchone()
+    return row[0] if row else None
+
+
+def query(db, run, category=None, file=None, cell=None, box=None):
+    '''Results of a run, filtered by category, file and cell (substrings), and location (overlapping box)'''
+    sql = 'select file, category, cell, description, left, bottom, right, top from results where run = ?'
+    args = [run]
+    for column, value in [('category', category), ('file', file), ('cell', cell)]:
+        if value:
+            sql += ' and %s like ?' % column
+            args.append('%' + value + '%')
+    if box:
+        sql += ' and left <= ? and right >= ? and bottom <= ? and top >= ?'
+        args += [box[2], box[0], box[3], box[1]]
+    return db.execute(sql + ' order by file, category', args).fetchall()
+
+
+def export_lyrdb(db, run, filename, file_lyrdb):
+    '''Write the .lyrdb file of one file, from the store'''
+    import pya
+    f = os.path.relpath(os.path.abspath(filename), path).replace(os.sep, '/')
+    rdb = pya.ReportDatabase('Verification results: %s' % f)
+    categories, cells = {}, {}
+    n = 0
+    for category, cell, vals in db.execute('select category, cell, vals from results where run = ? and file = ?', (run, f)):
+        if category not in categories:
+            parent = None
+            for i, name in enumerate(category.split('/')):
+                key = '/'.join(category.split('/')[:i + 1])
+                if key not in categories:
+                    categories[key] = rdb.create_category(parent, name) if parent else rdb.create_category(name)
+                parent = categories[key]
+        if cell not in cells:
+            cells[cell] = rdb.create_cell(cell)
+        item = rdb.create_item(cells[cell].rdb_id(), categories[category].rdb_id())
+        n += 1
+        for v in vals.split('\n') if vals else []:
+            item.add_value(pya.RdbItemValue.from_s(v))
+    rdb.save(file_lyrdb)
+    return n
+
+
+if __name__ == '__main__':
+    import time
+    import argparse
+    parser = argparse.ArgumentParser(description='Query the verification results store')
+    parser.add_argument('--run', default='latest', help='run identifier (default: the latest)')
+    parser.add_argument('--category', help='check category, e.g., "Disconnected pin"')
+    parser.add_argument('--file', help='submission file (substring)')
+    parser.add_argument('--cell', help='cell name (substring)')
+    parser.add_argument('--box', help='location: x1,y1,x2,y2, in microns')
+    parser.add_argument('--summary', action='store_true', help='number of errors per file, and per category')
+    parser.add_argument('--export', help='write the .lyrdb file of this submission, from the store')
+    args = parser.parse_args()
+
+    db = connect()
+    run = latest_run(db) if args.run == 'latest' else args.run
+    start_time = time.time()
+    if args.export:
+        file_lyrdb = os.path.splitext(args.export)[0] + '.lyrdb'
+        print('Exported %s items: %s' % (export_lyrdb(db, run, args.export, file_lyrdb), file_lyrdb))
+    elif args.summary:
+        print('Run: %s' % run)
+        for f, num_errors in db.execute('select file, num_errors from files where run = ? and num_errors > 0 order by num_errors desc', (run,)):
+            print('%-70s %6d errors' % (f, num_errors))
+        for category, n, files in db.execute('select category, count(*), count(distinct file) from results where run = ? group by category order by 2 desc', (run,)):
+            print('%-60s %6d items, %4d files' % (category, n, files))
+        n_files, n_errors = db.execute('select count(*), count(case when num_errors > 0 then 1 end) from files where run = ?', (run,)).fetchone()
+        print('Files: %s, with errors: %s' % (n_files, n_errors))
+    else:
+        box = [float(v) for v in args.box.split(',')] if args.box else None
+        rows = query(db, run, args.category, args.file, args.cell, box)
+        for f, category, cell, description, left, bottom, right, top in rows:
+            location = '(%.3f,%.3f;%.3f,%.3f)' % (left, bottom, right, top) if left is not None else ''
+            print('%-50s %-40s %-30s %s %s' % (f, category, cell, location, description))
+        print('Results: %s, in %s files (run %s)' % (len(rows), len(set(r[0] for r in rows)), run))
+    print('Query time: %.1f ms' % (1000 * (time.time() - start_time)))
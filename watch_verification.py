@@ -0,0 +1,122 @@
+'''
+Local watch mode: re-verify the submissions as they change
+
+Monitors the "submissions" folder (GDS/OAS files) and "submissions/KLayout Python" (scripts).
+When a file changes, and has not changed again for the debounce time (e.g., while the
+layout is being saved), only that file is processed:
+ - a Python script is run, in this process, to regenerate its layout (same basename,
+   in the "submissions" folder), and the layout is verified
+ - a layout is verified
+The verification is the same as in the GitHub Action (run_verification.py), and the
+.lyrdb file is written next to the layout. SiEPIC-Tools and the PDK are loaded once,
+when the watch starts, so each verification only takes seconds, offline.
+
+Usage:
+  python watch_verification.py [--interval 0.5] [--debounce 1.0]
+  python watch_verification.py --once submissions/EBeam_LukasChrostowski_MZI.oas
+
+'''
+
+# configuration
+folder_layouts = 'submissions'
+folder_scripts = 'submissions/KLayout Python'
+interval = 0.5  # seconds between polls
+debounce = 1.0  # seconds without changes before a file is processed
+
+import os
+import sys
+import time
+import runpy
+import argparse
+
+# path for this python file, the root of the repository
+path = os.path.dirname(os.path.realpath(__file__))
+
+
+def watched_files():
+    '''Modification time and size of the layouts and scripts: {path relative to the repository: (mtime, size)}'''
+    out = {}
+    for folder, extensions in [(folder_layouts, ('.gds', '.oas')), (folder_scripts, ('.py',))]:
+        _, _, names = next(os.walk(os.path.join(path, folder)), (None, None, []))
+        for f in names:
+            if f.lower().endswith(extensions):
+                filename = folder + '/' + f
+                try:
+                    st = os.stat(os.path.join(path, filename))
+                except OSError:
+                    continue
+                out[filename] = (st.st_mtime, st.st_size)
+    return out
+
+
+def script_output(script):
+    '''The layout generated by a script: same basename, in the submissions folder'''
+    basename = os.path.splitext(os.path.basename(script))[0]
+    outputs = [folder_layouts + '/' + basename + ext for ext in ['.oas', '.gds']]
+    outputs = [f for f in outputs if os.path.exists(os.path.join(path, f))]
+    return max(outputs, key=lambda f: os.path.getmtime(os.path.join(path, f))) if outputs else None
+
+
+def process(filename, verify):
+    '''Regenerate (for a script) and verify one file'''
+    start_time = time.time()
+    if filename.endswith('.py'):
+        print('%s: running the script' % filename)
+        try:
+            runpy.run_path(os.path.join(path, filename), run_name='__main__')
+        except (Exception, SystemExit) as e:
+            print('%s: ERROR running the script: %s' % (filename, e))
+            return
+        filename = script_output(filename)
+        if not filename:
+            print('  ERROR: the script did not generate a layout in the %s folder' % folder_layouts)
+            return
+    print('%s: verifying' % filename)
+    num_errors = verify(filename)
+    print('%s: %s errors, %.1f seconds, %s' % (
+        filename, num_errors, time.time() - start_time, os.path.splitext(filename)[0] + '.lyrdb'))
+
+
+def watch(verify, interval=interval, debounce=debounce):
+    snapshot = watched_files()
+    pending = {}  # filename: time of the last change
+    print('Watching %s files in %s and %s (Ctrl-C to stop)' % (len(snapshot), folder_layouts, folder_scripts))
+    while True:
+        time.sleep(interval)
+        current = watched_files()
+        for filename, stat in current.items():
+            if snapshot.get(filename) != stat:
+                pending[filename] = time.time()
+        snapshot = current
+        ready = [f for f in sorted(pending, key=pending.get) if time.time() - pending[f] >= debounce]
+        for filename in ready:
+            del pending[filename]
+            if filename in current:
+                process(filename, verify)
+        if ready:
+            # ignore the changes made by the processing itself, e.g., a regenerated layout
+            snapshot = watched_files()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Watch the submissions, and re-verify the changed files')
+    parser.add_argument('--interval', type=float, default=interval, help='seconds between polls')
+    parser.add_argument('--debounce', type=float, default=debounce, help='seconds without changes before a file is processed')
+    parser.add_argument('--once', help='process one file (layout or script), and exit')
+    args = parser.parse_args()
+
+    once = os.path.relpath(os.path.abspath(args.once), path).replace(os.sep, '/') if args.once else None
+
+    # relative paths, as in the GitHub Action
+    os.chdir(path)
+    sys.path.insert(0, path)
+    # loads SiEPIC-Tools and the PDK once
+    from run_verification import verify
+
+    if once:
+        process(once, verify)
+    else:
+        try:
+            watch(verify, args.interval, args.debounce)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,401 @@
+'''
+Waveguide lengths and bends, for all the waveguides of the merged chip or of a submission,
+with the nearest opt_in device
+
+The guiding path of each waveguide is read once per unique waveguide cell:
+ - a path on the Waveguide layer (1/99), when the layout has one, or
+ - the points of the SiEPIC Waveguide, in its DevRec text (Spice_param: ... points="[[x,y],...]"
+   radius=...); in the static GDS/OAS files, the Waveguide layer only has the polygons
+The statistics of all the paths are computed at once, with array operations over the points:
+ - path length (the segments), and the length with the bends replaced by arcs of the bend
+   radius; the length computed by SiEPIC (wg_length, including the Bezier bends) when available
+ - bends: number of vertices where the path turns, total turning angle (degrees), bend radius,
+   and the number of segments too short for the bends at their ends, with this radius
+Each instance of a waveguide is associated with the nearest opt_in label (from its end points),
+in the same submission if that has opt_in labels (opt_in_labels.py). For a submission file,
+rather than the merged chip, the submission is the file name.
+
+Output:
+- <layout>_waveguides.csv: one row per waveguide instance
+- <layout>_waveguides_devices.csv: one row per opt_in device: waveguides, total and longest
+  lengths; for the MZIs, the length difference of the two arms, and an estimate of the FSR (nm) = wavelength^2 / (group_index x
+  length difference). The ends of the waveguides are matched to the pins (PinRec) of the
+  components they touch; an arm is a chain of waveguides between the same two components,
+  joined end to end, or through components with two pins (e.g., a spiral, a taper), whose
+  length is estimated as half the perimeter of their merged Si, less the pin width (exact
+  for a strip of any width, longer for a corrugated waveguide). The arms are chained over
+  the whole layout, and each pair of components goes to the label of most of its waveguides.
+  The two arms with the largest length difference are used.
+- the number of waveguides, on the last line of the standard output
+
+Usage:
+  python waveguide_lengths.py [merge/EBeam.oas | submissions/file.oas]
+
+'''
+
+# configuration
+layer_waveguide = '1/99'
+layer_devrec = '68/0'
+layer_si = '1/0'
+default_radius = 5  # microns, for the paths without a radius
+min_turn = 1e-6  # radians, smaller turns are not bends
+group_index = {1550: 4.2, 1310: 4.4}  # strip waveguide, 500 nm x 220 nm, approximate
+
+import os
+import re
+import csv
+import json
+import time
+import argparse
+
+import numpy as np
+
+from opt_in_labels import LabelIndex, labels_in_layout, instance_submission, course_cells
+from pin_connectivity import find_layer, find_components, component_pins
+
+# path for this python file, the root of the repository
+path = os.path.dirname(os.path.realpath(__file__))
+
+spice_pattern = re.compile(r'^Spice_param:')
+points_pattern = re.compile(r'points="(\[.*?\]\])"')
+
+
+def spice_value(text, name):
+    m = re.search(r'\b%s=([-+0-9.eE]+)' % name, text)
+    return float(m.group(1)) if m else None
+
+
+def waveguide_paths(layout, cell):
+    '''Guiding paths of the waveguides in the cell: ({(cell_index, shape): (points (n x 2, microns), radius, SiEPIC length)}, [(key, DCplxTrans, submission)])'''
+    import pya
+    dbu = layout.dbu
+    paths, instances = {}, []
+    layer_index = layout.find_layer(int(layer_waveguide.split('/')[0]), int(layer_waveguide.split('/')[1]))
+    if layer_index is not None:
+        it = cell.begin_shapes_rec(layer_index)
+        it.shape_flags = pya.Shapes.SPaths
+        while not it.at_end():
+            # a cell with more than one path: each path is a waveguide, in the cell coordinates
+            path = it.shape().path.to_dtype(dbu)
+            key = (it.cell_index(), it.shape().to_s())
+            if key not in paths:
+                paths[key] = (np.array([(p.x, p.y) for p in path.each_point()]), default_radius, None)
+            instances.append((key, it.dtrans(), instance_submission(it)))
+            it.next()
+    with_paths = {key[0] for key in paths}
+    layer_index = layout.find_layer(int(layer_devrec.split('/')[0]), int(layer_devrec.split('/')[1]))
+    if layer_index is not None:
+        it = cell.begin_shapes_rec(layer_index)
+        it.shape_flags = pya.Shapes.STexts
+        while not it.at_end():
+            text = it.shape().text
+            if it.cell_index() not in with_paths and spice_pattern.match(text.string):
+                m = points_pattern.search(text.string)
+                if m:
+                    key = (it.cell_index(), '')
+                    if key not in paths:
+                        # points in microns, in the cell coordinates
+                        radius = spice_value(text.string, 'radius')
+                        length = spice_value(text.string, 'wg_length')
+                        paths[key] = (np.array(json.loads(m.group(1)), dtype=float).reshape(-1, 2),
+                                      radius * 1e6 if radius else default_radius, length * 1e6 if length else None)
+                    instances.append((key, it.dtrans(), instance_submission(it)))
+            it.next()
+    return paths, instances
+
+
+def path_statistics(points, counts, radius):
+    '''Per path: length, length with arcs, bends, total turning angle (degrees), segments too short for the bends'''
+    starts = np.cumsum(counts) - counts
+    segment = np.diff(points, axis=0)
+    length = np.hypot(segment[:, 0], segment[:, 1])
+    # segments within a path: not from the last point of a path to the first of the next
+    inside = np.ones(len(segment), dtype=bool)
+    inside[(starts + counts - 1)[:-1]] = False
+    length = np.where(inside, length, 0)
+    # turning angle at each vertex: between the segment before and after it
+    a1, a2 = segment[:-1], segment[1:]
+    turn = np.abs(np.arctan2(a1[:, 0] * a2[:, 1] - a1[:, 1] * a2[:, 0], (a1 * a2).sum(axis=1)))
+    vertex = inside[:-1] & inside[1:] & (length[:-1] > 0) & (length[1:] > 0)
+    turn = np.where(vertex & (turn > min_turn), turn, 0)
+    path_index = np.repeat(np.arange(len(counts)), counts)
+    r = radius[path_index[1:-1]] if len(turn) else np.zeros(0)
+    # arc instead of the corner: shorter by r (2 tan(a/2) - a); the corner needs r tan(a/2) on each segment
+    need = r * np.tan(turn / 2)
+    saving = 2 * need - r * turn
+    available = length.copy()
+    available[:-1] -= need
+    available[1:] -= need
+    too_close = (available < -1e-6) & inside
+    n = len(counts)
+    seg_path, vertex_path = path_index[:-1], path_index[1:-1]
+    total = np.bincount(seg_path, length, n)
+    return {'length_path': total,
+            'length_arcs': total - np.bincount(vertex_path, saving, n),
+            'bends': np.bincount(vertex_path, turn > 0, n).astype(int),
+            'turn': np.degrees(np.bincount(vertex_path, turn, n)),
+            'too_close': np.bincount(seg_path, too_close, n).astype(int)}
+
+
+def nearest_labels(ends, submissions, labels):
+    '''Nearest opt_in label of each waveguide, from its end points (n x 4): ([label], [distance])'''
+    out_labels, out_distance = [None] * len(ends), np.full(len(ends), np.nan)
+    if not labels:
+        return out_labels, out_distance
+    xy = np.array([(x, y) for _, x, y, _ in labels])
+    by_submission = {}
+    for i, (_, _, _, s) in enumerate(labels):
+        by_submission.setdefault(s, []).append(i)
+    groups = {}
+    for i, s in enumerate(submissions):
+        groups.setdefault(s if s in by_submission else None, []).append(i)
+    for s, members in groups.items():
+        candidates = np.array(by_submission[s]) if s is not None else np.arange(len(labels))
+        e = ends[members]
+        d = np.minimum(np.hypot(e[:, None, 0] - xy[None, candidates, 0], e[:, None, 1] - xy[None, candidates, 1]),
+                       np.hypot(e[:, None, 2] - xy[None, candidates, 0], e[:, None, 3] - xy[None, candidates, 1]))
+        nearest = d.argmin(axis=1)
+        for k, i in enumerate(members):
+            out_labels[i] = labels[candidates[nearest[k]]][0]
+            out_distance[i] = d[k, nearest[k]]
+    return out_labels, out_distance
+
+
+def end_ports(layout, cell, ends, waveguide_cells):
+    '''
+    The component whose pin (PinRec) each end of the waveguides touches, other than a waveguide: (n x 2 component
+    indexes, -1 if none; n x 2 lengths (microns) of these components if they have two pins, else nan; n x 2 lengths
+    of the components with two pins followed to the component on their other pin, e.g., a taper to a y-branch, else 0)
+    '''
+    import pya
+    ports, port_lengths, extra = np.full((len(ends), 2), -1), np.full((len(ends), 2), np.nan), np.zeros((len(ends), 2))
+    layer_index = find_layer(layout, layer_devrec)
+    if layer_index is None:
+        return ports, port_lengths, extra
+    components = find_components(cell, layer_index)
+    centres, _, widths, component, _, _ = component_pins(layout, components)
+    pins, component_points = {}, {}
+    for (x, y), c in zip(centres.astype(np.int64).tolist(), component.tolist()):
+        if components[c][0] not in waveguide_cells:
+            pins.setdefault((x, y), []).append(c)
+            component_points.setdefault(c, []).append((x, y))
+    # the ends in dbu, with a tolerance of 1 dbu for the rounding of the points in microns
+    offsets = [(0, 0)] + [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+
+    def touching(x, y, exclude=-1):
+        for dx, dy in offsets:
+            for c in pins.get((x + dx, y + dy), []):
+                if c != exclude:
+                    return c
+        return -1
+    points = np.rint(ends / layout.dbu).astype(np.int64).reshape(-1, 2).tolist()
+    for k, (x, y) in enumerate(points):
+        ports[k // 2, k % 2] = touching(x, y)
+    # length of the components with two pins: half the perimeter of the Si, less the width, once per unique cell
+    num_pins = np.bincount(component, minlength=len(components))
+    layer_index = find_layer(layout, layer_si)
+    perimeters = {}
+    for k, c in enumerate(ports.reshape(-1).tolist()):
+        if c < 0 or num_pins[c] != 2 or layer_index is None:
+            continue
+        cell_index, trans, _ = components[c]
+        if cell_index not in perimeters:
+            region = pya.Region(layout.cell(cell_index).begin_shapes_rec(layer_index))
+            perimeters[cell_index] = region.merged().perimeter()
+        # the pin widths are already transformed to the instance
+        length = (perimeters[cell_index] * trans.mag / 2 - widths[component == c].mean()) * layout.dbu
+        other = [touching(x, y, c) for x, y in component_points[c] if abs(x - points[k][0]) > 1 or abs(y - points[k][1]) > 1]
+        if other and other[0] >= 0:
+            ports[k // 2, k % 2], extra[k // 2, k % 2] = other[0], length
+        else:
+            port_lengths[k // 2, k % 2] = length
+    return ports, port_lengths, extra
+
+
+def waveguide_table(layout, cell, submission=None):
+    '''One row per waveguide instance, with the nearest opt_in label; submission: for all the waveguides, e.g., the file name'''
+    import pya
+    paths, instances = waveguide_paths(layout, cell)
+    if submission is not None:
+        instances = [(key, t, submission) for key, t, _ in instances]
+    keys = list(paths)
+    rows = []
+    if not keys:
+        return rows
+    counts = np.array([len(paths[k][0]) for k in keys])
+    stats = path_statistics(np.concatenate([paths[k][0] for k in keys]), counts,
+                            np.array([paths[k][1] for k in keys], dtype=float))
+    index = {k: i for i, k in enumerate(keys)}
+    # end points of each instance, in the top cell
+    ends = []
+    for key, t, _ in instances:
+        p1, p2 = t * pya.DPoint(*paths[key][0][0]), t * pya.DPoint(*paths[key][0][-1])
+        ends.append((p1.x, p1.y, p2.x, p2.y))
+    ends = np.array(ends).reshape(-1, 4)
+    ports, port_lengths, extra = end_ports(layout, cell, ends, {key[0] for key in keys})
+    # the SiEPIC length if available, else with the arcs
+    lengths = np.array([(paths[key][2] if paths[key][2] is not None else stats['length_arcs'][index[key]]) * t.mag
+                        for key, t, _ in instances])
+    arm, arms = waveguide_arms(ends, ports, lengths + extra.sum(axis=1), port_lengths, layout.dbu)
+    labels = labels_in_layout(layout)
+    if submission is not None:
+        labels = [(label, x, y, submission) for label, x, y, _ in labels]
+    labels, distance = nearest_labels(ends, [s for _, _, s in instances], labels)
+    for n, (key, t, submission) in enumerate(instances):
+        i = index[key]
+        points, radius, length = paths[key]
+        rows.append({'cell': layout.cell(key[0]).name, 'submission': submission,
+                     'x1': ends[n, 0], 'y1': ends[n, 1], 'x2': ends[n, 2], 'y2': ends[n, 3],
+                     'length': lengths[n],
+                     'length_path': stats['length_path'][i] * t.mag, 'length_arcs': stats['length_arcs'][i] * t.mag,
+                     'length_siepic': length * t.mag if length is not None else None,
+                     'points': len(points), 'bends': stats['bends'][i], 'turn': stats['turn'][i],
+                     'radius': radius * t.mag, 'too_close': stats['too_close'][i],
+                     'opt_in': labels[n], 'distance': distance[n],
+                     'arm': arm[n], 'arm_length': arms[arm[n]][0], 'arm_ends': arms[arm[n]][1]})
+    return rows
+
+
+def waveguide_arms(ends, ports, lengths, port_lengths, dbu):
+    '''
+    The arms: chains of waveguides, joined end to end, or through a component with two pins.
+    ends: n x 4 end points (microns); ports: n x 2 component indexes at the ends (-1 if none); port_lengths: n x 2
+    lengths of these components if they have two pins (else nan).
+    Returns the arm of each waveguide, and per arm: (length, (component, component) at its ends, or None)
+    '''
+    n = len(ports)
+    group = list(range(n))
+
+    def root(i):
+        while group[i] != i:
+            group[i] = group[group[i]]
+            i = group[i]
+        return i
+    inner = np.zeros((n, 2), dtype=bool)  # ends joined to another waveguide, or through a component
+    # ends without a component, at the end of another waveguide (1 dbu tolerance)
+    free = {}
+    points = np.rint(ends / dbu).astype(np.int64).reshape(-1, 2).tolist()
+    offsets = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+    for k, (x, y) in enumerate(points):
+        if ports[k // 2, k % 2] >= 0:
+            continue
+        for dx, dy in offsets:
+            other = free.get((x + dx, y + dy))
+            if other is not None and other // 2 != k // 2:
+                group[root(k // 2)] = root(other // 2)
+                inner[k // 2, k % 2] = inner[other // 2, other % 2] = True
+                break
+        free.setdefault((x, y), k)
+    # components with two pins, touched by two waveguides
+    through = {}
+    for i, k in zip(*np.nonzero((ports >= 0) & ~np.isnan(port_lengths))):
+        through.setdefault(ports[i, k], []).append((i, k))
+    extra = {}
+    for c, members in through.items():
+        if len(members) == 2 and members[0][0] != members[1][0]:
+            (i, ki), (j, kj) = members
+            group[root(i)] = root(j)
+            inner[i, ki] = inner[j, kj] = True
+            extra[c] = (i, port_lengths[i, ki])
+    arm = np.array([root(i) for i in range(n)])
+    arms = {}  # root: [length, [end components]]
+    for i in range(n):
+        a = arms.setdefault(arm[i], [0.0, []])
+        a[0] += lengths[i]
+        a[1] += [c for c, joined in zip(ports[i].tolist(), inner[i].tolist()) if not joined]
+    for i, length in extra.values():
+        arms[arm[i]][0] += length
+    return arm, {a: (length, tuple(sorted(c)) if len(c) == 2 and min(c) >= 0 and c[0] != c[1] else None)
+                 for a, (length, c) in arms.items()}
+
+
+def mzi_arms(rows):
+    '''
+    The arms of the MZIs: {opt_in label: (length, length)}, the two arms between the same two components
+    with the largest length difference. The arms are chained over the whole layout, and the pair of
+    components is given to the label of most of their waveguides: the nearest label may miss parts of the arms
+    '''
+    arms, votes = {}, {}
+    for r in rows:
+        if r['arm_ends']:
+            arms.setdefault(r['arm_ends'], {})[r['arm']] = r['arm_length']
+            if r['opt_in']:
+                label_votes = votes.setdefault(r['arm_ends'], {})
+                label_votes[r['opt_in']] = label_votes.get(r['opt_in'], 0) + 1
+    out = {}
+    for ends, lengths in arms.items():
+        if len(lengths) < 2 or ends not in votes:
+            continue
+        label = max(votes[ends], key=votes[ends].get)
+        best = out.get(label)
+        if max(lengths.values()) > min(lengths.values()) and (best is None or
+                max(lengths.values()) - min(lengths.values()) > best[1] - best[0]):
+            out[label] = (min(lengths.values()), max(lengths.values()))
+    return out
+
+
+def device_table(rows, labels):
+    '''One row per opt_in device, with the lengths of its waveguides, and the FSR estimate of the MZIs'''
+    index = LabelIndex([(label, None, None, '') for label in labels])
+    devices = {}
+    for r in rows:
+        if r['opt_in']:
+            devices.setdefault(r['opt_in'], []).append(r)
+    arms = mzi_arms(rows)
+    out = []
+    for label, members in sorted(devices.items()):
+        lengths = np.array([r['length'] for r in members])
+        record = index.records.get(label, {})
+        row = {'opt_in': label, 'type': record.get('type', ''), 'waveguides': len(members),
+               'length_total': lengths.sum(), 'length_longest': lengths.max(), 'delta_length': None, 'FSR': None}
+        if 'mzi' in row['type'].lower() and label in arms:
+            wavelength = record['wavelength']
+            row['delta_length'] = arms[label][1] - arms[label][0]
+            ng = group_index.get(wavelength, group_index[1550])
+            row['FSR'] = wavelength ** 2 / (ng * row['delta_length'] * 1e3)
+        out.append(row)
+    return out
+
+
+def write_csv(filename, rows, columns):
+    with open(filename, 'w', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(columns)
+        for r in rows:
+            w.writerow(['%.4f' % r[c] if isinstance(r[c], (float, np.floating)) else ('' if r[c] is None else r[c]) for c in columns])
+
+
+if __name__ == '__main__':
+    import pya
+    parser = argparse.ArgumentParser(description='Waveguide lengths and bends, with the nearest opt_in device')
+    parser.add_argument('layout', nargs='?', default=os.path.join(path, 'merge', 'EBeam.oas'), help='merged layout, or a submission')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    layout = pya.Layout()
+    layout.read(args.layout)
+    top_cells = layout.top_cells()
+    cell = top_cells[0]
+    for c in top_cells:
+        if c.name.lower() == 'top':
+            cell = c
+    # a submission file, rather than the merged chip with its course cells
+    merged = any(inst.cell.name in course_cells for inst in cell.each_inst())
+    rows = waveguide_table(layout, cell, None if merged else os.path.basename(args.layout))
+    devices = device_table(rows, {r['opt_in'] for r in rows if r['opt_in']})
+
+    filename = os.path.splitext(args.layout)[0]
+    write_csv(filename + '_waveguides.csv', rows,
+              ['cell', 'submission', 'opt_in', 'distance', 'length', 'length_siepic', 'length_arcs', 'length_path',
+               'points', 'bends', 'turn', 'radius', 'too_close', 'x1', 'y1', 'x2', 'y2'])
+    write_csv(filename + '_waveguides_devices.csv', devices,
+              ['opt_in', 'type', 'waveguides', 'length_total', 'length_longest', 'delta_length', 'FSR'])
+
+    print('Waveguides: %s, total length: %.1f mm, bends: %s, segments too short for the bends: %s' % (
+        len(rows), sum(r['length'] for r in rows) / 1e3, sum(r['bends'] for r in rows), sum(r['too_close'] for r in rows)))
+    print('Devices: %s, MZI with an FSR estimate: %s' % (len(devices), sum(1 for d in devices if d['FSR'])))
+    print('Output: %s_waveguides.csv, %s_waveguides_devices.csv' % (filename, filename))
+    print('Time: %.1f seconds' % (time.time() - start_time))
+
+    # Print the number of waveguides to standard output
+    print(len(rows))